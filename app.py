@@ -1,18 +1,23 @@
 import streamlit as st
 from datetime import datetime, date
-from PIL import Image as PILImage
-import numpy as np
-# import io
-from docx import Document
-from docx.shared import Inches
 from streamlit_drawable_canvas import st_canvas
-import smtplib
-from email.message import EmailMessage
-import shutil
 import re
 import time
-from dotenv import load_dotenv
-import os
+from submissions import submit_enrollment, get_job, release_job, DONE, FAILED, SIGNATURE_BUFFER
+from workspace import Workspace
+from signature import process_signature, analyse_signature
+from outbox import start_dispatcher
+from metrics import start_metrics_server, track_step, track_completed
+from assets import image_bytes, picture_html, preload_resources
+import assets
+from w5_export import spool_submission
+from telemetry import configure_logging, get_logger
+from placeholders import build_placeholder_values, document_file_name, calculate_age, validate_template, TEMPLATE_FILE
+from form_schema import init_session_state
+from drafts import resume, save_on_step_change, discard, record_submission, reopen, RESUME_PARAM, TOKEN_KEY
+from uploads import UploadError, UPLOAD_EXTENSIONS, UPLOAD_MAX_FILES, UPLOAD_MAX_BYTES, UPLOAD_ERRORS_KEY
+from streamlit.runtime import Runtime
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 
 # Set page configuration with a favicon
 st.set_page_config(
@@ -21,44 +26,41 @@ st.set_page_config(
     layout="centered"  # "centered" or "wide"
 )
 
+configure_logging()
+logger = get_logger('app')
+
 # add render support along with st.secret
 def get_secret(key):
-    try:
-        load_dotenv()
-        # Attempt to get the secret from environment variables
-        secret = os.environ.get(key)
-        if secret is None:
-            raise ValueError("Secret not found in environment variables")
-        return secret
-    except (ValueError, TypeError) as e:
-        # If an error occurs, fall back to Streamlit secrets
-        if hasattr(st, 'secrets'):
-            return st.secrets.get(key)
-        # If still not found, return None or handle as needed
-        return None
-
-# Initialize session state
-if 'step' not in st.session_state: st.session_state.step = 1
-if 'submission_done' not in st.session_state: st.session_state.submission_done = False
-if 'selected_option' not in st.session_state: st.session_state.selected_option = "    "  # Default value for the dropdown
-if 'hear_about' not in st.session_state: st.session_state.hear_about = "Self-referral"  # Default value for the dropdown
-if 'hother_source' not in st.session_state: st.session_state.hother_source = ''  # Default for the "Other" text input
-# Initialize session state for Step 2
-if 'title' not in st.session_state: st.session_state.title = "Mr"  # Default title
-if 'sir_name' not in st.session_state: st.session_state.sir_name = ''  # Default surname
-if 'first_name' not in st.session_state: st.session_state.first_name = ''  # Default first name
-if 'preferred_name' not in st.session_state: st.session_state.preferred_name = ''  # Default preferred name
-if 'previous_name' not in st.session_state: st.session_state.previous_name = ''  # Default previous name
-if 'home_address' not in st.session_state: st.session_state.home_address = ''  # Default home address
-if 'postcode' not in st.session_state: st.session_state.postcode = ''  # Default postcode
-if 'previous_postcode_country' not in st.session_state: st.session_state.previous_postcode_country = ''  # Default previous postcode or country
-if 'dob' not in st.session_state: st.session_state.dob = None
-if 'ni_number' not in st.session_state: st.session_state.ni_number = ''  # Default National Insurance number
-if 'gender' not in st.session_state: st.session_state.gender = "Male"  # Default gender
-if 'home_number' not in st.session_state: st.session_state.home_number = ''  # Default home phone number
-if 'mobile_number' not in st.session_state: st.session_state.mobile_number = ''  # Default mobile number
-if 'email' not in st.session_state: st.session_state.email = ''  # Default email
-# Initialize session state for Step 3
+    # Environment / .env first, then st.secrets; resolved once per process and again only if .env changes
+    return assets.get_secret(key, fallback=st.secrets.get)
+
+# Start the outbox dispatcher once per session so emails queued before a restart are delivered
+if 'outbox_started' not in st.session_state:
+    start_dispatcher(get_secret("sender_email"), get_secret("sender_password"))
+    start_metrics_server()
+    preload_resources()
+    st.session_state.outbox_started = True
+
+# Report template placeholders that don't match the form fields (checked once per process)
+validate_template(TEMPLATE_FILE)
+
+# Opened from a resume link: load the saved draft into the new session before any defaults are set
+if TOKEN_KEY not in st.session_state and RESUME_PARAM in st.query_params:
+    if not resume(st.session_state, st.query_params[RESUME_PARAM]):
+        del st.query_params[RESUME_PARAM]  # unknown or expired
+        st.session_state[TOKEN_KEY] = None
+
+# Initialize session state: the field schema materialises each step's defaults the first time
+# the session reaches that step, so reruns within a step do no initialisation work
+init_session_state(st.session_state)
+track_step(st.session_state.session_id, st.session_state.step)
+
+# Save the step just left to the draft, and keep its resume token in the URL so a refresh or a
+# reconnect picks the form up where it was
+if save_on_step_change(st.session_state) and st.query_params.get(RESUME_PARAM) != st.session_state[TOKEN_KEY]:
+    st.query_params[RESUME_PARAM] = st.session_state[TOKEN_KEY]
+
+# Ethnicity drop-downs for Step 3
 ethnicity_options = {
     'White': {
         'English/ Welsh/ Scottish/ N Irish/ British': '31',
@@ -89,78 +91,15 @@ ethnicity_options = {
         'Any other ethnic group': '48'
     }
 }
-if 'ethnicity_category' not in st.session_state: st.session_state.ethnicity_category = list(ethnicity_options.keys())[0]  # Default to first category
-# Initialize ethnicity only if ethnicity_category is already defined
-if 'ethnicity' not in st.session_state: st.session_state.ethnicity = list(ethnicity_options[st.session_state.ethnicity_category].keys())[0]  # Default to first ethnicity in the default category
-if 'ethnicity_code' not in st.session_state: st.session_state.ethnicity_code = 31  # Default to first code
-if 'ethnicity_vars' not in st.session_state: st.session_state.ethnicity_vars = {f'ethnicity_{i}': '' for i in range(31, 49)}  # Initialize all ethnicity variables
-if 'ph59' not in st.session_state: st.session_state.ph59 = ''  # Default for criminal conviction
-if 'ph60' not in st.session_state: st.session_state.ph60 = ''  # Default for criminal conviction
-if 'criminal_conviction' not in st.session_state: st.session_state.criminal_conviction = "No"  # Default for criminal conviction radio
-if 'ph61' not in st.session_state: st.session_state.ph61 = ''  # Default for caring for children
-if 'ph62' not in st.session_state: st.session_state.ph62 = ''  # Default for caring for children
-if 'caring_children' not in st.session_state: st.session_state.caring_children = "No"  # Default for caring for children radio
-# Initialize session state for Step 4
-if 'emergency_contact_name' not in st.session_state: st.session_state.emergency_contact_name = ''  # Default for emergency contact name
-if 'emergency_contact_relationship' not in st.session_state: st.session_state.emergency_contact_relationship = ''  # Default for emergency contact relationship
-if 'emergency_contact_phone' not in st.session_state: st.session_state.emergency_contact_phone = ''  # Default for emergency contact mobile number
-if 'home_tel_no' not in st.session_state: st.session_state.home_tel_no = ''  # Default for emergency contact home telephone number
-# Initialize session state for Step 5
-if 'ph63' not in st.session_state: st.session_state.ph63 = ''  # Entry Level
-if 'ph64' not in st.session_state: st.session_state.ph64 = ''  # Qualifications below Level 1
-if 'ph65' not in st.session_state: st.session_state.ph65 = ''  # Level 1
-if 'ph66' not in st.session_state: st.session_state.ph66 = ''  # Full Level 2
-if 'ph67' not in st.session_state: st.session_state.ph67 = ''  # Full Level 3
-if 'ph68' not in st.session_state: st.session_state.ph68 = ''  # Level 4
-if 'ph69' not in st.session_state: st.session_state.ph69 = ''  # Level 5
-if 'ph70' not in st.session_state: st.session_state.ph70 = ''  # Level 6
-if 'ph71' not in st.session_state: st.session_state.ph71 = ''  # Level 7 or above
-if 'ph72' not in st.session_state: st.session_state.ph72 = ''  # Other qualification
-if 'ph73' not in st.session_state: st.session_state.ph73 = ''  # No qualifications
-if 'ph74' not in st.session_state: st.session_state.ph74 = ''  # Not known
-# Initialize session state for Step 6
-for i in range(75, 84):
-    if f'ph{i}' not in st.session_state: st.session_state[f'ph{i}'] = ''  # Initialize placeholders for employment status options
-# Additional placeholders for employment details
-if 'ph79a' not in st.session_state: st.session_state.ph79a = ''  # 0 – 10 Hours (Self-employed)
-if 'ph79b' not in st.session_state: st.session_state.ph79b = ''  # 11 – 20 Hours (Self-employed)
-if 'ph79c' not in st.session_state: st.session_state.ph79c = ''  # 21 – 30 Hours (Self-employed)
-if 'ph79d' not in st.session_state: st.session_state.ph79d = ''  # 31+ Hours (Self-employed)
-# Initialize placeholders for other options
-for i in range(83, 88):
-    if f'ph{i}' not in st.session_state: st.session_state[f'ph{i}'] = ''  # Unemployment duration options
-for i in range(88, 93):
-    if f'ph{i}' not in st.session_state: st.session_state[f'ph{i}'] = ''  # Benefit options
-for i in range(93, 96):
-    if f'ph{i}' not in st.session_state: st.session_state[f'ph{i}'] = ''  # Employer details
-if 'ph96' not in st.session_state: st.session_state.ph96 = 0.0
-if 'ph97y' not in st.session_state: st.session_state.ph97y = ''  # Attending Bootcamp via Employer (Yes/No)
-if 'ph97n' not in st.session_state: st.session_state.ph97n = ''  # Attending Bootcamp via Employer (Yes/No)
-for i in range(98, 102):
-    if f'ph{i}' not in st.session_state: st.session_state[f'ph{i}'] = ''  # Work alongside bootcamp options
-for i in range(102, 112):
-    if f'ph{i}' not in st.session_state: st.session_state[f'ph{i}'] = ''  # Most recent occupation options
-for i in range(112, 121):
-    if f'ph{i}' not in st.session_state: st.session_state[f'ph{i}'] = ''  # Industry/sector options
-if 'ph120a' not in st.session_state: st.session_state.ph120a = ''  # Other services (Specify)
-# Initialize session state for Step 7
-for i in range(121, 147):
-    if f'ph{i}' not in st.session_state: st.session_state[f'ph{i}'] = ''  # Initialize placeholders for disabilities, learning difficulties, and health problems
-if 'ph123a' not in st.session_state: st.session_state.ph123a = ''  # Other Specify
-if 'impactful_condition' not in st.session_state: st.session_state.impactful_condition = ''  # Default for most impactful condition
-if 'confidential_interview' not in st.session_state: st.session_state.confidential_interview = ''  # Default for confidential interview request
-# Initialize session state for Step 8
-for i in range(147, 154):
-    if f'ph{i}' not in st.session_state: st.session_state[f'ph{i}'] = ''  # Initialize placeholders for contact and marketing information
-if 'other_source' not in st.session_state: st.session_state.other_source = ''  # Default for other source specification
-# Initialize session state for Step 9
-for i in range(154, 160):
-    if f'ph{i}' not in st.session_state: st.session_state[f'ph{i}'] = ''  # Initialize placeholders for learner declaration and commitment
 
 
 
 def last():
+    # The metrics session survives: the rerun after submitting (e.g. the download click) isn't a new enrollment
+    session_id = st.session_state.get('session_id')
     st.session_state.clear()
+    if session_id is not None:
+        st.session_state.session_id = session_id
 
 def is_valid_email(email):
     # Comprehensive regex for email validation
@@ -178,197 +117,23 @@ def is_valid_email(email):
     # Match the entire email against the pattern
     return re.match(pattern, email, re.VERBOSE) is not None
 
-# Function to send email with attachments (Handle Local + Uploaded)
-def send_email_with_attachments(sender_email, sender_password, receiver_email, subject, body, files=None, local_file_path=None):
-    msg = EmailMessage()
-    msg['From'] = sender_email
-    msg['To'] = ", ".join(receiver_email)
-    msg['Subject'] = subject
-    msg.set_content(body, subtype='html')
-
-    # Attach uploaded files
-    if files:
-        for uploaded_file in files:
-            uploaded_file.seek(0)  # Move to the beginning of the UploadedFile
-            msg.add_attachment(uploaded_file.read(), maintype='application', subtype='octet-stream', filename=uploaded_file.name)
-
-    # Attach local file if specified
-    if local_file_path:
-        with open(local_file_path, 'rb') as f:
-            file_data = f.read()
-            file_name = local_file_path.split('/')[-1]
-            msg.add_attachment(file_data, maintype='application', subtype='octet-stream', filename=file_name)
-
-    # Use the SMTP server for sending the email
-    with smtplib.SMTP('smtp.office365.com', 587) as server:
-        server.starttls()
-        server.login(sender_email, sender_password)
-        server.send_message(msg)
-
-def is_signature_drawn(signature):
-    # Check if signature is None or an empty numpy array
-    if signature is None:
-        return False
-    # Ensure it is a numpy array and has content
-    if isinstance(signature, np.ndarray) and signature.size > 0:
-        # Additional check: if the array is not just empty white pixels
-        # Assuming white background is [255, 255, 255] in RGB
-        if np.all(signature == 255):
-            return False
-        return True
-    return False
-
-def resize_image_to_fit_cell(image, max_width, max_height):
-    width, height = image.size
-    aspect_ratio = width / height
-
-    if width > max_width:
-        width = max_width
-        height = int(width / aspect_ratio)
-
-    if height > max_height:
-        height = max_height
-        width = int(height * aspect_ratio)
-
-    return image.resize((width, height))
-
-
-def replace_placeholders(template_file, modified_file, placeholder_values, signature_path):
-    try:
-        print(f"Copying template file '{template_file}' to '{modified_file}'...")
-        shutil.copy(template_file, modified_file)
-
-        print(f"Opening document '{modified_file}'...")
-        doc = Document(modified_file)
-
-        # Function to convert value to string, handling datetime.date objects
-        def convert_to_str(value):
-            if isinstance(value, date):
-                return value.strftime('%Y-%m-%d')  # Convert date to string
-            return str(value)  # Convert other types to string
-
-        # Compile regular expressions for all placeholders
-        placeholders = {re.escape(key): convert_to_str(value) for key, value in placeholder_values.items()}
-        placeholders_pattern = re.compile(r'\b(' + '|'.join(placeholders.keys()) + r')\b')
-
-        # Replace placeholders in paragraphs
-        print("Replacing placeholders in paragraphs...")
-        for para in doc.paragraphs:
-            original_text = para.text
-            updated_text = placeholders_pattern.sub(lambda match: placeholders[re.escape(match.group(0))], para.text)
-            if original_text != updated_text:
-                print(f"Updated paragraph text: '{original_text}' -> '{updated_text}'")
-                para.text = updated_text
-
-        # Replace placeholders in tables
-        print("Replacing placeholders in tables...")
-        for table in doc.tables:
-            for row in table.rows:
-                for cell in row.cells:
-                    for para in cell.paragraphs:
-                        original_text = para.text
-                        updated_text = placeholders_pattern.sub(lambda match: placeholders[re.escape(match.group(0))], para.text)
-                        if original_text != updated_text:
-                            print(f"Updated table cell text: '{original_text}' -> '{updated_text}'")
-                            para.text = updated_text
-
-                    # Inspect cell runs
-                    for para in cell.paragraphs:
-                        for run in para.runs:
-                            run_text = run.text
-                            run_updated_text = placeholders_pattern.sub(lambda match: placeholders[re.escape(match.group(0))], run_text)
-                            if run_text != run_updated_text:
-                                print(f"Updated run text in table cell: '{run_text}' -> '{run_updated_text}'")
-                                run.text = run_updated_text
-
-        # Check and handle signature placeholder
-        print("Inspecting document for 'ph_signature' placeholder...")
-        signature_placeholder_found = False
-
-        # Check paragraphs
-        for para in doc.paragraphs:
-            para_text = para.text.strip()  # Remove any extra spaces around text
-            while 'ph_signature' in para_text:
-                print(f"Found 'ph_signature' in paragraph: '{para_text}'")
-                para_text = para_text.replace('ph_signature', '').strip()  # Remove 'ph_signature' and any leading/trailing spaces
-                para.text = para_text
-                resized_image_path = 'resized_signature_image.png'
-                
-                try:
-                    # Open and resize the image
-                    print(f"Opening image file: {signature_path}")
-                    resized_image = PILImage.open(signature_path)
-                    print(f"Original image size: {resized_image.size}")
-                    resized_image = resize_image_to_fit_cell(resized_image, 200, 50)
-                    resized_image.save(resized_image_path)  # Save resized image to a file
-                    print(f"Resized image saved to: {resized_image_path}")
-                    
-                    # Add picture to the paragraph
-                    print(f"Adding picture to paragraph from path: {resized_image_path}")
-                    para.add_run().add_picture(resized_image_path, width=Inches(2))
-                    print("Inserted signature image into paragraph.")
-                    signature_placeholder_found = True
-                except Exception as img_e:
-                    print(f"An error occurred with image processing: {img_e}")
-
-        # Check table cells again in case the placeholder was missed
-        if not signature_placeholder_found:
-            print("Checking table cells for 'ph_signature'...")
-            for table in doc.tables:
-                for row in table.rows:
-                    for cell in row.cells:
-                        for para in cell.paragraphs:
-                            para_text = para.text.strip()
-                            while 'ph_signature' in para_text:
-                                print(f"Found 'ph_signature' in table cell paragraph: '{para_text}'")
-                                para_text = para_text.replace('ph_signature', '').strip()
-                                para.text = para_text
-                                resized_image_path = 'resized_signature_image.png'
-                                
-                                try:
-                                    # Open and resize the image
-                                    print(f"Opening image file: {signature_path}")
-                                    resized_image = PILImage.open(signature_path)
-                                    print(f"Original image size: {resized_image.size}")
-                                    resized_image = resize_image_to_fit_cell(resized_image, 200, 50)
-                                    resized_image.save(resized_image_path)  # Save resized image to a file
-                                    print(f"Resized image saved to: {resized_image_path}")
-                                    
-                                    # Add picture to the table cell
-                                    print(f"Adding picture to table cell from path: {resized_image_path}")
-                                    para.add_run().add_picture(resized_image_path, width=Inches(2))
-                                    print("Inserted signature image into table cell.")
-                                    signature_placeholder_found = True
-                                except Exception as img_e:
-                                    print(f"An error occurred with image processing: {img_e}")
-
-        if not signature_placeholder_found:
-            print("No signature placeholder found.")
-
-        # Save the modified document
-        print(f"Saving modified document '{modified_file}'...")
-        doc.save(modified_file)
-        print(f"Document modification complete: '{modified_file}'")
-
-    except Exception as e:
-        print(f"An error occurred: {e}")
-
-    # file download button
-    with open(modified_file, 'rb') as f:
-        file_contents = f.read()
-        st.download_button(
-            label="Download Your Response",
-            data=file_contents,
-            file_name=modified_file,
-            mime='application/vnd.openxmlformats-officedocument.wordprocessingml.document'
-        )
+def show_image(path, alt=''):
+    # Content-hashed WebP/PNG from static/ (tools/build_assets.py) when built, otherwise the cached source image
+    html = picture_html(path, alt)
+    if html:
+        st.markdown(html, unsafe_allow_html=True)
+    else:
+        st.image(image_bytes(path), use_column_width=True)
 
-def calculate_age(born):
-    today = date.today()
-    return today.year - born.year - ((today.month, today.day) < (born.month, born.day))
+def release_upload(uploaded_file):
+    # Streamlit keeps every upload in memory until the session ends; once spooled to disk it isn't needed
+    ctx = get_script_run_ctx()
+    if ctx is not None and Runtime.exists():
+        Runtime.instance().uploaded_file_mgr.remove_file(ctx.session_id, uploaded_file.file_id)
 
-if 'files' not in st.session_state:
-    st.session_state.files = []
+def is_signature_drawn(signature):
+    # Enough ink on the canvas to count as a signature; a transparent empty canvas or a stray tap is not
+    return analyse_signature(signature).drawn
 
 # Define a function to calculate progress and percentage
 def get_progress(step, total_steps=14):
@@ -378,19 +143,21 @@ def get_progress(step, total_steps=14):
 
 
 # Define the total number of steps
-total_steps = 10
+total_steps = 11
 # Calculate the current progress
 progress = get_progress(st.session_state.step, total_steps)
 # Display the progress bar and percentage
 st.write(f"Progress: {progress}%")
 st.progress(progress)
+if st.session_state.get(TOKEN_KEY) and not st.session_state.submission_done:
+    st.caption("Your answers are saved as you go. Bookmark this page to carry on later.")
 
 
 
 
 # Define different steps
 if st.session_state.step == 1:
-    st.image('resources/header-wihout-bg.png', use_column_width=True)
+    show_image('resources/header-wihout-bg.png', "Skills Bootcamp")
 
     st.title("Skills Bootcamp Enrollment and Registration Document")
     st.write("Provider: Prevista Ltd. | Sponsor: Surrey County Council | Website: www.prevista.co.uk")
@@ -562,9 +329,6 @@ elif st.session_state.step == 2:
 elif st.session_state.step == 3:
     st.title("> 2: Please indicate your ethnic group")
 
-    # Initialize ethnicity_vars if it doesn't exist
-    if 'ethnicity_vars' not in st.session_state:
-        st.session_state.ethnicity_vars = {f'ethnicity_{i}': '' for i in range(31, 49)}
 
     # Select ethnicity category
     st.session_state.ethnicity_category = st.selectbox(
@@ -744,7 +508,6 @@ elif st.session_state.step == 6:
     st.title("> 5: Employment Information")
 
     # Initialize placeholders for employment status options
-    st.session_state.update({f'ph{i}': st.session_state.get(f'ph{i}', '') for i in range(75, 122)})  # Make sure all relevant placeholders are initialized
 
     # Define radio button options and corresponding placeholders
     employment_options = {
@@ -992,9 +755,6 @@ elif st.session_state.step == 7:
     st.title("> 6: Disability, Learning Difficulty and/or Health Problem")
 
     # Initialize placeholders for conditions
-    st.session_state.update({f'ph{i}': st.session_state.get(f'ph{i}', '') for i in range(121, 147)})
-    st.session_state.impactful_condition = st.session_state.get('impactful_condition', '')  # Most impactful condition
-    st.session_state.confidential_interview = st.session_state.get('confidential_interview', '')  # Confidential interview request
     
     # Radio button for initial question
     difficulty_options = ["No", "Yes", "Other"]
@@ -1187,8 +947,6 @@ elif st.session_state.step == 8:
     st.title("> 7: Contact and Marketing Information")
 
     # Initialize placeholders
-    st.session_state.update({f'ph{i}': st.session_state.get(f'ph{i}', '') for i in range(147, 154)})
-    st.session_state.other_source = st.session_state.get('other_source', '')  # Default for other source specification
 
     # Question: How did you hear about us?
     st.text("How did you hear about us?")
@@ -1260,10 +1018,57 @@ elif st.session_state.step == 8:
 
 
 elif st.session_state.step == 9:
-    st.title("> 8: Learner Declaration and Commitment")
+    st.title("> 8: Supporting Documents")
+
+    st.write("Please upload a photo or scan of your ID and any evidence documents (for example proof of address or qualifications).")
+    st.caption(f"PDF, Word documents or photos, up to {UPLOAD_MAX_FILES} files of {UPLOAD_MAX_BYTES // (1024 * 1024)} MB each. "
+               "Photos taken with your phone are fine. You can also skip this step and send them to us later.")
+
+    spool = st.session_state.files
+    # A fresh key after every batch empties the widget: the files live in the spool from then on
+    uploaded_files = st.file_uploader("Supporting documents", type=UPLOAD_EXTENSIONS, accept_multiple_files=True,
+                                      key=f'upload_{spool.generation}')
+    if uploaded_files:
+        upload_errors = []
+        for uploaded_file in uploaded_files:
+            try:
+                spool.add(uploaded_file)
+            except UploadError as e:
+                upload_errors.append(str(e))
+            release_upload(uploaded_file)
+        st.session_state[UPLOAD_ERRORS_KEY] = upload_errors
+        st.experimental_rerun()
+
+    for message in st.session_state.pop(UPLOAD_ERRORS_KEY, ()):
+        st.warning(message)
+
+    # Files received so far
+    for index, attachment in enumerate(spool.files):
+        name_col, remove_col = st.columns([4, 1])
+        name_col.write(f"{attachment.file_name} ({max(attachment.size // 1024, 1):,} KB)")
+        if remove_col.button("Remove", key=f'remove_upload_{spool.generation}_{index}'):
+            spool.remove(index)
+            st.experimental_rerun()
+
+    # Navigation buttons
+    next_clicked = st.button("Next")
+    back_clicked = st.button("Back")
+
+    # Handle Next button click
+    if next_clicked:
+        st.session_state.step = 10
+        st.experimental_rerun()
+
+    # Handle Back button click
+    if back_clicked:
+        st.session_state.step = 8  # Go back to the previous step (Section 7)
+        st.experimental_rerun()
+
+
+elif st.session_state.step == 10:
+    st.title("> 9: Learner Declaration and Commitment")
     
     # Initialize placeholders
-    st.session_state.update({f'ph{i}': st.session_state.get(f'ph{i}', '') for i in range(154, 160)})
 
     # Agreement and Confirmation Section
     st.subheader("Agreement and Confirmation")
@@ -1342,7 +1147,7 @@ elif st.session_state.step == 9:
             time.sleep(1)
 
             st.session_state.submission_done = True
-            st.session_state.step = 10
+            st.session_state.step = 11
             st.experimental_rerun()
         else:
             st.warning("Please provide your signature before submitting.")
@@ -1356,11 +1161,11 @@ elif st.session_state.step == 9:
 
     # Handle Back button click
     if back_clicked:
-        st.session_state.step = 8  # Go back to the previous step
+        st.session_state.step = 9  # Go back to the previous step
         st.experimental_rerun()
 #11111111111111111
 
-elif st.session_state.step == 10:
+elif st.session_state.step == 11:
     st.info('Still Processing. . . .', icon="ℹ️")
     time.sleep(1)
 
@@ -1368,194 +1173,25 @@ elif st.session_state.step == 10:
 # ####################################################################################################################################
 
 with st.spinner('Wait for it...'):
-    # Generate and save the document if form is submitted
-    if st.session_state.submission_done:
+    # Accept the submission once; document generation and emails run on a background worker
+    if st.session_state.submission_done and 'job_id' not in st.session_state:
         # FILL TEMPLATE:
-        placeholder_values = {
-            'ph7': st.session_state.title,
-            'ph1': st.session_state.first_name,
-            'ph2': st.session_state.sir_name,
-            'ph8': st.session_state.preferred_name,
-            'ph9': st.session_state.previous_name,
-            'ph55': st.session_state.home_address,
-            'ph4': st.session_state.postcode,
-            'ph56': st.session_state.previous_postcode_country,
-            'ph34': st.session_state.dob.strftime("%d-%m-%Y"),
-            
-            'ph57': st.session_state.current_age,
-            'ph3': st.session_state.ni_number,
-            'ph58': st.session_state.home_number,
-            'ph6': st.session_state.mobile_number,
-            'ph5': st.session_state.email,
-
-            'ph219': st.session_state.ethnicity_vars['ethnicity_31'],
-            'ph220': st.session_state.ethnicity_vars['ethnicity_32'],
-            'ph221': st.session_state.ethnicity_vars['ethnicity_33'],
-            'ph222': st.session_state.ethnicity_vars['ethnicity_34'],
-            'ph223': st.session_state.ethnicity_vars['ethnicity_35'],
-            'ph224': st.session_state.ethnicity_vars['ethnicity_36'],
-            'ph225': st.session_state.ethnicity_vars['ethnicity_37'],
-            'ph226': st.session_state.ethnicity_vars['ethnicity_38'],
-            'ph227': st.session_state.ethnicity_vars['ethnicity_39'],
-            'ph228': st.session_state.ethnicity_vars['ethnicity_40'],
-            'ph229': st.session_state.ethnicity_vars['ethnicity_41'],
-            'ph230': st.session_state.ethnicity_vars['ethnicity_42'],
-            'ph231': st.session_state.ethnicity_vars['ethnicity_43'],
-            'ph232': st.session_state.ethnicity_vars['ethnicity_44'],
-            'ph233': st.session_state.ethnicity_vars['ethnicity_45'],
-            'ph234': st.session_state.ethnicity_vars['ethnicity_46'],
-            'ph235': st.session_state.ethnicity_vars['ethnicity_47'],
-            'ph236': st.session_state.ethnicity_vars['ethnicity_48'],
-            'ph59': st.session_state.ph59,
-            'ph60': st.session_state.ph60,
-            'ph61': st.session_state.ph61,
-            'ph62': st.session_state.ph62,
-            # 'ph10': st.session_state.highest_education,
-            # 'ph11': st.session_state.institution_name,
-            # 'ph12': st.session_state.year_of_completion,
-            # 'ph13': st.session_state.completed_level_6_or_above,
-            # 'ph14': st.session_state.subject,
-            # 'ph15': st.session_state.date_applied,
-            # 'ph16': st.session_state.placeholder_16,
-            # 'ph17': st.session_state.placeholder_17,
-            # 'ph18': st.session_state.placeholder_18,
-            # 'ph19': st.session_state.placeholder_19,
-            'ph40': st.session_state.emergency_contact_name,
-            'ph41': st.session_state.emergency_contact_relationship,
-            'ph42': st.session_state.emergency_contact_phone,
-            'ph43': st.session_state.home_tel_no,
-
-            'ph63': st.session_state.ph63,
-            'ph64': st.session_state.ph64,
-            'ph65': st.session_state.ph65,
-            'ph66': st.session_state.ph66,
-            'ph67': st.session_state.ph67,
-            'ph68': st.session_state.ph68,
-            'ph69': st.session_state.ph69,
-            'ph70': st.session_state.ph70,
-            'ph71': st.session_state.ph71,
-            'ph72': st.session_state.ph72,
-            'ph73': st.session_state.ph73,
-            'ph74': st.session_state.ph74,        
-
-            'ph75': st.session_state.ph75,
-            'ph76': st.session_state.ph76,
-            'ph77': st.session_state.ph77,
-            'ph78': st.session_state.ph78,
-            'ph79a': st.session_state.ph79a,
-            'ph79b': st.session_state.ph79b,
-            'ph79c': st.session_state.ph79c,
-            'ph79d': st.session_state.ph79d,
-            'ph80': st.session_state.ph80,
-            'ph81': st.session_state.ph81,
-            'ph82': st.session_state.ph82,
-
-            'ph83': st.session_state.ph83,  # Less than 6 months
-            'ph84': st.session_state.ph84,  # 6-11 months
-            'ph85': st.session_state.ph85,  # 12-23 months
-            'ph86': st.session_state.ph86,  # 24-35 months
-            'ph87': st.session_state.ph87,   # 36 months or over
-
-            'ph88': st.session_state.ph88,  # In receipt of JSA
-            'ph89': st.session_state.ph89,  # In receipt of ESA (Part of WRAG group)
-            'ph90': st.session_state.ph90,  # In receipt of Universal Credit
-            'ph91': st.session_state.ph91,  # In receipt of another State Benefit
-            'ph92': st.session_state.ph92,   # None
-
-            'ph93': st.session_state.ph93,  # Name of Employer
-            'ph94': st.session_state.ph94,  # Postcode
-            'ph95': st.session_state.ph95,  # Current Job Role
-            'ph96': st.session_state.ph96,  # Current Hourly Rate
-            'ph97y': st.session_state.ph97y,   # Attending Bootcamp via Employer (Yes/No)
-            'ph97n': st.session_state.ph97n,   # Attending Bootcamp via Employer (Yes/No)
-
-            'ph98': st.session_state.ph98,  # Yes (Full-time employment)
-            'ph99': st.session_state.ph99,  # Yes (Part-time employed)
-            'ph100': st.session_state.ph100,  # Yes (Self-employed)
-            'ph101': st.session_state.ph101,  # No
-
-            'ph102': st.session_state.ph102,  # Major Group
-            'ph103': st.session_state.ph103,  # Managers, directors and senior officials
-            'ph104': st.session_state.ph104,  # Professional occupations
-            'ph105': st.session_state.ph105,  # Associate professional and technical occupations
-            'ph106': st.session_state.ph106,  # Administrative and secretarial occupations
-            'ph107': st.session_state.ph107,  # Skilled trades occupations
-            'ph108': st.session_state.ph108,  # Caring, leisure and other service occupations
-            'ph109': st.session_state.ph109,  # Sales and customer service occupations
-            'ph110': st.session_state.ph110,  # Process, plant and machine operatives
-            'ph111': st.session_state.ph111,   # Elementary occupations
-
-            'ph112': st.session_state.ph112,  # Agriculture / forestry / fishing
-            'ph113': st.session_state.ph113,  # Distribution / hotels / restaurants
-            'ph114': st.session_state.ph114,  # Public admin / education / health
-            'ph115': st.session_state.ph115,  # Banking / finance
-            'ph116': st.session_state.ph116,  # Energy / water
-            'ph117': st.session_state.ph117,  # Transport / communication
-            'ph118': st.session_state.ph118,  # Construction
-            'ph119': st.session_state.ph119,  # Manufacturing
-            'ph120': st.session_state.ph120,   # Other services (Please specify below)
-            'ph120a': st.session_state.ph120a,   # Other services (Specifiy)
-
-            'ph121': st.session_state.ph121,  # No
-            'ph122': st.session_state.ph122,  # Yes
-            'ph123': st.session_state.ph123,  # Other
-            'ph123a': st.session_state.ph123a,  # Other Specify
-            'ph124': st.session_state.ph124,  # Epilepsy
-            'ph125': st.session_state.ph125,  # Hearing Impairment
-            'ph126': st.session_state.ph126,  # Diagnosed mental health condition
-            'ph127': st.session_state.ph127,  # Moderate Learning Difficulty
-            'ph128': st.session_state.ph128,  # Physical Disability
-            'ph129': st.session_state.ph129,  # Other Specific Learning Difficulty (e.g. Dyspraxia)
-            'ph130': st.session_state.ph130,  # Profound/Complex Disabilities
-            'ph131': st.session_state.ph131,  # Severe Learning Difficulty
-            'ph132': st.session_state.ph132,  # Social, Emotional & Behavioural Difficulties
-            'ph133': st.session_state.ph133,  # Speech, Language and Communication needs
-            'ph134': st.session_state.ph134,  # Temporary Disability after Illness or accident
-            'ph135': st.session_state.ph135,  # Visual Impairment-excluding glasses/contact lenses
-            'ph136': st.session_state.ph136,  # Prefer not to say
-            'ph137': st.session_state.ph137,  # Are you a wheelchair user? + Other specify text
-            'ph138': st.session_state.ph138,  # Allergy
-            'ph139': st.session_state.ph139,  # Asperger’s Syndrome
-            'ph140': st.session_state.ph140,  # Asthma
-            'ph141': st.session_state.ph141,  # Autism Spectrum Condition
-            'ph142': st.session_state.ph142,  # Cystic Fibrosis
-            'ph143': st.session_state.ph143,  # Diabetes
-            'ph144': st.session_state.ph144,  # Disability Affecting Mobility
-            'ph145': st.session_state.ph145,  # Dyscalculia
-            'ph146': st.session_state.ph146,  # Dyslexia
-            'impactful_condition': st.session_state.impactful_condition,  # Most impactful condition
-            'confidential_interview': st.session_state.confidential_interview,  # Confidential interview checkbox
-
-            'ph147': st.session_state.ph147,  # Employer
-            'ph148': st.session_state.ph148,  # Job Centre
-            'ph149': st.session_state.ph149,  # Social Media
-            'ph150': st.session_state.ph150,  # Local Press
-            'ph151': st.session_state.ph151,  # Search Engine
-            'ph152': st.session_state.ph152,  # Friends / Family
-            'ph153': st.session_state.ph153,  # Other Source
-            'other_source': st.session_state.other_source,  # Other Source (specified)
-
-            'ph154': st.session_state.ph154,  # About courses or learning opportunities
-            'ph155': st.session_state.ph155,  # For surveys and research
-            'ph156': st.session_state.ph156,  # By post
-            'ph157': st.session_state.ph157,  # By phone
-            'ph158': st.session_state.ph158,  # By email
-            'ph159': st.session_state.ph159,   # Consent to being filmed
-
-            'ph35m': st.session_state.ph35m,
-            'ph35f': st.session_state.ph35f,
-            'ph50': date.today().strftime("%d-%m-%Y"),
-        }
+        placeholder_values = build_placeholder_values(st.session_state)
 
-        template_file = "ph_skills_bootcamp.docx"
-        modified_file = f"SkillsBootcamp_Form_Submission_{st.session_state.first_name}_{st.session_state.sir_name}.docx"
+        # Queue the learner for the next W5 workbook export (python w5_export.py)
+        try:
+            spool_submission(st.session_state)
+        except Exception as e:
+            logger.warning('Could not spool submission for W5 export: %s', e)
 
-        signature_path = 'signature_image.png'
-        signature_image = PILImage.fromarray(
-            st.session_state.signature.astype('uint8'), 'RGBA')
-        signature_image.save(signature_path)
+        template_file = TEMPLATE_FILE
+        file_name = document_file_name(st.session_state)
 
-        replace_placeholders(template_file, modified_file, placeholder_values, signature_path)
+        # Process the signature once into this submission's own workspace; nothing is shared between sessions
+        workspace = Workspace()
+        signature_png = process_signature(st.session_state.signature)
+        if signature_png:
+            workspace.buffer(SIGNATURE_BUFFER).write(signature_png)
 
 
 
@@ -1609,20 +1245,48 @@ with st.spinner('Wait for it...'):
         </html>
         """
 
-        # Local file path
-        local_file_path = modified_file
-
-        # Send email to team with attachments
-        if st.session_state.files or local_file_path:
-            send_email_with_attachments(sender_email, sender_password, team_email, subject_team, body_team, st.session_state.files, local_file_path)
-        
-        # Send thank you email to learner
-        send_email_with_attachments(sender_email, sender_password, learner_email, subject_learner, body_learner)
-
-        st.success("Processing Complete!")
-        st.write("Someone will get in touch with you soon.")
-        st.snow()
-        last()
+        st.session_state.job_id = submit_enrollment(template_file, file_name, placeholder_values, workspace, {
+            'sender_email': sender_email,
+            'sender_password': sender_password,
+            'files': st.session_state.files.hand_over(workspace),  # moved into the submission's workspace, not re-read
+            'team_email': team_email,
+            'subject_team': subject_team,
+            'body_team': body_team,
+            'learner_email': learner_email,
+            'subject_learner': subject_learner,
+            'body_learner': body_learner,
+        })
+        record_submission(st.session_state, st.session_state.job_id)
+        track_completed(st.session_state.session_id)
+
+    # Poll the background job; step 11 already waits a second per rerun
+    if st.session_state.submission_done:
+        job = get_job(st.session_state.job_id)
+        if job is None or job.status == FAILED:
+            st.error("Sorry, something went wrong while submitting your form. Please contact PrevistaAdmissions@prevista.co.uk.")
+            if job is None:
+                discard(st.session_state)  # unknown job (e.g. lost with its process): don't invite a second submission
+            else:
+                reopen(st.session_state, 10)  # nothing was sent: the draft goes back to the declaration
+            release_job(st.session_state.job_id)
+            last()
+        elif job.status == DONE:
+            discard(st.session_state)
+            # file download button
+            st.download_button(
+                label="Download Your Response",
+                data=job.document,
+                file_name=job.file_name,
+                mime='application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+            )
+
+            st.success("Processing Complete!")
+            st.write("Someone will get in touch with you soon.")
+            st.snow()
+            release_job(st.session_state.job_id)
+            last()
+        else:
+            st.experimental_rerun()
 
 
 
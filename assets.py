@@ -0,0 +1,215 @@
+from contextlib import contextmanager
+from PIL import Image as PILImage
+from dotenv import dotenv_values
+from html import escape
+import threading
+import tempfile
+import hashlib
+import zipfile
+import shutil
+import json
+import time
+import glob
+import io
+import os
+
+# Process-wide cache for static files
+#
+# Images under resources/, the compiled DOCX template and the .env file are read from
+# disk once per process and kept in memory. Each file's version (mtime and size) is
+# re-checked at most every ASSET_RECHECK seconds, so a rerun or a submission normally
+# touches the disk not at all, while an edited file is still picked up within seconds.
+
+RESOURCES_DIR = 'resources'
+STATIC_DIR = 'static'  # built by tools/build_assets.py, served by Streamlit at app/static/
+STATIC_URL = 'app/static'
+MANIFEST_FILE = 'manifest.json'
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp', '.gif')
+ASSET_RECHECK = float(os.environ.get('ASSET_RECHECK', '5'))  # seconds between stat() calls per file
+IMAGE_DISPLAY_WIDTH = 704  # width of the centered layout's column
+IMAGE_MAX_WIDTH = 1408  # twice the column stays sharp on high-DPI screens
+ENV_FILE = '.env'
+
+_versions = {}  # path -> (version, checked at)
+_images = {}  # (path, max width) -> (version, bytes)
+_manifest = (None, {})  # (version, parsed static/manifest.json)
+_source_hashes = {}  # path -> (version, sha256)
+_env_keys = set()  # variables this process set from .env, which a newer .env may overwrite
+_env_version = None
+_secrets = {}
+_preloaded = set()
+_lock = threading.Lock()
+
+
+def file_version(path):
+    # (mtime_ns, size), or None if the file doesn't exist; cached for ASSET_RECHECK seconds
+    path = os.path.abspath(path)
+    now = time.monotonic()
+    cached = _versions.get(path)
+    if cached is not None and now - cached[1] < ASSET_RECHECK:
+        return cached[0]
+    try:
+        stat = os.stat(path)
+        version = (stat.st_mtime_ns, stat.st_size)
+    except FileNotFoundError:
+        version = None
+    _versions[path] = (version, now)
+    return version
+
+
+def copy_zip_info(info):
+    # A fresh ZipInfo for rewriting a member as it was: writestr() fills in sizes and CRC on the one
+    # it is given, so an archive's own infolist() entries can't be reused (nor shared between threads)
+    member = zipfile.ZipInfo(info.filename, info.date_time)
+    member.compress_type = info.compress_type
+    member.external_attr = info.external_attr
+    return member
+
+
+@contextmanager
+def replace_file(path, mode_source=None):
+    # Yields a temporary path next to path that replaces it once the block completes, or is removed if
+    # it fails. The new file keeps the permissions of the one it replaces (mode_source's when path is
+    # new): mkstemp() would otherwise leave it readable by its owner only.
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=os.path.splitext(path)[1])
+    os.close(fd)
+    try:
+        yield temp_path
+        source = path if os.path.exists(path) else mode_source
+        if source is not None:
+            shutil.copymode(source, temp_path)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def _web_image(path, max_width):
+    # Downscaled to max_width if wider, re-encoded as an optimised PNG (or JPEG for JPEG sources)
+    with PILImage.open(path) as image:
+        image.load()
+        source_format = image.format
+        if image.width > max_width:
+            image = image.resize((max_width, round(image.height * max_width / image.width)), PILImage.LANCZOS)
+        buffer = io.BytesIO()
+        if source_format == 'JPEG':
+            image.save(buffer, format='JPEG', quality=85, optimize=True, progressive=True)
+        else:
+            image.save(buffer, format='PNG', optimize=True)
+    data = buffer.getvalue()
+    if source_format in ('PNG', 'JPEG') and os.path.getsize(path) <= len(data):
+        with open(path, 'rb') as f:
+            data = f.read()  # the original was already smaller
+    return data
+
+
+def image_bytes(path, max_width=IMAGE_MAX_WIDTH):
+    # Web-ready bytes for an image under resources/, suitable for st.image()
+    key = (os.path.abspath(path), max_width)
+    version = file_version(path)
+    cached = _images.get(key)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    with _lock:
+        cached = _images.get(key)
+        if cached is None or cached[0] != version:
+            cached = _images[key] = (version, _web_image(path, max_width))
+        return cached[1]
+
+
+def _preload(directory):
+    for path in sorted(glob.glob(os.path.join(directory, '*'))):
+        if path.lower().endswith(IMAGE_EXTENSIONS):
+            image_bytes(path)
+
+
+def _static_manifest():
+    global _manifest
+    path = os.path.join(STATIC_DIR, MANIFEST_FILE)
+    version = file_version(path)
+    if version != _manifest[0]:
+        try:
+            with open(path) as f:
+                _manifest = (version, json.load(f))
+        except (OSError, ValueError):
+            _manifest = (version, {})
+    return _manifest[1]
+
+
+def _source_hash(path):
+    version = file_version(path)
+    cached = _source_hashes.get(path)
+    if cached is None or cached[0] != version:
+        with open(path, 'rb') as f:
+            cached = _source_hashes[path] = (version, hashlib.sha256(f.read()).hexdigest())
+    return cached[1]
+
+
+def picture_html(path, alt='', display_width=IMAGE_DISPLAY_WIDTH):
+    # <picture> markup for the built variants of a resources/ image (WebP first, PNG/JPEG fallback, one
+    # size per screen density), or None if static/ has no up-to-date build of it
+    # Every existence check goes through file_version(), so a rerun within ASSET_RECHECK stats nothing
+    entry = _static_manifest().get(path.replace(os.sep, '/'))
+    if not entry or file_version(path) is None or entry['sha256'] != _source_hash(path):
+        return None
+    if any(file_version(os.path.join(STATIC_DIR, variant['file'])) is None for variant in entry['variants']):
+        return None  # static/ is missing part of the build
+    variants = sorted(entry['variants'], key=lambda variant: variant['width'])
+    fallback = [variant for variant in variants if variant['format'] != 'webp']
+    webp = [variant for variant in variants if variant['format'] == 'webp']
+
+    def srcset(group):
+        return ', '.join(f"{STATIC_URL}/{variant['file']} {variant['width']}w" for variant in group)
+
+    sizes = f'(max-width: {display_width}px) 100vw, {display_width}px'
+    return (
+        f'<picture><source type="image/webp" srcset="{srcset(webp)}" sizes="{sizes}">'
+        f'<img src="{STATIC_URL}/{fallback[0]["file"]}" srcset="{srcset(fallback)}" sizes="{sizes}" '
+        f'alt="{escape(alt)}" width="{entry["width"]}" height="{entry["height"]}" style="width: 100%; height: auto;">'
+        f'</picture>'
+    )
+
+
+def preload_resources(directory=RESOURCES_DIR):
+    # Warm the image cache once per process, in the background so the first page isn't held up
+    with _lock:
+        if directory in _preloaded:
+            return
+        _preloaded.add(directory)
+    threading.Thread(target=_preload, args=(directory,), name='asset-preload', daemon=True).start()
+
+
+def _load_env(path):
+    # Like load_dotenv(), real environment variables win; values that came from .env follow its edits
+    global _env_version
+    version = file_version(path)
+    if version == _env_version:
+        return
+    with _lock:
+        if version == _env_version:
+            return
+        if version is not None:
+            for key, value in dotenv_values(path).items():
+                if value is not None and (key not in os.environ or key in _env_keys):
+                    os.environ[key] = value
+                    _env_keys.add(key)
+        _secrets.clear()
+        _env_version = version
+
+
+def get_secret(key, fallback=None, env_file=ENV_FILE):
+    # Environment (and .env) first, then fallback(key), e.g. st.secrets.get. Only environment values are
+    # cached (per .env version): st.secrets follows edits to secrets.toml itself, and a miss is retried.
+    _load_env(env_file)
+    if key in _secrets:
+        return _secrets[key]
+    value = os.environ.get(key)
+    if value is not None:
+        _secrets[key] = value
+        return value
+    if fallback is not None:
+        try:
+            return fallback(key)
+        except Exception:
+            return None
+    return None
@@ -0,0 +1,216 @@
+from datetime import date
+from form_schema import FIELDS, FIELDS_BY_STEP, FIELDS_BY_KEY
+from telemetry import get_logger
+import secrets
+import sqlite3
+import json
+import time
+import os
+
+# Server-side drafts of the enrollment form
+#
+# A learner's answers otherwise live only in st.session_state, so a dropped websocket, a
+# refresh or a server restart loses them. Every step transition saves the fields of the
+# step just left that changed since the last save (one row per field), under an opaque
+# resume token that the app puts in the page URL (?resume=<token>). Opening that URL
+# again loads the draft with one primary-key range scan and carries on at the saved step.
+#
+# Uploads and the signature are not kept: they are re-entered on the step that takes them.
+# Once the form is submitted the draft holds the job id instead (record_submission), so a
+# reconnect to any Streamlit process polls that job rather than offering the declaration
+# again. A draft is deleted once the job is done, and purged after DRAFT_TTL otherwise: expired
+# drafts are swept by the first connection of a process and then at most every PURGE_INTERVAL,
+# so a long-running server keeps doing it as learners move between steps.
+
+DRAFTS_DB = os.environ.get('DRAFTS_DB', 'drafts.sqlite3')
+DRAFT_TTL = float(os.environ.get('DRAFT_TTL_DAYS', '30')) * 86400
+PURGE_INTERVAL = 3600  # seconds between sweeps for expired drafts
+RESUME_PARAM = 'resume'
+
+TOKEN_KEY = '_draft_token'
+SAVED_KEY = '_draft_saved'  # key -> JSON last written, so unchanged fields aren't written again
+STEP_KEY = '_draft_step'  # the step the session was on when it was last saved
+JOB_KEY = 'job_id'  # draft row (and session key) of the submitted job
+
+# Answers worth keeping; step and the other session fields (step 0) are handled separately
+DRAFT_KEYS = frozenset(field.key for field in FIELDS if field.step > 0 and field.widget not in ('upload', 'canvas'))
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS draft_fields (
+    token TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (token, key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS draft_fields_updated ON draft_fields (updated);
+'''
+
+logger = get_logger('drafts')
+
+_schema_ready = set()
+_purged = {}  # path -> time.monotonic() of the last purge
+
+
+def _connect(path=None):
+    path = path or DRAFTS_DB
+    db = sqlite3.connect(path, timeout=30, isolation_level=None)
+    if path not in _schema_ready:
+        db.execute('PRAGMA journal_mode=WAL')
+        db.executescript(_SCHEMA)
+        _schema_ready.add(path)
+    now = time.monotonic()
+    if path not in _purged or now - _purged[path] >= PURGE_INTERVAL:
+        _purged[path] = now
+        purge_expired(db)
+    return db
+
+
+def _encode(field, value):
+    if field.widget == 'date' and isinstance(value, date):
+        value = value.isoformat()
+    return json.dumps(value, sort_keys=True)
+
+
+def _decode(field, text):
+    value = json.loads(text)
+    if field.widget == 'date' and isinstance(value, str):
+        value = date.fromisoformat(value)
+    return value
+
+
+def new_token():
+    return secrets.token_urlsafe(16)
+
+
+def purge_expired(db=None, ttl=DRAFT_TTL):
+    # Drops every field of a draft whose step row (written on each save) is older than ttl
+    own = db is None
+    db = db or _connect()
+    try:
+        cursor = db.execute(
+            "DELETE FROM draft_fields WHERE token IN (SELECT token FROM draft_fields WHERE key = 'step' AND updated < ?)",
+            (time.time() - ttl,)
+        )
+        if cursor.rowcount:
+            logger.info('Purged %d expired draft field(s)', cursor.rowcount)
+    finally:
+        if own:
+            db.close()
+
+
+def save_fields(token, step, changes):
+    # changes: {key: JSON text}; written in one transaction together with the current step
+    now = time.time()
+    rows = [(token, key, value, now) for key, value in changes.items()]
+    rows.append((token, 'step', json.dumps(step), now))
+    db = _connect()
+    try:
+        db.execute('BEGIN IMMEDIATE')
+        db.executemany('INSERT OR REPLACE INTO draft_fields (token, key, value, updated) VALUES (?, ?, ?, ?)', rows)
+        db.execute('COMMIT')
+    finally:
+        db.close()
+
+
+def load_draft(token):
+    # {key: JSON text} for the token, including 'step'; empty if it's unknown or expired
+    db = _connect()
+    try:
+        return dict(db.execute('SELECT key, value FROM draft_fields WHERE token = ?', (token,)).fetchall())
+    finally:
+        db.close()
+
+
+def delete_draft(token):
+    db = _connect()
+    try:
+        db.execute('DELETE FROM draft_fields WHERE token = ?', (token,))
+    finally:
+        db.close()
+
+
+def resume(state, token):
+    # Fill a fresh session from a saved draft; returns True if there was one
+    rows = load_draft(token)
+    if 'step' not in rows:
+        return False
+    for key, text in rows.items():
+        if key in DRAFT_KEYS:
+            state[key] = _decode(FIELDS_BY_KEY[key], text)
+    state['step'] = json.loads(rows.pop('step'))
+    if JOB_KEY in rows:
+        # Submitted already: go straight to polling the job
+        state[JOB_KEY] = json.loads(rows.pop(JOB_KEY))
+        state['submission_done'] = True
+    state[TOKEN_KEY] = token
+    state[SAVED_KEY] = rows
+    state[STEP_KEY] = state['step']
+    logger.info('Resumed draft at step %d (%d field(s))', state['step'], len(rows))
+    return True
+
+
+def save_on_step_change(state):
+    # Called on every rerun; only writes when the step changed since the last save, and then only the
+    # fields of the step that was left whose value differs from what the draft already holds
+    step = state['step']
+    previous = state.get(STEP_KEY)
+    if previous == step or state.get('submission_done'):
+        return False  # once submitted, the draft stays at the last step before submission
+    state[STEP_KEY] = step
+    if previous is None:
+        return False  # a new session: nothing answered yet
+    saved = state.setdefault(SAVED_KEY, {})
+    changes = {}
+    for field in FIELDS_BY_STEP.get(previous, ()):
+        if field.key in DRAFT_KEYS and field.key in state:
+            text = _encode(field, state[field.key])
+            if saved.get(field.key) != text:
+                changes[field.key] = text
+    token = state.get(TOKEN_KEY)
+    if token is None:
+        token = state[TOKEN_KEY] = new_token()
+    try:
+        save_fields(token, step, changes)
+    except sqlite3.Error:
+        logger.exception('Saving the draft failed')
+        return False
+    saved.update(changes)
+    return True
+
+
+def record_submission(state, job_id):
+    # Keep the submitted job in the draft, so a resumed session polls it instead of submitting again
+    token = state.get(TOKEN_KEY)
+    if token is None:
+        return
+    try:
+        save_fields(token, state['step'], {JOB_KEY: json.dumps(job_id)})
+    except sqlite3.Error:
+        logger.exception('Saving the submitted job to the draft failed')
+
+
+def reopen(state, step):
+    # The job failed before anything was sent: resuming the draft offers that step again
+    token = state.get(TOKEN_KEY)
+    if token is None:
+        return
+    db = _connect()
+    try:
+        db.execute('BEGIN IMMEDIATE')
+        db.execute('DELETE FROM draft_fields WHERE token = ? AND key = ?', (token, JOB_KEY))
+        db.execute("INSERT OR REPLACE INTO draft_fields (token, key, value, updated) VALUES (?, 'step', ?, ?)",
+                   (token, json.dumps(step), time.time()))
+        db.execute('COMMIT')
+    except sqlite3.Error:
+        logger.exception('Reopening the draft failed')
+    finally:
+        db.close()
+
+
+def discard(state):
+    # The submission went through: the draft's personal data isn't needed any more
+    token = state.get(TOKEN_KEY)
+    if token is not None:
+        delete_draft(token)
+        state[SAVED_KEY] = {}
@@ -0,0 +1,139 @@
+from collections import namedtuple
+from uploads import UploadSpool
+import uuid
+
+# Field schema for the enrollment form
+#
+# One entry per session_state key the form keeps: the step whose widgets edit it, its
+# default, the kind of widget and the DOCX placeholder it fills (None when the field only
+# drives the form). Step 0 holds session-wide state.
+#
+# init_session_state() runs on every rerun but only does work the first time a session
+# reaches a step: that step's defaults are materialised once and the step is remembered,
+# so every later rerun (each keystroke, each click) costs a single set lookup.
+
+Field = namedtuple('Field', 'step key default widget placeholder')
+
+INITIALISED_KEY = '_initialised_steps'
+
+
+def _options(step, keys, widget='radio', default=''):
+    # A group of mutually exclusive / tick-box options whose session key is the placeholder itself
+    return [Field(step, key, default, widget, key) for key in keys]
+
+
+def _ph(start, stop):
+    return [f'ph{i}' for i in range(start, stop)]
+
+
+FIELDS = [
+    # Session
+    Field(0, 'step', 1, 'state', None),
+    Field(0, 'session_id', lambda: uuid.uuid4().hex, 'state', None),  # identifies the session in metrics
+    Field(0, 'submission_done', False, 'state', None),
+    Field(0, 'files', UploadSpool, 'upload', None),  # supporting documents, spooled to disk (step 9)
+
+    # Step 1: support and referral
+    Field(1, 'selected_option', "    ", 'select', None),
+    Field(1, 'hear_about', "Self-referral", 'select', None),
+    Field(1, 'hother_source', '', 'text', None),
+
+    # Step 2: learner information
+    Field(2, 'title', "Mr", 'radio', 'ph7'),
+    Field(2, 'sir_name', '', 'text', 'ph2'),
+    Field(2, 'first_name', '', 'text', 'ph1'),
+    Field(2, 'preferred_name', '', 'text', 'ph8'),
+    Field(2, 'previous_name', '', 'text', 'ph9'),
+    Field(2, 'home_address', '', 'text', 'ph55'),
+    Field(2, 'postcode', '', 'text', 'ph4'),
+    Field(2, 'previous_postcode_country', '', 'text', 'ph56'),
+    Field(2, 'dob', None, 'date', 'ph34'),
+    Field(2, 'current_age', '', 'computed', 'ph57'),
+    Field(2, 'ni_number', '', 'text', 'ph3'),
+    Field(2, 'gender', "Male", 'radio', None),
+    Field(2, 'ph35m', '', 'computed', 'ph35m'),
+    Field(2, 'ph35f', '', 'computed', 'ph35f'),
+    Field(2, 'home_number', '', 'text', 'ph58'),
+    Field(2, 'mobile_number', '', 'text', 'ph6'),
+    Field(2, 'email', '', 'text', 'ph5'),
+
+    # Step 3: ethnicity, convictions, caring responsibilities
+    Field(3, 'ethnicity_category', 'White', 'select', None),
+    Field(3, 'ethnicity', 'English/ Welsh/ Scottish/ N Irish/ British', 'select', None),
+    Field(3, 'ethnicity_code', 31, 'computed', None),
+    # A dict of answers fills one placeholder per entry: ethnicity_31 .. ethnicity_48 -> ph219 .. ph236
+    Field(3, 'ethnicity_vars', lambda: {f'ethnicity_{i}': '' for i in range(31, 49)}, 'computed',
+          {f'ethnicity_{i}': f'ph{i + 188}' for i in range(31, 49)}),
+    Field(3, 'criminal_conviction', "No", 'radio', None),
+    Field(3, 'ph59', '', 'computed', 'ph59'),
+    Field(3, 'ph60', '', 'computed', 'ph60'),
+    Field(3, 'caring_children', "No", 'radio', None),
+    Field(3, 'ph61', '', 'computed', 'ph61'),
+    Field(3, 'ph62', '', 'computed', 'ph62'),
+
+    # Step 4: emergency contact
+    Field(4, 'emergency_contact_name', '', 'text', 'ph40'),
+    Field(4, 'emergency_contact_relationship', '', 'text', 'ph41'),
+    Field(4, 'emergency_contact_phone', '', 'text', 'ph42'),
+    Field(4, 'home_tel_no', '', 'text', 'ph43'),
+
+    # Step 5: prior attainment
+    *_options(5, _ph(63, 75)),
+
+    # Step 6: employment
+    *_options(6, _ph(75, 79) + ['ph79a', 'ph79b', 'ph79c', 'ph79d'] + _ph(80, 83)),  # employment status
+    *_options(6, _ph(83, 88)),  # unemployment duration
+    *_options(6, _ph(88, 93)),  # benefits
+    *_options(6, _ph(93, 96), 'text'),  # employer name, postcode, job role
+    Field(6, 'ph96', 0.0, 'number', 'ph96'),  # current hourly rate
+    *_options(6, ['ph97y', 'ph97n']),  # attending via employer
+    *_options(6, _ph(98, 102)),  # working alongside the bootcamp
+    *_options(6, _ph(102, 112)),  # most recent occupation
+    *_options(6, _ph(112, 121)),  # industry / sector
+    Field(6, 'ph120a', '', 'text', 'ph120a'),
+
+    # Step 7: disability, learning difficulty and/or health problem
+    *_options(7, _ph(121, 124)),
+    Field(7, 'ph123a', '', 'text', 'ph123a'),
+    *_options(7, _ph(124, 147), 'checkbox'),
+    Field(7, 'impactful_condition', '', 'text', 'impactful_condition'),
+    Field(7, 'confidential_interview', '', 'checkbox', 'confidential_interview'),
+
+    # Step 8: contact and marketing
+    *_options(8, _ph(147, 154)),
+    Field(8, 'other_source', '', 'text', 'other_source'),
+
+    # Step 9: supporting documents (kept in 'files', above)
+
+    # Step 10: declaration and signature
+    *_options(10, _ph(154, 160), 'checkbox'),
+    Field(10, 'signature', None, 'canvas', None),  # embedded as a picture at ph_signature, not a text value
+]
+
+FIELDS_BY_KEY = {field.key: field for field in FIELDS}
+PLACEHOLDER_FIELDS = [field for field in FIELDS if field.placeholder]
+FIELDS_BY_STEP = {}
+for _field in FIELDS:
+    FIELDS_BY_STEP.setdefault(_field.step, []).append(_field)
+
+
+def default_value(field):
+    # Callable defaults (list, dict factories) give every session its own object
+    return field.default() if callable(field.default) else field.default
+
+
+def init_step(state, step):
+    for field in FIELDS_BY_STEP.get(step, ()):
+        if field.key not in state:
+            state[field.key] = default_value(field)
+
+
+def init_session_state(state):
+    initialised = state.get(INITIALISED_KEY)
+    if initialised is None:
+        init_step(state, 0)
+        initialised = state[INITIALISED_KEY] = {0}
+    step = state['step']
+    if step not in initialised:
+        init_step(state, step)
+        initialised.add(step)
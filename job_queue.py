@@ -0,0 +1,179 @@
+from metrics import Gauge
+from telemetry import get_logger
+import sqlite3
+import json
+import time
+import os
+
+# Shared submission queue for multi-process deployments
+#
+# With SUBMISSION_BACKEND=queue the Streamlit processes don't render anything themselves:
+# submit_enrollment() writes the job here and returns, and separate worker processes
+# (python worker.py -n <processes>) claim jobs, render the DOCX and queue the emails in
+# the outbox. Status and the finished document are written back to the same row, so any
+# Streamlit process can answer get_job() - a learner needs no sticky session to see their
+# result. A job claimed by a worker that died is handed out again after CLAIM_TIMEOUT.
+#
+# Credentials never go through the queue: workers read sender_password from their own
+# environment / .env. Uploaded files don't either: the row only holds their paths in the
+# submission's workspace directory, which the worker removes when the job is finished -
+# so workers run on the same host as the Streamlit processes (see worker.py).
+
+JOBS_DB = os.environ.get('JOBS_DB', 'jobs.sqlite3')
+CLAIM_TIMEOUT = 300  # seconds before a job left in 'rendering' by a dead worker is retried
+MAX_CLAIMS = 3  # a job that kills its worker this often is failed instead of retried
+JOB_TTL = 3600  # seconds a finished job is kept for a page that never came back for it
+
+# Job statuses, in order
+QUEUED = 'queued'
+RENDERING = 'rendering'
+SENDING = 'sending'
+DONE = 'done'
+FAILED = 'failed'
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    status TEXT NOT NULL DEFAULT 'queued',
+    template_file TEXT NOT NULL,
+    file_name TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    signature BLOB,
+    document BLOB,
+    error TEXT,
+    claims INTEGER NOT NULL DEFAULT 0,
+    claimed_by TEXT,
+    claimed_at REAL,
+    created REAL NOT NULL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created);
+'''
+
+logger = get_logger('job_queue')
+
+_schema_ready = set()
+
+
+def _connect(path=None):
+    path = path or JOBS_DB
+    db = sqlite3.connect(path, timeout=30, isolation_level=None)
+    db.execute('PRAGMA synchronous=NORMAL')  # a job lost to a power cut is resubmitted from its draft
+    if path not in _schema_ready:
+        db.execute('PRAGMA journal_mode=WAL')
+        db.executescript(_SCHEMA)
+        _schema_ready.add(path)
+    return db
+
+
+class QueuedJob:
+    # Read-only view of a row, with the attributes the app uses on a SubmissionJob
+    def __init__(self, job_id, status, file_name, document, error, finished_at):
+        self.job_id = job_id
+        self.status = status
+        self.file_name = file_name
+        self.document = document or b''
+        self.error = error
+        self.finished_at = finished_at
+
+    @property
+    def finished(self):
+        return self.status in (DONE, FAILED)
+
+
+# files are (file name, path, content type) of the uploaded files to attach
+def enqueue_job(job_id, template_file, file_name, placeholder_values, signature_png, emails, files=()):
+    payload = json.dumps({
+        'placeholder_values': placeholder_values,
+        'emails': {key: value for key, value in emails.items() if key not in ('sender_password', 'files')},
+        'files': list(files),
+    })
+    now = time.time()
+    db = _connect()
+    try:
+        db.execute('BEGIN IMMEDIATE')
+        db.execute('DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?', (DONE, FAILED, now - JOB_TTL))
+        db.execute('INSERT INTO jobs (job_id, template_file, file_name, payload, signature, created) VALUES (?, ?, ?, ?, ?, ?)',
+                   (job_id, template_file, file_name, payload, signature_png, now))
+        db.execute('COMMIT')
+    finally:
+        db.close()
+
+
+# Take the oldest waiting job (or one a dead worker left behind); returns
+# (job_id, template_file, file_name, placeholder_values, signature_png, emails, files) or None
+def claim_job(worker_name):
+    now = time.time()
+    db = _connect()
+    try:
+        db.execute('BEGIN IMMEDIATE')
+        row = db.execute(
+            'SELECT job_id, claims FROM jobs WHERE status = ? OR (status = ? AND claimed_at < ?) ORDER BY created LIMIT 1',
+            (QUEUED, RENDERING, now - CLAIM_TIMEOUT)
+        ).fetchone()
+        if row is None:
+            db.execute('COMMIT')
+            return None
+        job_id, claims = row
+        if claims >= MAX_CLAIMS:
+            logger.error('Submission job %s abandoned by %d workers, failing it', job_id, claims)
+            db.execute('UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE job_id = ?',
+                       (FAILED, 'worker died while processing', now, job_id))
+            db.execute('COMMIT')
+            return claim_job(worker_name)
+        db.execute('UPDATE jobs SET status = ?, claims = claims + 1, claimed_by = ?, claimed_at = ? WHERE job_id = ?',
+                   (RENDERING, worker_name, now, job_id))
+        template_file, file_name, payload, signature = db.execute(
+            'SELECT template_file, file_name, payload, signature FROM jobs WHERE job_id = ?', (job_id,)).fetchone()
+        db.execute('COMMIT')
+    except BaseException:
+        if db.in_transaction:
+            db.execute('ROLLBACK')
+        raise
+    finally:
+        db.close()
+    payload = json.loads(payload)
+    files = [tuple(file) for file in payload.get('files', ())]
+    return job_id, template_file, file_name, payload['placeholder_values'], signature, payload['emails'], files
+
+
+def finish_job(job_id, status, document=b'', error=None):
+    db = _connect()
+    try:
+        db.execute('UPDATE jobs SET status = ?, document = ?, error = ?, finished_at = ?, payload = ?, signature = NULL '
+                   'WHERE job_id = ?', (status, document, error, time.time(), '{}', job_id))
+    finally:
+        db.close()
+
+
+def get_job(job_id):
+    db = _connect()
+    try:
+        row = db.execute('SELECT job_id, status, file_name, document, error, finished_at FROM jobs WHERE job_id = ?',
+                         (job_id,)).fetchone()
+    finally:
+        db.close()
+    return QueuedJob(*row) if row is not None else None
+
+
+def release_job(job_id):
+    db = _connect()
+    try:
+        db.execute('DELETE FROM jobs WHERE job_id = ?', (job_id,))
+    finally:
+        db.close()
+
+
+def stats():
+    if not os.path.exists(JOBS_DB):
+        return {}  # the in-process backend never creates the queue
+    db = _connect()
+    try:
+        return dict(db.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+    finally:
+        db.close()
+
+
+# The backlog waiting for workers; read from the database on each scrape
+QUEUED_JOBS = Gauge('submission_queue_jobs', 'Jobs in the shared submission queue by status', ['status'],
+                    callback=lambda: {(status,): count for status, count in stats().items()})
@@ -0,0 +1,189 @@
+from contextlib import contextmanager
+from email.message import EmailMessage
+from mime import Attachment, build_message
+from telemetry import span
+from metrics import EMAIL_SEND_SECONDS, SMTP_FAILURES
+import threading
+import smtplib
+import time
+import os
+
+# Outgoing mail settings; override through the environment to point at a local stand-in server
+SMTP_HOST = os.environ.get('SMTP_HOST', 'smtp.office365.com')
+SMTP_PORT = int(os.environ.get('SMTP_PORT', '587'))
+SMTP_STARTTLS = os.environ.get('SMTP_STARTTLS', '1') != '0'
+SMTP_MAX_CONNECTIONS = int(os.environ.get('SMTP_MAX_CONNECTIONS', '4'))
+SMTP_IDLE_TIMEOUT = float(os.environ.get('SMTP_IDLE_TIMEOUT', '60'))  # seconds before an idle session is dropped
+SMTP_TIMEOUT = float(os.environ.get('SMTP_TIMEOUT', '30'))
+
+# Errors that mean the session itself is gone and a fresh connection may succeed
+CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError)
+
+
+def send_stream(server, msg):
+    # One SMTP transaction for a mime.MessageStream, read from its file in chunks
+    # (smtplib's sendmail() wants the whole message in memory). Returns the refused recipients.
+    server.ehlo_or_helo_if_needed()
+    options = [f'SIZE={msg.size}'] if server.does_esmtp and server.has_extn('size') else []
+    code, response = server.mail(msg.sender, options)
+    if code != 250:
+        raise smtplib.SMTPSenderRefused(code, response, msg.sender)
+    refused = {}
+    for recipient in msg.recipients:
+        code, response = server.rcpt(recipient)
+        if code not in (250, 251):
+            refused[recipient] = (code, response)
+    if len(refused) == len(msg.recipients):
+        raise smtplib.SMTPRecipientsRefused(refused)
+    code, response = server.docmd('data')
+    if code != 354:
+        raise smtplib.SMTPDataError(code, response)
+    line_start = True
+    for chunk in msg.chunks():
+        # Dot-stuffing, including a line that starts right at a chunk boundary
+        chunk = chunk.replace(b'\n.', b'\n..')
+        if line_start and chunk.startswith(b'.'):
+            chunk = b'.' + chunk
+        server.send(chunk)
+        line_start = chunk.endswith(b'\n')
+    server.send(b'.\r\n' if line_start else b'\r\n.\r\n')
+    code, response = server.getreply()
+    if code != 250:
+        raise smtplib.SMTPDataError(code, response)
+    return refused
+
+
+class SMTPPool:
+    # Keeps authenticated SMTP sessions open between messages.
+    # Idle sessions are health-checked with NOOP before reuse, dropped after SMTP_IDLE_TIMEOUT
+    # and replaced transparently if the server hung up. At most max_connections are open at once.
+    def __init__(self, host, port, username, password, starttls=True, max_connections=SMTP_MAX_CONNECTIONS,
+                 idle_timeout=SMTP_IDLE_TIMEOUT, timeout=SMTP_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self._idle = []  # (server, last_used)
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.starttls:
+                server.starttls()
+            server.ehlo_or_helo_if_needed()
+            # Local stand-in servers don't offer AUTH; the real relay requires it after STARTTLS
+            if self.username and self.password and server.has_extn('auth'):
+                server.login(self.username, self.password)
+        except Exception:
+            self._close(server)
+            raise
+        return server
+
+    def _close(self, server):
+        try:
+            server.quit()
+        except Exception:
+            server.close()
+
+    def _is_alive(self, server):
+        try:
+            return server.noop()[0] == 250
+        except Exception:
+            return False
+
+    def _checkout(self):
+        # Reuse the most recently used session that still answers NOOP, otherwise open a new one
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                server, last_used = self._idle.pop()
+            if time.monotonic() - last_used < self.idle_timeout and self._is_alive(server):
+                return server
+            self._close(server)
+        return self._connect()
+
+    def _checkin(self, server):
+        with self._lock:
+            self._idle.append((server, time.monotonic()))
+
+    @contextmanager
+    def connection(self):
+        self._slots.acquire()
+        try:
+            server = self._checkout()
+            try:
+                yield server
+            except Exception:
+                self._close(server)  # the session state is unknown after a failure
+                raise
+            self._checkin(server)
+        finally:
+            self._slots.release()
+
+    def _send(self, server, msg):
+        if isinstance(msg, EmailMessage):
+            return server.send_message(msg)
+        return send_stream(server, msg)
+
+    def send_message(self, msg):
+        # msg is a mime.MessageStream (or an EmailMessage)
+        started, outcome = time.perf_counter(), 'failed'
+        try:
+            with span('smtp_send'):
+                try:
+                    with self.connection() as server:
+                        self._send(server, msg)
+                except CONNECTION_ERRORS:
+                    # Reconnect once: the pooled session may have been closed by the server between NOOP and send
+                    with self.connection() as server:
+                        self._send(server, msg)
+            outcome = 'sent'
+        except Exception as e:
+            SMTP_FAILURES.inc(error=type(e).__name__)
+            raise
+        finally:
+            EMAIL_SEND_SECONDS.observe(time.perf_counter() - started, outcome=outcome)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for server, _ in idle:
+            self._close(server)
+
+
+# One pool per sender account, shared by every session in the process
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(sender_email, sender_password):
+    key = (SMTP_HOST, SMTP_PORT, sender_email, sender_password)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = SMTPPool(SMTP_HOST, SMTP_PORT, sender_email, sender_password, starttls=SMTP_STARTTLS)
+            _pools[key] = pool
+        return pool
+
+
+# Returns a mime.MessageStream; close it once it has been sent or queued.
+# files are mime.Attachment objects (spooled uploads, see uploads.py) or uploaded file objects with .name;
+# attachments are (file_name, data) pairs.
+def build_email(sender_email, receiver_email, subject, body, files=None, attachments=None):
+    parts = [uploaded_file if isinstance(uploaded_file, Attachment) else Attachment(uploaded_file.name, uploaded_file)
+             for uploaded_file in files or ()]
+    parts += [Attachment(file_name, file_data) for file_name, file_data in attachments or ()]
+    return build_message(sender_email, receiver_email, subject, body, parts)
+
+
+# Function to send email with attachments (Handle In-memory + Uploaded)
+def send_email_with_attachments(sender_email, sender_password, receiver_email, subject, body, files=None, attachments=None):
+    # Use the pooled SMTP session for sending the email
+    with build_email(sender_email, receiver_email, subject, body, files, attachments) as msg:
+        get_pool(sender_email, sender_password).send_message(msg)
@@ -0,0 +1,295 @@
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from contextlib import contextmanager
+from telemetry import get_logger
+import threading
+import bisect
+import time
+import os
+
+# Prometheus metrics for the enrollment app
+#
+# A small in-process registry (counters, gauges, histograms with labels) rendered in the
+# Prometheus text exposition format, served by a sidecar HTTP server on METRICS_PORT next
+# to Streamlit. Standard library only, so it works offline and needs no extra package.
+#
+#   curl http://localhost:9464/metrics
+#
+# The enrollment funnel is driven by st.session_state.step: track_step() is called on
+# every rerun, counts a session's transitions into each step, and a session that goes
+# quiet for ABANDON_AFTER without submitting is counted as abandoned at its last step.
+
+METRICS_PORT = os.environ.get('METRICS_PORT', '9464')  # empty disables the endpoint, 0 picks a free port
+METRICS_HOST = os.environ.get('METRICS_HOST', '127.0.0.1')  # 0.0.0.0 to let a scraper on another host in
+ABANDON_AFTER = float(os.environ.get('METRICS_ABANDON_AFTER', '1800'))  # seconds of inactivity
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+logger = get_logger('metrics')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.register(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} expects labels {self.labelnames}, got {tuple(labels)}')
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, (), value) for key, value in sorted(self._values.items())]
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for name, key, extra, value in self.samples():
+            lines.append(f'{name}{_format_labels(self.labelnames, key, extra)} {_format_value(value)}')
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        if not self.labelnames:
+            self._values[()] = 0
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        # callback() -> {label values tuple: value}, read at scrape time instead of stored values
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+        if not self.labelnames and callback is None:
+            self._values[()] = 0
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def samples(self):
+        if self.callback is None:
+            return super().samples()
+        try:
+            values = self.callback()
+        except Exception:
+            logger.exception('Collecting %s failed', self.name)
+            return []
+        return [(self.name, tuple(map(str, key)), (), value) for key, value in sorted(values.items())]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0, 0.0]  # per-bucket counts, count, sum
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                state[0][index] += 1
+            state[1] += 1
+            state[2] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, count, total) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    samples.append((f'{self.name}_bucket', key, (('le', _format_value(float(bound))),), cumulative))
+                samples.append((f'{self.name}_bucket', key, (('le', '+Inf'),), count))
+                samples.append((f'{self.name}_count', key, (), count))
+                samples.append((f'{self.name}_sum', key, (), total))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []  # called before every scrape to refresh derived values
+
+    def register(self, metric):
+        self.metrics.append(metric)
+
+    def render(self):
+        for collect in self.collectors:
+            try:
+                collect()
+            except Exception:
+                logger.exception('Metrics collector failed')
+        return '\n'.join(metric.render() for metric in self.metrics) + '\n'
+
+
+REGISTRY = Registry()
+
+# Enrollment funnel
+ENROLLMENTS_STARTED = Counter('enrollment_started_total', 'Sessions that opened the enrollment form')
+STEP_ENTERED = Counter('enrollment_step_entered_total', 'Transitions into each form step', ['step'])
+ENROLLMENTS_COMPLETED = Counter('enrollment_completed_total', 'Enrollments submitted')
+ENROLLMENTS_ABANDONED = Counter('enrollment_abandoned_total', 'Sessions that went quiet without submitting, by last step', ['step'])
+
+# Submission pipeline
+SUBMISSIONS_IN_FLIGHT = Gauge('submissions_in_flight', 'Submissions accepted but not yet rendered and queued')
+SUBMISSIONS_FINISHED = Counter('submissions_finished_total', 'Background submission jobs by outcome', ['status'])
+RENDER_SECONDS = Histogram('render_seconds', 'Time to render the enrollment DOCX (replace_placeholders)')
+EMAIL_SEND_SECONDS = Histogram('email_send_seconds', 'Time to hand one email to the SMTP server', ['outcome'])
+SMTP_FAILURES = Counter('smtp_failures_total', 'Failed email deliveries, by error type', ['error'])
+
+
+class _Funnel:
+    def __init__(self):
+        self.sessions = {}  # session id -> [step, last seen, submitted]
+        self.active = {}  # (step,) -> sessions currently on it, as of the last collect()
+        self.pruned = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _prune(self, now, abandon_after):
+        # Forget sessions idle for longer than the abandon window, counted as abandoned unless submitted;
+        # call with the lock held
+        cutoff = now - abandon_after
+        for session_id, (step, last_seen, submitted) in list(self.sessions.items()):
+            if last_seen < cutoff:
+                del self.sessions[session_id]
+                if not submitted:
+                    ENROLLMENTS_ABANDONED.inc(step=step)
+        self.pruned = now
+
+    def track_step(self, session_id, step):
+        now = time.monotonic()
+        with self.lock:
+            # Without a scraper collect() never runs: prune here too, at most once per abandon window
+            if now - self.pruned >= ABANDON_AFTER:
+                self._prune(now, ABANDON_AFTER)
+            session = self.sessions.get(session_id)
+            if session is None:
+                self.sessions[session_id] = [step, now, False]
+                ENROLLMENTS_STARTED.inc()
+                STEP_ENTERED.inc(step=step)
+                return
+            # After submitting, the form starting over (download click, a cleared session) isn't counted again
+            if session[0] != step and not session[2]:
+                STEP_ENTERED.inc(step=step)
+                session[0] = step
+            session[1] = now
+
+    def track_completed(self, session_id):
+        # The session stays known (its page keeps polling) but can no longer be abandoned or enter steps
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if session is not None:
+                if session[2]:
+                    return
+                session[2] = True
+        ENROLLMENTS_COMPLETED.inc()
+
+    def collect(self, abandon_after=None):
+        active = {}
+        with self.lock:
+            self._prune(time.monotonic(), ABANDON_AFTER if abandon_after is None else abandon_after)
+            for step, _, submitted in self.sessions.values():
+                if not submitted:
+                    active[(step,)] = active.get((step,), 0) + 1
+            self.active = active
+
+
+_funnel = _Funnel()
+REGISTRY.collectors.append(_funnel.collect)
+ACTIVE_SESSIONS = Gauge('enrollment_active_sessions', 'Sessions seen within the abandon window, by current step', ['step'],
+                        callback=lambda: _funnel.active)
+track_step = _funnel.track_step
+track_completed = _funnel.track_completed
+collect_funnel = _funnel.collect
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/metrics', '/'):
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # scrapes every few seconds would drown the app log
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+# Start the /metrics endpoint once per process (safe to call on every rerun); returns the bound port or None
+def start_metrics_server(port=METRICS_PORT, host=METRICS_HOST):
+    global _server
+    with _server_lock:
+        if _server is not None:
+            return _server.server_address[1]
+        if port in (None, ''):
+            return None
+        try:
+            _server = ThreadingHTTPServer((host, int(port)), _MetricsHandler)
+        except OSError as e:
+            # Another process (a second Streamlit worker) already serves metrics on this port
+            logger.warning('Metrics endpoint not started on %s:%s: %s', host, port, e)
+            return None
+        _server.daemon_threads = True
+        threading.Thread(target=_server.serve_forever, name='metrics-server', daemon=True).start()
+        logger.info('Serving metrics on http://%s:%s/metrics', host, _server.server_address[1])
+        return _server.server_address[1]
@@ -0,0 +1,291 @@
+from contextlib import contextmanager
+from email.message import EmailMessage, MIMEPart
+from email.parser import BytesHeaderParser
+from email.utils import getaddresses
+from email import policy
+from telemetry import get_logger
+import mimetypes
+import tempfile
+import zipfile
+import codecs
+import shutil
+import base64
+import html
+import re
+import uuid
+import io
+import os
+
+# Streaming MIME assembly for outgoing mail
+#
+# build_message() writes the message straight into a spooled temporary file: every
+# attachment is read from its own file handle CHUNK_SIZE bytes at a time and base64-encoded
+# on the way, so neither an attachment nor the encoded message is ever held in memory
+# whole - memory per message stays around SPOOL_SIZE however many files a learner attaches.
+# Content types are sniffed from the first bytes of each file instead of trusting the name.
+#
+# When the attachments add up to more than EMAIL_MAX_BYTES, the largest are moved into one
+# zip until the rest fits. Files that still don't fit are left out and listed at the end of
+# the body, so the mail server never bounces the whole message for its size.
+
+EMAIL_MAX_BYTES = int(os.environ.get('EMAIL_MAX_BYTES', str(18 * 1024 * 1024)))  # attachments in total, before base64 adds a third
+SPOOL_SIZE = 1024 * 1024  # bytes of a message kept in memory before it spills to disk
+CHUNK_SIZE = 57 * 1024  # read size; a multiple of 57 bytes encodes to whole 76-character base64 lines
+SNIFF_SIZE = 2048
+ZIP_NAME = 'attachments.zip'
+# Header values can't carry control characters (the email package refuses \x0b, \x1c.. as line breaks);
+# the subject and file names embed the learner's name, so anything pasted into it is dropped here
+_HEADER_CONTROL = re.compile(r'[\x00-\x08\x0a-\x1f\x7f]')
+
+logger = get_logger('mime')
+
+# Leading bytes of the formats learners upload (ID scans, certificates, forms)
+_SIGNATURES = (
+    (b'%PDF-', 'application/pdf'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'II*\x00', 'image/tiff'),
+    (b'MM\x00*', 'image/tiff'),
+    (b'{\\rtf', 'application/rtf'),
+)
+_HEIF_BRANDS = (b'heic', b'heix', b'hevc', b'heim', b'heis', b'mif1', b'msf1')
+_OLE_SIGNATURE = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'  # legacy .doc / .xls / .ppt
+_OLE_TYPES = {'.xls': 'application/vnd.ms-excel', '.ppt': 'application/vnd.ms-powerpoint'}
+_OOXML_TYPES = (
+    ('word/', 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'),
+    ('xl/', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+    ('ppt/', 'application/vnd.openxmlformats-officedocument.presentationml.presentation'),
+)
+
+
+def _zip_content_type(file):
+    # DOCX / XLSX / PPTX are zips too: tell them apart by the parts inside
+    if file is not None:
+        try:
+            names = zipfile.ZipFile(file).namelist()
+        except (zipfile.BadZipFile, OSError):
+            names = []
+        finally:
+            file.seek(0)
+        for prefix, content_type in _OOXML_TYPES:
+            if any(name.startswith(prefix) for name in names):
+                return content_type
+    return 'application/zip'
+
+
+def sniff_content_type(head, file_name='', file=None):
+    # head is the start of the data; file (seekable, optional) lets zip-based formats be inspected
+    if head.startswith(b'PK\x03\x04'):
+        return _zip_content_type(file)
+    if head[4:8] == b'ftyp' and head[8:12] in _HEIF_BRANDS:
+        return 'image/heic'  # iPhone photos
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    for signature, content_type in _SIGNATURES:
+        if head.startswith(signature):
+            return content_type
+    if head.startswith(_OLE_SIGNATURE):
+        return _OLE_TYPES.get(os.path.splitext(file_name)[1].lower(), 'application/msword')
+    guessed = mimetypes.guess_type(file_name)[0]
+    try:
+        # Incremental decoder: a character cut off at the end of head is not an error
+        codecs.getincrementaldecoder('utf-8')().decode(head)
+        is_text = bool(head) and b'\x00' not in head
+    except UnicodeDecodeError:
+        is_text = False
+    if is_text:
+        return guessed if guessed and guessed.startswith('text/') else 'text/plain'
+    return 'application/octet-stream'
+
+
+class Attachment:
+    # A file to attach. data is bytes, a path, or a seekable binary file (e.g. a Streamlit UploadedFile);
+    # owned files are closed together with the attachment.
+    def __init__(self, file_name, data, content_type=None, owned=False):
+        self.file_name = file_name
+        self.data = data
+        self.owned = owned
+        self._content_type = content_type
+        self._size = None
+
+    @contextmanager
+    def open(self):
+        if isinstance(self.data, (bytes, bytearray, memoryview)):
+            yield io.BytesIO(self.data)
+        elif isinstance(self.data, (str, os.PathLike)):
+            with open(self.data, 'rb') as f:
+                yield f
+        else:
+            self.data.seek(0)
+            yield self.data
+
+    @property
+    def size(self):
+        if self._size is None:
+            if isinstance(self.data, (bytes, bytearray, memoryview)):
+                self._size = len(self.data)
+            elif isinstance(self.data, (str, os.PathLike)):
+                self._size = os.path.getsize(self.data)
+            else:
+                self._size = self.data.seek(0, io.SEEK_END)
+        return self._size
+
+    @property
+    def content_type(self):
+        if self._content_type is None:
+            with self.open() as f:
+                head = f.read(SNIFF_SIZE)
+                f.seek(0)
+                self._content_type = sniff_content_type(head, self.file_name, f)
+        return self._content_type
+
+    def close(self):
+        if self.owned:
+            self.data.close()
+
+
+def _zip_largest(attachments, max_bytes):
+    # Move the largest attachments into one zip until everything fits. Returns (attachments, None), or
+    # (None, compressed size of each attachment) if even zipping all of them isn't enough.
+    zipped = []
+    rest = sum(attachment.size for attachment in attachments)
+    spool = tempfile.SpooledTemporaryFile(SPOOL_SIZE)
+    with zipfile.ZipFile(spool, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for attachment in sorted(attachments, key=lambda attachment: attachment.size, reverse=True):
+            if rest + spool.tell() <= max_bytes:
+                break
+            with attachment.open() as source, archive.open(attachment.file_name, 'w') as target:
+                shutil.copyfileobj(source, target, CHUNK_SIZE)
+            zipped.append(attachment)
+            rest -= attachment.size
+    if rest + spool.tell() > max_bytes:
+        spool.close()
+        return None, {attachment: info.compress_size for attachment, info in zip(zipped, archive.infolist())}
+    logger.info('Zipped %d attachment(s) to stay under %d bytes', len(zipped), max_bytes)
+    return [attachment for attachment in attachments if attachment not in zipped] + \
+        [Attachment(ZIP_NAME, spool, 'application/zip', owned=True)], None
+
+
+# Returns (attachments whose sizes add up to at most max_bytes, names of the files left out)
+def fit_attachments(attachments, max_bytes=EMAIL_MAX_BYTES):
+    attachments = list(attachments)
+    omitted = []
+    while attachments and sum(attachment.size for attachment in attachments) > max_bytes:
+        fitted, compressed = _zip_largest(attachments, max_bytes)
+        if fitted is not None:
+            return fitted, omitted
+        # Leave out the file that is still largest once compressed (a photo, not a text file that zips well)
+        largest = max(attachments, key=lambda attachment: compressed[attachment])
+        attachments.remove(largest)
+        omitted.append(largest.file_name)
+    return attachments, omitted
+
+
+class MessageStream:
+    # A serialized message in a (temporary or database) file, with the envelope needed to send it
+    def __init__(self, sender, recipients, file, size):
+        self.sender = sender
+        self.recipients = recipients
+        self.file = file
+        self.size = size
+
+    @classmethod
+    def from_file(cls, file, size):
+        # Envelope from the From / To / Cc headers, as smtplib's send_message() does; only the header block is read
+        head = b''
+        file.seek(0)
+        while b'\r\n\r\n' not in head:
+            chunk = file.read(SNIFF_SIZE)
+            if not chunk:
+                break
+            head += chunk
+        headers = BytesHeaderParser(policy=policy.SMTP).parsebytes(head.partition(b'\r\n\r\n')[0] + b'\r\n\r\n')
+        sender = getaddresses([headers.get('Sender') or headers.get('From', '')])[0][1]
+        recipients = [address for _, address in getaddresses(headers.get_all('To', []) + headers.get_all('Cc', []))]
+        return cls(sender, recipients, file, size)
+
+    def chunks(self, chunk_size=CHUNK_SIZE):
+        self.file.seek(0)
+        while True:
+            chunk = self.file.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    def as_bytes(self):
+        return b''.join(self.chunks())
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _write_headers(out, part):
+    for name, value in part.items():
+        out.write(policy.SMTP.fold_binary(name, value))
+    out.write(b'\r\n')
+
+
+def _write_base64(source, out):
+    pending = b''
+    while True:
+        chunk = source.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        chunk = pending + chunk
+        whole_lines = len(chunk) - len(chunk) % 57  # a short read must not leave '=' padding mid-stream
+        out.write(base64.encodebytes(chunk[:whole_lines]).replace(b'\n', b'\r\n'))
+        pending = chunk[whole_lines:]
+    if pending:
+        out.write(base64.encodebytes(pending).replace(b'\n', b'\r\n'))
+
+
+def build_message(sender, recipients, subject, body, attachments=(), max_bytes=EMAIL_MAX_BYTES):
+    attachments, omitted = fit_attachments(attachments, max_bytes)
+    if omitted:
+        logger.warning('Left %d attachment(s) out of "%s" to stay under %d bytes', len(omitted), subject, max_bytes)
+        body += '<p>Not attached (over the email size limit): ' + ', '.join(html.escape(name) for name in omitted) + '</p>'
+
+    msg = EmailMessage()
+    msg['From'] = sender
+    msg['To'] = ", ".join(recipients)
+    msg['Subject'] = _HEADER_CONTROL.sub('', subject)
+    spool = tempfile.SpooledTemporaryFile(SPOOL_SIZE)
+    try:
+        if not attachments:
+            msg.set_content(body, subtype='html')
+            spool.write(msg.as_bytes(policy=policy.SMTP))
+        else:
+            boundary = f'==============={uuid.uuid4().hex}=='
+            msg['MIME-Version'] = '1.0'
+            msg['Content-Type'] = f'multipart/mixed; boundary="{boundary}"'
+            _write_headers(spool, msg)
+            text = MIMEPart()
+            text.set_content(body, subtype='html')
+            spool.write(f'--{boundary}\r\n'.encode('ascii'))
+            spool.write(text.as_bytes(policy=policy.SMTP))
+            for attachment in attachments:
+                part = MIMEPart()
+                part['Content-Type'] = attachment.content_type
+                part['Content-Transfer-Encoding'] = 'base64'
+                part.add_header('Content-Disposition', 'attachment', filename=_HEADER_CONTROL.sub('', attachment.file_name))
+                spool.write(f'\r\n--{boundary}\r\n'.encode('ascii'))
+                _write_headers(spool, part)
+                with attachment.open() as source:
+                    _write_base64(source, spool)
+            spool.write(f'\r\n--{boundary}--\r\n'.encode('ascii'))
+    except BaseException:
+        spool.close()
+        raise
+    finally:
+        for attachment in attachments:
+            attachment.close()
+    envelope = getaddresses([sender, *recipients])
+    return MessageStream(envelope[0][1], [address for _, address in envelope[1:]], spool, spool.tell())
@@ -0,0 +1,270 @@
+from mailer import get_pool
+from mime import MessageStream
+from telemetry import get_logger, correlation, log_summary, configure_logging
+from metrics import Gauge
+import threading
+import smtplib
+import sqlite3
+import random
+import time
+import sys
+import os
+
+# Durable outbox for enrollment emails
+#
+# Every rendered submission is written here (team email with the DOCX attached, plus
+# the learner thank-you email) before anything is sent. A single dispatcher thread
+# drains due messages through the pooled SMTP session, backing off exponentially on
+# failure. Rows survive a restart: pending messages are picked up again as soon as the
+# dispatcher starts, and `python outbox.py replay` re-queues them immediately.
+#
+# Messages carry the learner's personal data (the DOCX, uploaded ID scans), so a row's
+# message is emptied the moment it is sent; the row itself - just the dedupe key and
+# delivery metadata - is deleted SENT_RETENTION later. Dead messages keep their content
+# until they are replayed or removed by hand.
+
+OUTBOX_DB = os.environ.get('OUTBOX_DB', 'outbox.sqlite3')
+RETRY_BASE = 30  # seconds before the first retry
+RETRY_MAX = 3600  # cap on the backoff interval
+MAX_ATTEMPTS = 12  # roughly a day of retries before a message is parked as dead
+CLAIM_LEASE = 300  # seconds a message is held by the dispatcher sending it; another one retries it after that
+BATCH_SIZE = 20
+SENT_RETENTION = 7 * 24 * 3600  # seconds a sent row (without its message) is kept for dedupe and auditing
+
+PENDING = 'pending'
+SENT = 'sent'
+DEAD = 'dead'
+
+# Failures no retry will fix
+PERMANENT_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPNotSupportedError)
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    dedupe_key TEXT NOT NULL UNIQUE,
+    sender TEXT NOT NULL,
+    message BLOB NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL,
+    last_error TEXT,
+    created REAL NOT NULL,
+    sent_at REAL
+);
+CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt);
+'''
+
+logger = get_logger('outbox')
+
+_credentials = {}  # sender -> password, kept in memory only
+_wakeup = threading.Event()
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+_schema_ready = set()
+
+
+def _connect(path=None):
+    path = path or OUTBOX_DB
+    db = sqlite3.connect(path, timeout=30, isolation_level=None)
+    if path not in _schema_ready:
+        db.execute('PRAGMA journal_mode=WAL')
+        db.executescript(_SCHEMA)
+        # Rows sent before messages were emptied on delivery
+        db.execute("UPDATE outbox SET message = X'' WHERE status = ? AND length(message) > 0", (SENT,))
+        _schema_ready.add(path)
+    return db
+
+
+def backoff(attempts):
+    # Exponential backoff with jitter so a recovered mail server isn't hit by every message at once
+    delay = min(RETRY_BASE * 2 ** (attempts - 1), RETRY_MAX)
+    return delay * random.uniform(0.8, 1.2)
+
+
+# Persist a batch of (dedupe_key, sender, mime.MessageStream) in one transaction; returns how many were new
+# (dedupe_key already seen -> ignored). Messages are copied in chunks, never loaded whole.
+def enqueue(messages):
+    now = time.time()
+    db = _connect()
+    try:
+        db.execute('BEGIN IMMEDIATE')
+        db.execute('DELETE FROM outbox WHERE status = ? AND sent_at < ?', (SENT, now - SENT_RETENTION))
+        added = 0
+        for dedupe_key, sender, msg in messages:
+            cursor = db.execute(
+                'INSERT OR IGNORE INTO outbox (dedupe_key, sender, message, next_attempt, created) VALUES (?, ?, zeroblob(?), ?, ?)',
+                (dedupe_key, sender, msg.size, now, now)
+            )
+            if cursor.rowcount:
+                with db.blobopen('outbox', 'message', cursor.lastrowid) as blob:
+                    for chunk in msg.chunks():
+                        blob.write(chunk)
+            added += cursor.rowcount
+        db.execute('COMMIT')
+    finally:
+        db.close()
+    _wakeup.set()
+    return added
+
+
+def _deliver(row):
+    message_id, dedupe_key, sender, attempts = row
+    password = _credentials[sender]
+    job_id, _, kind = dedupe_key.rpartition(':')
+    db = _connect()
+    # Logged under the submission's job id, so a delivery can be matched with its render
+    with correlation(job_id or dedupe_key) as timings:
+        try:
+            try:
+                # Streamed from the row to the SMTP socket
+                with db.blobopen('outbox', 'message', message_id, readonly=True) as blob:
+                    size = len(blob)
+                    get_pool(sender, password).send_message(MessageStream.from_file(blob, size))
+            except Exception as e:
+                attempts += 1
+                if isinstance(e, PERMANENT_ERRORS) or attempts >= MAX_ATTEMPTS:
+                    logger.error('Outbox message %s (%s) failed permanently: %s', message_id, kind, e)
+                    db.execute('UPDATE outbox SET status = ?, attempts = ?, last_error = ? WHERE id = ?',
+                               (DEAD, attempts, str(e), message_id))
+                else:
+                    logger.warning('Outbox message %s (%s) failed (attempt %d), retrying later: %s',
+                                   message_id, kind, attempts, e)
+                    db.execute('UPDATE outbox SET attempts = ?, next_attempt = ?, last_error = ? WHERE id = ?',
+                               (attempts, time.time() + backoff(attempts), str(e), message_id))
+                return False
+            db.execute("UPDATE outbox SET status = ?, attempts = ?, sent_at = ?, last_error = NULL, message = X'' WHERE id = ?",
+                       (SENT, attempts + 1, time.time(), message_id))
+            log_summary(logger, 'email sent', {
+                'message_id': message_id, 'kind': kind, 'attempt': attempts + 1, 'bytes': size,
+                **{f'{name}_ms': elapsed for name, elapsed in timings.items()},
+            })
+            return True
+        finally:
+            db.close()
+
+
+def _claim(db, senders):
+    # Lease the next due message for this dispatcher; None when nothing is due. Every process (Streamlit
+    # workers, submission workers) may run a dispatcher on the same database: a message is only sent by
+    # the one whose lease update wins. One message is leased at a time, right before it is sent, so a
+    # slow send can't let the lease on messages still waiting behind it run out.
+    while True:
+        now = time.time()
+        row = db.execute(
+            f'SELECT id, dedupe_key, sender, attempts, next_attempt FROM outbox WHERE status = ? AND next_attempt <= ? '
+            f'AND sender IN ({", ".join("?" * len(senders))}) ORDER BY id LIMIT 1',
+            (PENDING, now, *senders)
+        ).fetchone()
+        if row is None:
+            return None
+        *row, next_attempt = row
+        cursor = db.execute('UPDATE outbox SET next_attempt = ? WHERE id = ? AND status = ? AND next_attempt = ?',
+                            (now + CLAIM_LEASE, row[0], PENDING, next_attempt))
+        if cursor.rowcount:
+            return row
+
+
+# Send up to BATCH_SIZE messages that are due; returns the number delivered
+def drain():
+    senders = list(_credentials)
+    if not senders:
+        return 0
+    delivered = 0
+    db = _connect()
+    try:
+        for _ in range(BATCH_SIZE):
+            row = _claim(db, senders)
+            if row is None:
+                break
+            delivered += _deliver(row)
+    finally:
+        db.close()
+    return delivered
+
+
+def _next_due():
+    senders = list(_credentials)
+    db = _connect()
+    try:
+        row = db.execute(
+            f'SELECT MIN(next_attempt) FROM outbox WHERE status = ? AND sender IN ({", ".join("?" * len(senders))})',
+            (PENDING, *senders)
+        ).fetchone()
+    finally:
+        db.close()
+    return row[0]
+
+
+def _run():
+    while True:
+        _wakeup.clear()
+        try:
+            if drain() == BATCH_SIZE:
+                continue
+            next_due = _next_due()
+        except Exception:
+            logger.exception('Outbox dispatcher error')
+            next_due = None
+        timeout = RETRY_BASE if next_due is None else max(next_due - time.time(), 0.1)
+        _wakeup.wait(min(timeout, RETRY_BASE))
+
+
+# Register sender credentials and make sure the dispatcher thread is running (safe to call on every rerun)
+def start_dispatcher(sender_email, sender_password):
+    global _dispatcher
+    if sender_email and sender_password and _credentials.get(sender_email) != sender_password:
+        _credentials[sender_email] = sender_password
+        _wakeup.set()
+    with _dispatcher_lock:
+        if _dispatcher is None or not _dispatcher.is_alive():
+            _dispatcher = threading.Thread(target=_run, name='outbox-dispatcher', daemon=True)
+            _dispatcher.start()
+
+
+# Make pending (and optionally dead) messages due right now, e.g. after a mail outage is fixed
+def replay(include_dead=False):
+    statuses = (PENDING, DEAD) if include_dead else (PENDING,)
+    db = _connect()
+    try:
+        # A revived dead message starts over with a full set of attempts
+        cursor = db.execute(
+            'UPDATE outbox SET status = ?, next_attempt = ?, '
+            'attempts = CASE WHEN status = ? THEN 0 ELSE attempts END, '
+            'last_error = CASE WHEN status = ? THEN NULL ELSE last_error END '
+            f'WHERE status IN ({", ".join("?" * len(statuses))})',
+            (PENDING, time.time(), DEAD, DEAD, *statuses)
+        )
+        count = cursor.rowcount
+    finally:
+        db.close()
+    _wakeup.set()
+    return count
+
+
+def stats():
+    db = _connect()
+    try:
+        return dict(db.execute('SELECT status, COUNT(*) FROM outbox GROUP BY status').fetchall())
+    finally:
+        db.close()
+
+
+# Pending and dead messages are the SMTP health signal: read from the database on each scrape
+OUTBOX_MESSAGES = Gauge('outbox_messages', 'Messages in the outbox by status', ['status'],
+                        callback=lambda: {(status,): count for status, count in stats().items()})
+
+
+if __name__ == '__main__':
+    # python outbox.py [status | replay [--dead] [--send]]
+    # --send delivers straight away using sender_email / sender_password from the environment or .env
+    configure_logging()
+    command = sys.argv[1] if len(sys.argv) > 1 else 'status'
+    if command == 'replay':
+        print(f"Re-queued {replay(include_dead='--dead' in sys.argv)} message(s)")
+        if '--send' in sys.argv:
+            from dotenv import load_dotenv
+            load_dotenv()
+            _credentials[os.environ['sender_email']] = os.environ['sender_password']
+            while drain():
+                pass
+    print(stats())
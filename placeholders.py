@@ -0,0 +1,80 @@
+from datetime import date
+from functools import lru_cache
+from form_schema import PLACEHOLDER_FIELDS
+from template_engine import load_template
+from telemetry import get_logger, configure_logging
+import sys
+
+# Placeholder mapping for ph_skills_bootcamp.docx
+#
+# Builds the value for every placeholder in the enrollment form from a learner's answers.
+# `state` is anything with attribute access to the answers: st.session_state in the app,
+# or a LearnerRecord when rendering offline (see render_batch.py).
+#
+# The mapping is generated from the field schema (form_schema.py), so a new form field
+# needs one schema entry and nothing here. validate_template() compares the schema with
+# the placeholders actually present in the template.
+#
+#   python placeholders.py [template.docx]     report unknown / unused placeholders
+
+TEMPLATE_FILE = "ph_skills_bootcamp.docx"
+DATE_FORMAT = "%d-%m-%Y"
+SUBMISSION_DATE_PLACEHOLDER = 'ph50'
+
+logger = get_logger('placeholders')
+
+PLACEHOLDER_KEYS = frozenset(
+    [placeholder for field in PLACEHOLDER_FIELDS
+     for placeholder in (field.placeholder.values() if isinstance(field.placeholder, dict) else [field.placeholder])]
+    + [SUBMISSION_DATE_PLACEHOLDER]
+)
+
+
+def calculate_age(born):
+    today = date.today()
+    return today.year - born.year - ((today.month, today.day) < (born.month, born.day))
+
+
+def format_value(value):
+    if isinstance(value, date):
+        return value.strftime(DATE_FORMAT)
+    return str(value)
+
+
+def build_placeholder_values(state):
+    # Every value is converted to its final text here, in one pass, so rendering only has to escape it
+    values = {}
+    for field in PLACEHOLDER_FIELDS:
+        value = getattr(state, field.key)
+        if isinstance(field.placeholder, dict):
+            for answer, placeholder in field.placeholder.items():
+                values[placeholder] = format_value(value[answer])
+        else:
+            values[field.placeholder] = format_value(value)
+    values[SUBMISSION_DATE_PLACEHOLDER] = format_value(date.today())
+    return values
+
+
+@lru_cache(maxsize=None)
+def validate_template(template_file=TEMPLATE_FILE):
+    # Returns (unknown, unused): placeholders in the template that no field fills, and fields the
+    # template has no placeholder for. Checked once per process; compiling here also warms the
+    # template cache with exactly the keys build_placeholder_values() produces.
+    template = load_template(template_file, PLACEHOLDER_KEYS)
+    unknown = sorted(template.tokens - PLACEHOLDER_KEYS)
+    unused = sorted(PLACEHOLDER_KEYS - template.found_keys)
+    if unknown:
+        logger.warning('%s: placeholders with no form field: %s', template_file, ', '.join(unknown))
+    if unused:
+        logger.warning('%s: form fields with no placeholder: %s', template_file, ', '.join(unused))
+    return unknown, unused
+
+
+def document_file_name(state):
+    return f"SkillsBootcamp_Form_Submission_{state.first_name}_{state.sir_name}.docx"
+
+
+if __name__ == '__main__':
+    configure_logging()
+    unknown, _ = validate_template(sys.argv[1] if len(sys.argv) > 1 else TEMPLATE_FILE)
+    sys.exit(1 if unknown else 0)
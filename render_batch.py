@@ -0,0 +1,216 @@
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime
+from PIL import Image as PILImage
+from placeholders import build_placeholder_values, document_file_name, calculate_age, format_value, validate_template, TEMPLATE_FILE
+from signature import process_signature
+from template_engine import load_template
+from telemetry import configure_logging
+import numpy as np
+import argparse
+import zipfile
+import json
+import time
+import csv
+import sys
+import os
+
+# Offline / bulk rendering of enrollment forms
+#
+# Fills ph_skills_bootcamp.docx for many learners at once - re-issuing documents after a
+# template revision, or learners registered by phone - without clicking through the app.
+# Each input record carries the same answers the app keeps in st.session_state (first_name,
+# sir_name, dob, ph63, ...); missing answers are left blank. Records are rendered across a
+# process pool and every document is written as soon as it is ready.
+#
+#   python render_batch.py learners.csv -o out/          one .docx per learner
+#   python render_batch.py learners.jsonl -o forms.zip    everything in one zip
+#
+# Extra columns understood besides the session state names:
+#   ethnicity_31 .. ethnicity_48   flattened ethnicity_vars
+#   signature                      path to an image of the learner's signature
+#   submission_date                date printed as the submission date (defaults to today)
+
+DATE_FORMATS = ('%Y-%m-%d', '%d-%m-%Y', '%d/%m/%Y')
+PROGRESS_EVERY = 100
+
+
+class LearnerRecord(dict):
+    # One learner's answers with attribute access, standing in for st.session_state
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return self.get(name, '')
+
+
+def parse_date(value):
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value.strip(), date_format).date()
+        except ValueError:
+            pass
+    raise ValueError(f"unrecognised date '{value}'")
+
+
+def read_records(path):
+    # Yields (line number, raw record, error) without loading the whole file; a line that can't be
+    # parsed comes back with its error instead of a record, so one bad line doesn't stop the batch
+    if path.lower().endswith('.csv'):
+        with open(path, newline='', encoding='utf-8-sig') as f:
+            reader = csv.DictReader(f)
+            while True:
+                try:
+                    record = next(reader)
+                except StopIteration:
+                    return
+                except csv.Error as e:
+                    # line_num still points at the end of the previous row; the bad one starts on the next line
+                    yield f'line {reader.line_num + 1}', None, e
+                    continue
+                yield f'line {reader.line_num}', record, None
+    else:
+        with open(path, encoding='utf-8') as f:
+            for line_no, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                    if not isinstance(record, dict):
+                        raise ValueError(f'expected a JSON object, got {type(record).__name__}')
+                except ValueError as e:
+                    yield f'line {line_no}', None, e
+                    continue
+                yield f'line {line_no}', record, None
+
+
+def learner_record(raw):
+    record = LearnerRecord((key, value) for key, value in raw.items() if key and value is not None)
+    if not record.get('dob'):
+        raise ValueError('dob is required')
+    if not hasattr(record['dob'], 'strftime'):
+        record['dob'] = parse_date(record['dob'])
+    if not record.get('current_age'):
+        record['current_age'] = calculate_age(record['dob'])
+    if 'ph96' not in record:
+        record['ph96'] = 0.0
+    if not isinstance(record.get('ethnicity_vars'), dict):
+        record['ethnicity_vars'] = {f'ethnicity_{i}': record.get(f'ethnicity_{i}', '') for i in range(31, 49)}
+    return record
+
+
+def load_signature(path):
+    # Any image on a white or transparent background goes through the same processing as the canvas
+    with PILImage.open(path) as image:
+        return process_signature(np.asarray(image.convert('RGBA')))
+
+
+# Runs in a worker process; each worker compiles the template once and keeps it
+def render_record(template_file, raw):
+    record = learner_record(raw)
+    placeholder_values = build_placeholder_values(record)
+    if record.get('submission_date'):
+        placeholder_values['ph50'] = format_value(parse_date(str(record['submission_date'])))
+    signature_png = load_signature(record['signature']) if record.get('signature') else None
+    template = load_template(template_file, placeholder_values.keys())
+    return document_file_name(record), template.render(placeholder_values, signature_png)
+
+
+class DirectoryOutput:
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def write(self, file_name, document):
+        with open(os.path.join(self.path, file_name), 'wb') as f:
+            f.write(document)
+
+    def close(self):
+        pass
+
+
+class ZipOutput:
+    def __init__(self, path):
+        # DOCX members are already deflated, so the outer zip just stores them
+        self.zf = zipfile.ZipFile(path, 'w', zipfile.ZIP_STORED)
+
+    def write(self, file_name, document):
+        self.zf.writestr(file_name, document)
+
+    def close(self):
+        self.zf.close()
+
+
+def unique_name(file_name, used):
+    # Two learners with the same name must not overwrite each other's form
+    stem, extension = os.path.splitext(file_name)
+    candidate, n = file_name, 1
+    while candidate in used:
+        n += 1
+        candidate = f'{stem}_{n}{extension}'
+    used.add(candidate)
+    return candidate
+
+
+def render_batch(input_file, output, template_file=TEMPLATE_FILE, workers=None):
+    # Returns (rendered, failed); keeps at most a few records per worker in flight
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = workers * 4
+    used, rendered, failed = set(), 0, 0
+    started = time.perf_counter()
+
+    def report(source, error):
+        nonlocal failed
+        failed += 1
+        print(f"{input_file} {source}: {error}", file=sys.stderr)
+
+    def collect(futures):
+        nonlocal rendered
+        for future in futures:
+            source = pending.pop(future)
+            try:
+                file_name, document = future.result()
+            except Exception as e:
+                report(source, e)
+                continue
+            output.write(unique_name(file_name, used), document)
+            rendered += 1
+            if rendered % PROGRESS_EVERY == 0:
+                print(f"{rendered} documents, {rendered / (time.perf_counter() - started):.1f} docs/sec")
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = {}
+        for source, raw, error in read_records(input_file):
+            if error is not None:
+                report(source, error)
+                continue
+            pending[executor.submit(render_record, template_file, raw)] = source
+            if len(pending) >= max_in_flight:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+        collect(list(pending))
+
+    elapsed = time.perf_counter() - started
+    print(f"Rendered {rendered} document(s) in {elapsed:.2f}s ({rendered / elapsed if elapsed else 0:.1f} docs/sec), "
+          f"{failed} failed")
+    return rendered, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Render enrollment forms for many learners from CSV or JSONL')
+    parser.add_argument('input', help='learner records (.csv, or one JSON object per line)')
+    parser.add_argument('-o', '--output', required=True, help='output directory, or a .zip file')
+    parser.add_argument('-t', '--template', default=TEMPLATE_FILE, help='DOCX template (default: %(default)s)')
+    parser.add_argument('-w', '--workers', type=int, default=None, help='worker processes (default: CPU count)')
+    args = parser.parse_args()
+
+    configure_logging()
+    validate_template(args.template)
+    output = ZipOutput(args.output) if args.output.lower().endswith('.zip') else DirectoryOutput(args.output)
+    try:
+        _, failed = render_batch(args.input, output, args.template, args.workers)
+    finally:
+        output.close()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+from collections import namedtuple
+from PIL import Image as PILImage
+import numpy as np
+import io
+
+# Signature processing for the st_canvas drawing
+#
+# The canvas array is converted exactly once per submission: cropped to the inked
+# bounding box, downscaled to fit the form's signature cell, quantised to a small
+# grey palette and encoded as PNG. The resulting bytes are what every ph_signature
+# anchor in the document embeds.
+
+SIGNATURE_MAX_WIDTH = 200
+SIGNATURE_MAX_HEIGHT = 50
+SIGNATURE_COLORS = 16  # 4-bit palette is plenty for a black stroke on white
+SIGNATURE_PADDING = 4  # pixels kept around the ink so strokes aren't clipped
+
+
+def resize_image_to_fit_cell(image, max_width, max_height):
+    width, height = image.size
+    aspect_ratio = width / height
+
+    if width > max_width:
+        width = max_width
+        height = int(width / aspect_ratio)
+
+    if height > max_height:
+        height = max_height
+        width = int(height * aspect_ratio)
+
+    return image.resize((max(width, 1), max(height, 1)), PILImage.LANCZOS)
+
+
+# Fewer inked pixels than this is a stray tap, not a signature (a 5px stroke dot is ~20 pixels)
+MIN_INK_PIXELS = 60
+
+SignatureInk = namedtuple('SignatureInk', 'pixels bbox drawn')
+ANALYSE_BLOCK_ROWS = 16  # rows reduced at a time, so no temporary is ever canvas-sized
+
+
+def _analyse(canvas, min_ink):
+    height, width = canvas.shape[:2]
+    # Read each RGBA pixel as one little-endian word (no copy): alpha is the top byte.
+    # st_canvas hands back the drawing layer, so ink is simply alpha > 0 - unless the canvas
+    # is fully opaque (white background baked in), then ink is whatever is darker than near-white.
+    words = canvas.view('<u4').reshape(height, width)
+    opaque = int(words.min()) >= 0x01000000
+    pixels = 0
+    inked_rows = np.zeros(height, dtype=bool)
+    inked_cols = np.zeros(width, dtype=bool)
+    for start in range(0, height, ANALYSE_BLOCK_ROWS):
+        block = words[start:start + ANALYSE_BLOCK_ROWS]
+        ink = (block & 0xFF) < 250 if opaque else block >= 0x01000000
+        pixels += int(np.count_nonzero(ink))
+        inked_rows[start:start + len(block)] = ink.any(axis=1)
+        inked_cols |= ink.any(axis=0)
+    if pixels < min_ink:
+        return SignatureInk(pixels, None, False)
+
+    rows, cols = np.flatnonzero(inked_rows), np.flatnonzero(inked_cols)
+    return SignatureInk(pixels, (int(rows[0]), int(rows[-1]) + 1, int(cols[0]), int(cols[-1]) + 1), True)
+
+
+def analyse_signature(canvas, min_ink=MIN_INK_PIXELS):
+    # Ink pixel count and bounding box (top, bottom, left, right) of a canvas drawing. Not cached:
+    # one pass costs less than hashing the canvas to recognise a drawing seen before.
+    if not isinstance(canvas, np.ndarray) or canvas.ndim != 3 or canvas.shape[2] != 4 or canvas.size == 0:
+        return SignatureInk(0, None, False)
+    return _analyse(np.ascontiguousarray(canvas, dtype=np.uint8), min_ink)
+
+
+def process_signature(canvas, max_width=SIGNATURE_MAX_WIDTH, max_height=SIGNATURE_MAX_HEIGHT):
+    # Returns PNG bytes for the signature, or None if nothing was drawn
+    canvas = np.asarray(canvas, dtype=np.uint8)
+    ink = analyse_signature(canvas)
+    if not ink.drawn:
+        return None
+
+    top, bottom, left, right = ink.bbox
+    height, width = canvas.shape[:2]
+    top, left = max(top - SIGNATURE_PADDING, 0), max(left - SIGNATURE_PADDING, 0)
+    bottom, right = min(bottom + SIGNATURE_PADDING, height), min(right + SIGNATURE_PADDING, width)
+    cropped = canvas[top:bottom, left:right]
+
+    # Flatten onto white: transparent canvas pixels and the white background end up the same
+    alpha = cropped[..., 3:4].astype(np.float32) / 255
+    grey = (cropped[..., :3].astype(np.float32) * alpha + 255 * (1 - alpha)).mean(axis=2)
+    image = PILImage.fromarray(grey.round().astype(np.uint8), 'L')
+
+    image = resize_image_to_fit_cell(image, max_width, max_height)
+    image = image.quantize(colors=SIGNATURE_COLORS)
+
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG', optimize=True)
+    return buffer.getvalue()
@@ -0,0 +1,214 @@
+from concurrent.futures import ThreadPoolExecutor
+from mailer import build_email
+from mime import Attachment
+from outbox import enqueue, start_dispatcher
+from template_engine import load_template
+from workspace import sweep_stale_workspaces
+from telemetry import get_logger, correlation, span, log_summary
+from metrics import RENDER_SECONDS, SUBMISSIONS_IN_FLIGHT, SUBMISSIONS_FINISHED
+from job_queue import QUEUED, RENDERING, SENDING, DONE, FAILED  # noqa: F401 (re-exported for the app)
+import job_queue
+import threading
+import shutil
+import time
+import uuid
+import os
+
+# Background submission pipeline
+#
+# The Streamlit script only accepts a submission (submit_enrollment returns a job id
+# straight away); rendering the DOCX and queuing both emails in the durable outbox
+# happens on a worker thread. The page polls get_job() on each rerun until the job is
+# done or failed. Delivery itself is left to the outbox dispatcher.
+#
+# SUBMISSION_BACKEND=queue hands the work to separate worker processes instead, through the
+# shared SQLite queue in job_queue.py (see worker.py), so several Streamlit processes can
+# share one pool of renderers and rendering is no longer bound to their GIL.
+
+SUBMISSION_BACKEND = os.environ.get('SUBMISSION_BACKEND', 'thread')  # 'thread' or 'queue'
+MAX_WORKERS = 4
+JOB_TTL = job_queue.JOB_TTL
+
+logger = get_logger('submissions')
+
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='submission')
+sweep_stale_workspaces()  # leftovers from a previous process
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+
+# Names of the buffers a submission keeps in its workspace
+SIGNATURE_BUFFER = 'signature.png'
+DOCUMENT_BUFFER = 'document.docx'
+
+
+class SubmissionJob:
+    def __init__(self, job_id, template_file, file_name, placeholder_values, workspace, emails):
+        self.job_id = job_id
+        self.template_file = template_file
+        self.file_name = file_name
+        self.placeholder_values = placeholder_values
+        self.workspace = workspace
+        self.emails = emails
+        self.status = QUEUED
+        self.error = None
+        self.finished_at = None
+
+    @property
+    def finished(self):
+        return self.status in (DONE, FAILED)
+
+    @property
+    def document(self):
+        return self.workspace.getvalue(DOCUMENT_BUFFER)
+
+
+# Render the filled enrollment form; everything stays in memory and the DOCX bytes are returned.
+# signature_png is the already-processed signature (see signature.process_signature) or None.
+# Raises if the document can't be rendered: a submission without its form must fail, not look done.
+def replace_placeholders(template_file, placeholder_values, signature_png):
+    with RENDER_SECONDS.time():
+        with span('template_load'):
+            template = load_template(template_file, placeholder_values.keys())
+        document_bytes = template.render(placeholder_values, signature_png)
+    if not document_bytes:
+        raise ValueError(f'Rendering {template_file} produced an empty document')
+    logger.debug('Rendered %s: %d bytes', template_file, len(document_bytes))
+    return document_bytes
+
+
+# Render the document and queue both emails in the outbox; returns the DOCX bytes. Raises - and queues no email at
+# all, so the learner isn't thanked for an enrollment the team never receives - if rendering or queuing fails.
+# emails['files'] are the learner's uploads (see uploads.py); attachments are (file name, data) pairs sent to
+# the team besides those and the document.
+def process_submission(job_id, template_file, file_name, placeholder_values, signature_png, emails, attachments=(), on_sending=None):
+    document = replace_placeholders(template_file, placeholder_values, signature_png)
+    if on_sending is not None:
+        on_sending(document)
+
+    messages = []
+    with span('build_email'):
+        # Email to team with attachments
+        messages.append((f'{job_id}:team', emails['sender_email'], build_email(
+            emails['sender_email'], emails['team_email'], emails['subject_team'], emails['body_team'],
+            emails.get('files'), list(attachments) + [(file_name, document)])))
+
+        # Thank you email to learner
+        messages.append((f'{job_id}:learner', emails['sender_email'], build_email(
+            emails['sender_email'], emails['learner_email'], emails['subject_learner'], emails['body_learner'])))
+
+    # Both messages are on disk before any delivery is attempted; the dispatcher sends and retries them
+    try:
+        with span('enqueue'):
+            enqueue(messages)
+    finally:
+        for _, _, msg in messages:
+            msg.close()
+    start_dispatcher(emails['sender_email'], emails['sender_password'])
+    return document
+
+
+def _log_finished(status, document, timings, started):
+    SUBMISSIONS_FINISHED.inc(status=status)
+    log_summary(logger, 'submission', {
+        'status': status,
+        'document_bytes': len(document),
+        **{f'{name}_ms': elapsed for name, elapsed in timings.items()},
+        'total_ms': (time.perf_counter() - started) * 1000,
+    })
+
+
+def _process(job):
+    started, document = time.perf_counter(), b''
+
+    def on_sending(rendered):
+        job.workspace.buffer(DOCUMENT_BUFFER).write(rendered)
+        job.status = SENDING
+
+    with correlation(job.job_id) as timings:
+        try:
+            job.status = RENDERING
+            document = process_submission(job.job_id, job.template_file, job.file_name, job.placeholder_values,
+                                          job.workspace.getvalue(SIGNATURE_BUFFER) or None, job.emails, on_sending=on_sending)
+            job.status = DONE
+        except Exception as e:
+            logger.exception('Submission failed')
+            job.error = str(e)
+            job.status = FAILED
+        finally:
+            job.finished_at = time.time()
+            SUBMISSIONS_IN_FLIGHT.dec()
+            _log_finished(job.status, document, timings, started)
+
+
+# One job from the shared queue, in a worker process; returns False if the queue was empty
+def process_queued_job(worker_name, sender_password):
+    claimed = job_queue.claim_job(worker_name)
+    if claimed is None:
+        return False
+    job_id, template_file, file_name, placeholder_values, signature_png, emails, files = claimed
+    started, document, status, error = time.perf_counter(), b'', FAILED, None
+    with correlation(job_id) as timings:
+        try:
+            emails['sender_password'] = sender_password
+            emails['files'] = [Attachment(name, path, content_type) for name, path, content_type in files]
+            document = process_submission(job_id, template_file, file_name, placeholder_values, signature_png, emails)
+            status = DONE
+        except Exception as e:
+            logger.exception('Submission failed')
+            error = str(e)
+        finally:
+            job_queue.finish_job(job_id, status, document, error)
+            _log_finished(status, document, timings, started)
+            # The uploads were in the submission's workspace, handed over by submit_enrollment()
+            for directory in {os.path.dirname(path) for _, path, _ in files}:
+                shutil.rmtree(directory, ignore_errors=True)
+    return True
+
+
+def _prune_jobs():
+    cutoff = time.time() - JOB_TTL
+    for job_id in [job_id for job_id, job in _jobs.items() if job.finished and job.finished_at < cutoff]:
+        _jobs.pop(job_id).workspace.close()
+
+
+# Accept a submission and hand it to the worker pool; returns the job id to poll.
+# The job owns the workspace (holding SIGNATURE_BUFFER) from here on and closes it when released.
+def submit_enrollment(template_file, file_name, placeholder_values, workspace, emails):
+    job_id = uuid.uuid4().hex
+    if SUBMISSION_BACKEND == 'queue':
+        # Everything else the worker needs is copied into the queue row; uploaded files stay on disk
+        # where they are and the worker removes the workspace directory when it is done with them
+        files = [(attachment.file_name, attachment.data, attachment.content_type) for attachment in emails.get('files') or ()]
+        job_queue.enqueue_job(job_id, template_file, file_name, placeholder_values,
+                              workspace.getvalue(SIGNATURE_BUFFER) or None, emails, files)
+        if files:
+            workspace.detach()
+        workspace.close()
+        return job_id
+
+    job = SubmissionJob(job_id, template_file, file_name, placeholder_values, workspace, emails)
+    with _jobs_lock:
+        _prune_jobs()
+        _jobs[job.job_id] = job
+    SUBMISSIONS_IN_FLIGHT.inc()
+    _executor.submit(_process, job)
+    return job.job_id
+
+
+def get_job(job_id):
+    if SUBMISSION_BACKEND == 'queue':
+        return job_queue.get_job(job_id)
+    with _jobs_lock:
+        return _jobs.get(job_id)
+
+
+# Drop a finished job once the page has shown its result
+def release_job(job_id):
+    if SUBMISSION_BACKEND == 'queue':
+        job_queue.release_job(job_id)
+        return
+    with _jobs_lock:
+        job = _jobs.pop(job_id, None)
+    if job is not None:
+        job.workspace.close()
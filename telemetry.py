@@ -0,0 +1,108 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+import threading
+import logging
+import json
+import time
+import os
+
+# Logging and timing for the submission pipeline
+#
+# Every module logs through a child of the 'bootcamp' logger. Records carry the id of the
+# submission being worked on (the job id, or '-' outside a submission), so the render on a
+# worker thread and the later SMTP delivery from the outbox can be tied back together.
+#
+# span() times one stage (template load, substitution, signature embedding, save, SMTP
+# send) and adds it to the current submission's timings; per-stage times are only logged
+# at DEBUG. A submission emits a single INFO summary with all of its timings instead.
+#
+#   LOG_LEVEL=DEBUG      also log every span as it finishes
+#   LOG_FORMAT=json      one JSON object per line, summary timings as fields
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')
+LOGGER_NAME = 'bootcamp'
+
+_correlation_id = ContextVar('correlation_id', default='-')
+_timings = ContextVar('timings', default=None)
+_configured = False
+_configure_lock = threading.Lock()
+
+logger = logging.getLogger(f'{LOGGER_NAME}.telemetry')
+
+
+def get_logger(name):
+    return logging.getLogger(f'{LOGGER_NAME}.{name}')
+
+
+class CorrelationFilter(logging.Filter):
+    def filter(self, record):
+        record.correlation_id = _correlation_id.get()
+        return True
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'correlation_id': getattr(record, 'correlation_id', '-'),
+            'message': record.getMessage(),
+        }
+        entry.update(getattr(record, 'fields', None) or {})
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(level=LOG_LEVEL, log_format=LOG_FORMAT):
+    # Safe to call on every rerun; the handler is only installed once per process
+    global _configured
+    with _configure_lock:
+        if _configured:
+            return
+        handler = logging.StreamHandler()
+        handler.addFilter(CorrelationFilter())
+        if log_format == 'json':
+            handler.setFormatter(JSONFormatter())
+        else:
+            handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s [%(correlation_id)s] %(message)s'))
+        root = logging.getLogger(LOGGER_NAME)
+        root.addHandler(handler)
+        root.setLevel(level)
+        root.propagate = False
+        _configured = True
+
+
+@contextmanager
+def correlation(correlation_id):
+    # Tags every record logged inside the block and collects the block's span timings (in ms)
+    timings = {}
+    id_token, timings_token = _correlation_id.set(correlation_id), _timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _correlation_id.reset(id_token)
+        _timings.reset(timings_token)
+
+
+@contextmanager
+def span(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = (time.perf_counter() - started) * 1000
+        timings = _timings.get()
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + elapsed
+        logger.debug('%s took %.2f ms', name, elapsed)
+
+
+def log_summary(log, message, fields, level=logging.INFO):
+    # One record per unit of work: fields become JSON keys, or key=value pairs in text logs
+    if not log.isEnabledFor(level):
+        return
+    text = ' '.join(f'{key}={value:.2f}' if isinstance(value, float) else f'{key}={value}' for key, value in fields.items())
+    log.log(level, '%s %s', message, text, extra={'fields': fields})
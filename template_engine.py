@@ -0,0 +1,218 @@
+from xml.sax.saxutils import escape
+from docx.oxml import parse_xml
+from docx.oxml.ns import qn
+from docx.oxml.shape import CT_Inline
+from docx.shared import Inches
+from lxml import etree
+from token_matcher import TokenMatcher
+from telemetry import span
+from assets import file_version, copy_zip_info
+import threading
+import struct
+import zipfile
+import io
+import os
+import re
+
+# Compiled template engine for ph_skills_bootcamp.docx
+#
+# The template never changes between learners, so it is parsed once per process.
+# Compiling walks every paragraph once at the run / w:t level, works out which text
+# nodes hold a placeholder (including placeholders Word split across several runs)
+# and swaps just those nodes for markers. Everything else in word/document.xml is
+# serialised into static byte segments, with run formatting left untouched.
+# Rendering a submission only fills in the slots and writes a new zip in memory.
+
+SIGNATURE_PLACEHOLDER = 'ph_signature'
+SIGNATURE_WIDTH = Inches(2)
+
+DOCUMENT_PART = 'word/document.xml'
+RELS_PART = 'word/_rels/document.xml.rels'
+IMAGE_RELTYPE = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/image'
+
+_SLOT_PATTERN = re.compile(rb'<\?slot (\d+)\?>')
+_TOKEN_PATTERN = re.compile(r'(?<!\w)ph\d+[a-z]?(?!\w)')  # what a placeholder looks like in the template text
+
+# Run children that read as whitespace in paragraph.text; they separate words but carry no w:t
+_BREAK_TAGS = {qn('w:tab'), qn('w:br'), qn('w:cr'), qn('w:ptab')}
+_TEXT_TAG = qn('w:t')
+_RUN_TAG = qn('w:r')
+_HYPERLINK_TAG = qn('w:hyperlink')
+_SPACE_ATTR = '{http://www.w3.org/XML/1998/namespace}space'
+
+# Splices a line break into the w:t being rendered, like python-docx does for '\n' in run.text
+_LINE_BREAK = '</w:t><w:br/><w:t xml:space="preserve">'
+# Control characters XML 1.0 doesn't allow even escaped (e.g. \x0b or \x1b pasted into a field): Word
+# and python-docx refuse the whole document.xml over one of them
+_INVALID_XML = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+def _escape_text(value):
+    return re.sub(r'\r\n|\n|\r', _LINE_BREAK, escape(_INVALID_XML.sub('', value)))
+
+
+def _paragraph_atoms(para):
+    # Yield the paragraph's w:t elements in reading order, with None standing in for tabs/breaks
+    for child in para:
+        runs = child.iterchildren(_RUN_TAG) if child.tag == _HYPERLINK_TAG else (child,) if child.tag == _RUN_TAG else ()
+        for run in runs:
+            for item in run:
+                if item.tag == _TEXT_TAG:
+                    yield item
+                elif item.tag in _BREAK_TAGS:
+                    yield None
+
+
+class CompiledTemplate:
+    def __init__(self, template_file, keys):
+        self.template_file = template_file
+        self.matcher = TokenMatcher(keys)
+        self.keys = self.matcher.keys
+
+        with zipfile.ZipFile(template_file) as zf:
+            self.members = [(info, zf.read(info.filename)) for info in zf.infolist()]
+        parts = {info.filename: data for info, data in self.members}
+
+        document = parse_xml(parts[DOCUMENT_PART])
+
+        # Each slot is a list of pieces: (True, key) for a value, (False, text) for literal text.
+        # A signature slot is None and becomes the picture run.
+        self.slots = []
+        self.found_keys = set()
+        self.tokens = set()  # every placeholder-shaped word, whether or not a value is supplied for it
+        for para in document.iter(qn('w:p')):
+            self._compile_paragraph(para)
+
+        xml = etree.tostring(document, xml_declaration=True, encoding='UTF-8', standalone=True)
+        pieces = _SLOT_PATTERN.split(xml)
+        self.segments = pieces[0::2]  # static XML between slots
+        self.slot_order = [int(index) for index in pieces[1::2]]
+
+        # Reserve ids for the signature picture so render() doesn't need to inspect the document
+        shape_ids = [int(value) for value in document.xpath('//wp:docPr/@id')]
+        self.signature_shape_id = max(shape_ids, default=0) + 1
+
+        rels = parts[RELS_PART].decode('utf-8')
+        rel_ids = [int(value) for value in re.findall(r'Id="rId(\d+)"', rels)]
+        self.signature_rel_id = f'rId{max(rel_ids, default=0) + 1}'
+        media_numbers = [int(value) for value in re.findall(r'media/image(\d+)\.', ' '.join(parts))]
+        self.signature_media = f'media/image{max(media_numbers, default=0) + 1}.png'
+        self.rels_with_signature = rels.replace(
+            '</Relationships>',
+            f'<Relationship Id="{self.signature_rel_id}" Type="{IMAGE_RELTYPE}" Target="{self.signature_media}"/></Relationships>'
+        ).encode('utf-8')
+
+    def _add_slot(self, parent, pieces):
+        parent.append(etree.ProcessingInstruction('slot', str(len(self.slots))))
+        self.slots.append(pieces)
+
+    def _compile_paragraph(self, para):
+        # Concatenate the paragraph text once, remembering which w:t each character came from
+        nodes, offsets, owners, text = [], [], [], []
+        for atom in _paragraph_atoms(para):
+            if atom is None:
+                text.append('\t')  # any non-word character keeps words apart
+                owners.append(-1)
+                continue
+            offsets.append(len(owners))
+            owners.extend([len(nodes)] * len(atom.text or ''))
+            nodes.append(atom)
+            text.append(atom.text or '')
+        text = ''.join(text)
+
+        self.tokens.update(_TOKEN_PATTERN.findall(text))
+        matches = self.matcher.findall(text)
+        signature = text.find(SIGNATURE_PLACEHOLDER)
+        if signature >= 0 and not any(start <= signature < end for start, end, _ in matches):
+            matches.append((signature, signature + len(SIGNATURE_PLACEHOLDER), None))
+            matches.sort()
+        if not matches:
+            return
+
+        # A placeholder belongs to the node holding its first character; the tail nodes lose those characters
+        node_pieces = {}
+        for start, end, key in matches:
+            first, last = owners[start], owners[end - 1]
+            for index in range(first, last + 1):
+                node_pieces.setdefault(index, [])
+            node_pieces[first].append((start, end, key or ''))
+            if key:
+                self.found_keys.add(key)
+            for index in range(first + 1, last + 1):
+                node_pieces[index].append((max(start, offsets[index]), end, ''))
+
+        for index, spans in node_pieces.items():
+            node = nodes[index]
+            node_text = node.text or ''
+            base = offsets[index]
+            pieces, cursor = [], 0
+            for start, end, key in spans:
+                start, end = max(start - base, 0), min(end - base, len(node_text))
+                if start > cursor:
+                    pieces.append((False, node_text[cursor:start]))
+                if key:
+                    pieces.append((True, key))
+                cursor = max(cursor, end)
+            if cursor < len(node_text):
+                pieces.append((False, node_text[cursor:]))
+            node.text = None
+            node.set(_SPACE_ATTR, 'preserve')
+            self._add_slot(node, pieces)
+
+        if signature >= 0:
+            self._add_slot(para, None)
+
+    def _picture_run_xml(self, signature_png):
+        width, height = struct.unpack('>II', signature_png[16:24])  # straight from the PNG IHDR chunk
+        inline = CT_Inline.new_pic_inline(
+            self.signature_shape_id, self.signature_rel_id, os.path.basename(self.signature_media),
+            SIGNATURE_WIDTH, int(SIGNATURE_WIDTH * height / width)
+        )
+        return f'<w:r><w:drawing>{etree.tostring(inline, encoding="unicode")}</w:drawing></w:r>'
+
+    def render(self, placeholder_values, signature_png=None):
+        with span('signature_embed'):
+            picture = self._picture_run_xml(signature_png).encode('utf-8') if signature_png is not None else b''
+
+        with span('substitution'):
+            # Values arrive as final text from placeholders.build_placeholder_values: only escaping is left
+            values = {key: _escape_text(str(value)) for key, value in placeholder_values.items() if key in self.keys}
+            document = [self.segments[0]]
+            for index, segment in zip(self.slot_order, self.segments[1:]):
+                pieces = self.slots[index]
+                if pieces is None:
+                    document.append(picture)
+                else:
+                    document.append(''.join(
+                        values.get(piece, piece) if is_key else escape(piece) for is_key, piece in pieces
+                    ).encode('utf-8'))
+                document.append(segment)
+
+        with span('save'):
+            buffer = io.BytesIO()
+            with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
+                for info, data in self.members:
+                    if info.filename == DOCUMENT_PART:
+                        data = b''.join(document)
+                    elif info.filename == RELS_PART and signature_png is not None:
+                        data = self.rels_with_signature
+                    zf.writestr(copy_zip_info(info), data)  # a copy each: renders run concurrently
+                if signature_png is not None:
+                    zf.writestr(f'word/{self.signature_media}', signature_png, compress_type=zipfile.ZIP_STORED)
+            return buffer.getvalue()
+
+
+# Process-wide registry: one compiled template per file/mtime/placeholder set
+_templates = {}
+_templates_lock = threading.Lock()
+
+
+def load_template(template_file, keys):
+    # file_version() only stats the template every few seconds, so a render normally does no disk I/O
+    cache_key = (os.path.abspath(template_file), file_version(template_file), frozenset(keys))
+    with _templates_lock:
+        template = _templates.get(cache_key)
+        if template is None:
+            template = CompiledTemplate(template_file, keys)
+            _templates[cache_key] = template
+        return template
@@ -0,0 +1,46 @@
+import re
+
+# Whole-token placeholder matcher
+#
+# Finds every placeholder in a piece of text in one left-to-right pass. Placeholders are
+# whole words (ph1, ph120a, impactful_condition), so the text is cut into maximal word runs
+# by a single regex scan and each run costs one set lookup. Because a run is always taken
+# whole, the longest token wins by construction: ph1 never matches inside ph10 or ph120a,
+# and nothing backtracks however many keys share a prefix. Scanning is O(length of text)
+# regardless of the number of keys.
+#
+# Build one per key set and reuse it; see tools/bench_matcher.py for the comparison with a
+# single alternation regex over all the keys.
+
+_WORD_PATTERN = re.compile(r'\w+')
+
+
+class TokenMatcher:
+    def __init__(self, keys):
+        self.keys = frozenset(keys)
+        # A key that isn't a single word could never be found as a whole token
+        invalid = sorted(key for key in self.keys if not _WORD_PATTERN.fullmatch(key))
+        if invalid:
+            raise ValueError(f"placeholders must be single words: {', '.join(invalid)}")
+
+    def finditer(self, text):
+        # Yields (start, end, key) for each placeholder, in order and never overlapping
+        keys = self.keys
+        for match in _WORD_PATTERN.finditer(text):
+            word = match.group()
+            if word in keys:
+                yield match.start(), match.end(), word
+
+    def findall(self, text):
+        return list(self.finditer(text))
+
+    def sub(self, text, values):
+        # Replaces every placeholder with values[key] (keys without a value are left as they are)
+        pieces, cursor = [], 0
+        for start, end, key in self.finditer(text):
+            if key in values:
+                pieces.append(text[cursor:start])
+                pieces.append(values[key])
+                cursor = end
+        pieces.append(text[cursor:])
+        return ''.join(pieces)
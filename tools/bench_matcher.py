@@ -0,0 +1,85 @@
+# Micro-benchmark for the placeholder matcher.
+#
+# Substitutes a full set of placeholder values into every paragraph of the enrollment
+# template, once with a single alternation regex over all the keys (how placeholders used
+# to be replaced) and once with TokenMatcher, checks both give the same text and reports
+# the time per pass over the whole template.
+#
+#   python tools/bench_matcher.py [-r 200]
+
+from datetime import date
+import argparse
+import zipfile
+import timeit
+import re
+import sys
+import os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from docx.oxml import parse_xml  # noqa: E402
+from docx.oxml.ns import qn  # noqa: E402
+from template_engine import _paragraph_atoms, DOCUMENT_PART  # noqa: E402
+from placeholders import PLACEHOLDER_KEYS  # noqa: E402
+from token_matcher import TokenMatcher  # noqa: E402
+
+TEMPLATE_FILE = os.path.join(ROOT, 'ph_skills_bootcamp.docx')
+
+
+def template_paragraphs(template_file=TEMPLATE_FILE):
+    with zipfile.ZipFile(template_file) as zf:
+        document = parse_xml(zf.read(DOCUMENT_PART))
+    return [''.join('\t' if atom is None else atom.text or '' for atom in _paragraph_atoms(para))
+            for para in document.iter(qn('w:p'))]
+
+
+def alternation_sub(paragraphs, values):
+    # One pattern over every key, resolved through re.escape() on each hit
+    escaped = {re.escape(key): value for key, value in values.items()}
+    pattern = re.compile(r'\b(' + '|'.join(escaped) + r')\b')
+    return [pattern.sub(lambda match: escaped[re.escape(match.group(0))], text) for text in paragraphs]
+
+
+def matcher_sub(paragraphs, matcher, values):
+    return [matcher.sub(text, values) for text in paragraphs]
+
+
+def run(repeat=200):
+    # Returns microseconds per pass over the template for each approach
+    paragraphs = template_paragraphs()
+    values = {key: f'value of {key}' for key in PLACEHOLDER_KEYS}
+    values['ph34'] = date(1990, 1, 1).strftime('%d-%m-%Y')
+    matcher = TokenMatcher(values)
+
+    if alternation_sub(paragraphs, values) != matcher_sub(paragraphs, matcher, values):
+        raise AssertionError('TokenMatcher and the alternation regex disagree')
+
+    alternation = min(timeit.repeat(lambda: alternation_sub(paragraphs, values), number=repeat, repeat=3)) / repeat
+    build = min(timeit.repeat(lambda: TokenMatcher(values), number=repeat, repeat=3)) / repeat
+    scan = min(timeit.repeat(lambda: matcher_sub(paragraphs, matcher, values), number=repeat, repeat=3)) / repeat
+    return {
+        'paragraphs': len(paragraphs),
+        'keys': len(values),
+        'alternation_us': alternation * 1e6,
+        'matcher_build_us': build * 1e6,
+        'matcher_scan_us': scan * 1e6,
+        'speedup': alternation / scan,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Placeholder matcher micro-benchmark')
+    parser.add_argument('-r', '--repeat', type=int, default=200, help='passes per timing')
+    args = parser.parse_args()
+
+    result = run(args.repeat)
+    print(f"{result['paragraphs']} paragraphs, {result['keys']} placeholders")
+    print(f"alternation regex  {result['alternation_us']:9.1f} us/pass")
+    print(f"TokenMatcher       {result['matcher_scan_us']:9.1f} us/pass "
+          f"(built once in {result['matcher_build_us']:.1f} us), {result['speedup']:.1f}x")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
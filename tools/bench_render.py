@@ -0,0 +1,308 @@
+# Benchmark suite for the enrollment render path.
+#
+# Times each stage a submission goes through, on the real template and a synthetic
+# 400x150 st_canvas drawing, and writes the results as JSON keyed by git commit so two
+# commits can be compared:
+#
+#   placeholder_matcher     TokenMatcher vs the old alternation regex (tools/bench_matcher.py)
+#   replace_placeholders    full placeholder set plus signature into ph_skills_bootcamp.docx
+#   process_signature       canvas -> cropped palette PNG
+#   is_signature_drawn      ink analysis of an empty and of a drawn canvas
+#   send_email              MIME assembly and delivery of the team email to a local SMTP stub
+#   submit_N                N submissions at once, from submit_enrollment() until the stub
+#                           has received every team and learner email (N = 1, 10, 100)
+#
+# Mail never leaves the machine: SMTP, the outbox database and the workspaces are pointed
+# at a stub server and a temporary directory before the app modules are imported.
+#
+#   python tools/bench_render.py                        writes bench_results/<commit>.json
+#   python tools/bench_render.py --compare bench_results/<old commit>.json
+#   python tools/bench_render.py --quick                fewer rounds, for a smoke test
+
+from contextlib import redirect_stdout
+import socketserver
+import subprocess
+import statistics
+import threading
+import platform
+import argparse
+import tempfile
+import datetime
+import json
+import time
+import sys
+import os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+TEMPLATE_FILE = os.path.join(ROOT, 'ph_skills_bootcamp.docx')
+RESULTS_DIR = os.path.join(ROOT, 'bench_results')
+SENDER = ('bench@example.com', 'bench-password')
+CONCURRENCY = (1, 10, 100)
+REGRESSION_THRESHOLD = 0.10  # a median this much slower than the baseline is reported as a regression
+DELIVERY_TIMEOUT = 120
+
+
+class SMTPStub(socketserver.ThreadingTCPServer):
+    # Just enough SMTP for smtplib: accepts every message and counts it
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), SMTPStubHandler)
+        self.received = 0
+        self.received_bytes = 0
+        self.lock = threading.Lock()
+        threading.Thread(target=self.serve_forever, name='smtp-stub', daemon=True).start()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def wait_for(self, count, timeout=DELIVERY_TIMEOUT):
+        deadline = time.monotonic() + timeout
+        while self.received < count:
+            if time.monotonic() > deadline:
+                raise TimeoutError(f'SMTP stub received {self.received} of {count} messages')
+            time.sleep(0.002)
+
+
+class SMTPStubHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode('ascii') + b'\r\n')
+
+    def handle(self):
+        self.reply('220 stub ready')
+        for line in self.rfile:
+            command = line[:4].upper()
+            if command == b'EHLO':
+                self.wfile.write(b'250-stub\r\n250-8BITMIME\r\n250 SIZE 52428800\r\n')
+            elif command == b'DATA':
+                self.reply('354 end with <CRLF>.<CRLF>')
+                size = 0
+                for data in self.rfile:
+                    if data == b'.\r\n':
+                        break
+                    size += len(data)
+                with self.server.lock:
+                    self.server.received += 1
+                    self.server.received_bytes += size
+                self.reply('250 queued')
+            elif command == b'QUIT':
+                self.reply('221 bye')
+                return
+            else:  # HELO, MAIL, RCPT, RSET, NOOP
+                self.reply('250 ok')
+
+
+def configure_environment(stub, scratch):
+    # Must run before mailer / outbox / workspace are imported: they read these at import time
+    os.environ.update({
+        'SMTP_HOST': '127.0.0.1',
+        'SMTP_PORT': str(stub.port),
+        'SMTP_STARTTLS': '0',
+        'OUTBOX_DB': os.path.join(scratch, 'outbox.sqlite3'),
+        'WORKSPACE_ROOT': os.path.join(scratch, 'workspaces'),
+    })
+
+
+def measure(fn, rounds, warmup=1):
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - started) * 1000)
+    return {
+        'rounds': rounds,
+        'min_ms': min(times),
+        'median_ms': statistics.median(times),
+        'mean_ms': statistics.fmean(times),
+        'max_ms': max(times),
+    }
+
+
+def synthetic_canvas(seed=0):
+    # A drawn 400x150 st_canvas layer: transparent background, a 5px black scrawl across the middle
+    import numpy as np
+    canvas = np.zeros((150, 400, 4), dtype=np.uint8)
+    xs = np.arange(40, 360)
+    ys = (75 + 30 * np.sin(xs / (17.0 + seed))).astype(int)
+    for dy in range(-2, 3):
+        canvas[ys + dy, xs] = (0, 0, 0, 255)
+    return canvas
+
+
+def learner(index):
+    from render_batch import learner_record
+    return learner_record({
+        'first_name': f'First{index:05d}', 'sir_name': f'Last{index:05d}', 'dob': '1990-05-03',
+        'email': f'learner{index}@example.com', 'postcode': 'GU1 1AA', 'ph63': 'X', 'ph75': 'X',
+        'ph96': 12.5, 'ethnicity_31': 'X', 'ph154': 'X', 'impactful_condition': 'None',
+    })
+
+
+def emails(index, files=()):
+    return {
+        'sender_email': SENDER[0], 'sender_password': SENDER[1],
+        'team_email': ['team@example.com'], 'learner_email': [f'learner{index}@example.com'],
+        'subject_team': f'Skills Bootcamp enrollment {index}', 'body_team': '<p>New enrollment attached.</p>',
+        'subject_learner': 'Thank you for enrolling', 'body_learner': '<p>Thank you.</p>',
+        'files': list(files),
+    }
+
+
+def bench_components(rounds):
+    from placeholders import build_placeholder_values
+    from submissions import replace_placeholders
+    from signature import process_signature, analyse_signature
+
+    import numpy as np
+    values = build_placeholder_values(learner(0))
+    # analyse_signature remembers the last canvas object, so rounds alternate between distinct arrays
+    canvases = [synthetic_canvas(seed) for seed in range(2)]
+    empties = [np.zeros((150, 400, 4), dtype=np.uint8) for _ in range(2)]
+    signature_png = process_signature(canvases[0])
+    turn = iter(range(10 ** 9))
+
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        return {
+            'replace_placeholders': measure(lambda: replace_placeholders(TEMPLATE_FILE, values, signature_png), rounds),
+            'process_signature': measure(lambda: process_signature(canvases[next(turn) % 2]), rounds * 5),
+            'is_signature_drawn_empty': measure(lambda: analyse_signature(empties[next(turn) % 2]).drawn, rounds * 20),
+            'is_signature_drawn_drawn': measure(lambda: analyse_signature(canvases[next(turn) % 2]).drawn, rounds * 20),
+        }
+
+
+def bench_send_email(stub, rounds):
+    from mailer import send_email_with_attachments
+    from submissions import replace_placeholders
+    from placeholders import build_placeholder_values
+
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        document = replace_placeholders(TEMPLATE_FILE, build_placeholder_values(learner(0)), None)
+    message = emails(0)
+
+    def send():
+        expected = stub.received + 1
+        send_email_with_attachments(SENDER[0], SENDER[1], message['team_email'], message['subject_team'],
+                                    message['body_team'], attachments=[('enrollment.docx', document)])
+        stub.wait_for(expected)
+
+    return measure(send, rounds)
+
+
+def bench_submissions(stub, count, rounds):
+    from submissions import submit_enrollment, get_job, release_job, DONE, SIGNATURE_BUFFER
+    from placeholders import build_placeholder_values, document_file_name
+    from signature import process_signature
+    from workspace import Workspace
+
+    records = [learner(index) for index in range(count)]
+    values = [build_placeholder_values(record) for record in records]
+    signature_png = process_signature(synthetic_canvas())
+
+    def run():
+        expected = stub.received + 2 * count  # team email with the DOCX, plus the learner thank-you
+        job_ids = []
+        for index, record in enumerate(records):
+            workspace = Workspace()
+            workspace.buffer(SIGNATURE_BUFFER).write(signature_png)
+            job_ids.append(submit_enrollment(TEMPLATE_FILE, document_file_name(record), values[index], workspace,
+                                             emails(index)))
+        for job_id in job_ids:
+            while not get_job(job_id).finished:
+                time.sleep(0.001)
+            if get_job(job_id).status != DONE:
+                raise RuntimeError(f'submission failed: {get_job(job_id).error}')
+            release_job(job_id)
+        stub.wait_for(expected)
+
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        result = measure(run, rounds)
+    result['submissions_per_sec'] = count / (result['median_ms'] / 1000)
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except Exception:
+        return 'unknown'
+
+
+def compare(results, baseline):
+    # Prints each benchmark's median against the baseline's; returns the names that regressed
+    regressions = []
+    print(f"\ncompared with {baseline['commit']} ({baseline['timestamp']}):")
+    for name, result in results['benchmarks'].items():
+        old = baseline['benchmarks'].get(name)
+        if not old or 'median_ms' not in result:
+            continue
+        change = result['median_ms'] / old['median_ms'] - 1
+        flag = '  REGRESSION' if change > REGRESSION_THRESHOLD else ''
+        if flag:
+            regressions.append(name)
+        print(f"  {name:28s} {old['median_ms']:10.3f} -> {result['median_ms']:10.3f} ms  {change:+7.1%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the enrollment render path')
+    parser.add_argument('-o', '--output', help='results file (default: bench_results/<commit>.json)')
+    parser.add_argument('--compare', help='earlier results file to compare against')
+    parser.add_argument('--quick', action='store_true', help='fewer rounds and no 100-submission run')
+    args = parser.parse_args()
+
+    rounds = 5 if args.quick else 30
+    stub = SMTPStub()
+    scratch = tempfile.mkdtemp(prefix='bench-render-')
+    configure_environment(stub, scratch)
+
+    from outbox import start_dispatcher
+    import bench_matcher
+
+    start_dispatcher(*SENDER)
+    benchmarks = {'placeholder_matcher': bench_matcher.run(20 if args.quick else 200)}
+    # compared between runs on the matcher's scan time (its best of three passes)
+    benchmarks['placeholder_matcher']['median_ms'] =benchmarks['placeholder_matcher']['matcher_scan_us'] / 1000
+    benchmarks.update(bench_components(rounds))
+    benchmarks['send_email'] = bench_send_email(stub, rounds)
+    for count in CONCURRENCY:
+        if args.quick and count > 10:
+            continue
+        benchmarks[f'submit_{count}'] = bench_submissions(stub, count, max(rounds // count, 3))
+
+    results = {
+        'commit': git_commit(),
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'machine': f'{platform.system()} {platform.machine()}, {os.cpu_count()} CPUs',
+        'quick': args.quick,
+        'benchmarks': benchmarks,
+    }
+
+    for name, result in benchmarks.items():
+        extra = f"  {result['submissions_per_sec']:8.1f} submissions/sec" if 'submissions_per_sec' in result else ''
+        print(f"{name:28s} median {result['median_ms']:10.3f} ms{extra}")
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{results['commit']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"results written to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f))
+        if regressions:
+            print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
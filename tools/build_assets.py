@@ -0,0 +1,179 @@
+# Asset build step for resources/ and the DOCX template.
+#
+# For every image in resources/ writes sized variants to static/ (served by Streamlit at
+# app/static/, see .streamlit/config.toml): WebP for browsers and an optimised PNG/JPEG
+# fallback, at the form's column width (704px) and twice that for high-DPI screens,
+# never wider than the source. File names carry a hash of their content, so a changed
+# image gets a new URL and browsers can cache the old ones forever. static/manifest.json
+# maps each source (with its sha256) to its variants; the app only uses an entry whose
+# hash still matches the source, and falls back to the source image otherwise.
+#
+# The images embedded in ph_skills_bootcamp.docx (word/media) are recompressed losslessly
+# in place, which shrinks every generated document and email attachment.
+#
+#   python tools/build_assets.py            build static/ and recompress the template
+#   python tools/build_assets.py --check    only report whether static/ is up to date
+
+from PIL import Image as PILImage
+import argparse
+import hashlib
+import zipfile
+import json
+import glob
+import sys
+import io
+import os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from assets import copy_zip_info, replace_file, RESOURCES_DIR, STATIC_DIR, MANIFEST_FILE, IMAGE_EXTENSIONS, IMAGE_DISPLAY_WIDTH, IMAGE_MAX_WIDTH  # noqa: E402
+from placeholders import TEMPLATE_FILE  # noqa: E402
+
+WIDTHS = (IMAGE_DISPLAY_WIDTH, IMAGE_MAX_WIDTH)
+WEBP_QUALITY = 85
+JPEG_QUALITY = 85
+HASH_LENGTH = 10
+NEAR_WIDTH = 1.15
+
+
+def sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def encode(image, image_format):
+    buffer = io.BytesIO()
+    if image_format == 'webp':
+        image.save(buffer, format='WEBP', quality=WEBP_QUALITY, method=6)
+    elif image_format == 'jpg':
+        image.convert('RGB').save(buffer, format='JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+    else:
+        image.save(buffer, format='PNG', optimize=True)
+    return buffer.getvalue()
+
+
+def build_variants(source, data):
+    # [(file name, width, height, format, bytes)] for one source image
+    stem = os.path.splitext(os.path.basename(source))[0]
+    with PILImage.open(io.BytesIO(data)) as image:
+        image.load()
+        fallback = 'jpg' if image.format == 'JPEG' else 'png'
+        widths = sorted({min(width, image.width) for width in WIDTHS})
+        # A size within NEAR_WIDTH of the next one up adds a file without saving anything
+        widths = [width for width, larger in zip(widths, widths[1:] + [None]) if larger is None or larger > width * NEAR_WIDTH]
+        variants = []
+        for width in widths:
+            sized = image if width == image.width else image.resize(
+                (width, round(image.height * width / image.width)), PILImage.LANCZOS)
+            for image_format in ('webp', fallback):
+                encoded = encode(sized, image_format)
+                if sized is image and image_format == fallback and len(data) < len(encoded):
+                    encoded = data  # the source is already the smallest encoding of itself
+                name = f'{stem}.{width}w.{sha256(encoded)[:HASH_LENGTH]}.{image_format}'
+                variants.append((name, sized.width, sized.height, image_format, encoded))
+        return image.width, image.height, variants
+
+
+def build_static(resources_dir=RESOURCES_DIR, static_dir=STATIC_DIR, check=False):
+    # Returns the number of sources whose variants were (or, with check, would be) rebuilt
+    manifest_path = os.path.join(static_dir, MANIFEST_FILE)
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        manifest = {}
+
+    sources = sorted(path for path in glob.glob(os.path.join(resources_dir, '*')) if path.lower().endswith(IMAGE_EXTENSIONS))
+    keys = {os.path.relpath(path, ROOT).replace(os.sep, '/'): path for path in sources}
+    stale = 0
+    new_manifest = {}
+    for key, path in keys.items():
+        with open(path, 'rb') as f:
+            data = f.read()
+        entry = manifest.get(key)
+        if entry and entry['sha256'] == sha256(data) and all(
+                os.path.exists(os.path.join(static_dir, variant['file'])) for variant in entry['variants']):
+            new_manifest[key] = entry
+            continue
+        stale += 1
+        if check:
+            print(f"{key}: out of date")
+            continue
+        width, height, variants = build_variants(path, data)
+        os.makedirs(static_dir, exist_ok=True)
+        for name, _, _, _, encoded in variants:
+            with open(os.path.join(static_dir, name), 'wb') as f:
+                f.write(encoded)
+        new_manifest[key] = {
+            'sha256': sha256(data), 'width': width, 'height': height,
+            'variants': [{'file': name, 'width': w, 'height': h, 'format': image_format, 'bytes': len(encoded)}
+                         for name, w, h, image_format, encoded in variants],
+        }
+        smallest = min(len(encoded) for *_, encoded in variants)
+        print(f"{key}: {len(data)} bytes -> {len(variants)} variants, smallest {smallest} bytes")
+
+    stale += len(set(manifest) - set(keys))
+    if check:
+        return stale
+
+    with open(manifest_path, 'w') as f:
+        json.dump(new_manifest, f, indent=2, sort_keys=True)
+        f.write('\n')
+    # Variants no longer referenced (an image changed or was removed)
+    referenced = {variant['file'] for entry in new_manifest.values() for variant in entry['variants']}
+    for path in glob.glob(os.path.join(static_dir, '*')):
+        name = os.path.basename(path)
+        if name != MANIFEST_FILE and name not in referenced:
+            os.remove(path)
+    return stale
+
+
+def recompress_png(data):
+    # Lossless: the same pixels, re-encoded with the best zlib settings; None if that isn't smaller
+    with PILImage.open(io.BytesIO(data)) as image:
+        image.load()
+        if image.format != 'PNG':
+            return None
+        buffer = io.BytesIO()
+        image.save(buffer, format='PNG', optimize=True)
+    encoded = buffer.getvalue()
+    return encoded if len(encoded) < len(data) else None
+
+
+def recompress_docx(docx_file=TEMPLATE_FILE, check=False):
+    # Returns bytes saved; the template is only rewritten if something got smaller
+    with zipfile.ZipFile(docx_file) as zf:
+        members = [(info, zf.read(info.filename)) for info in zf.infolist()]
+    saved, replaced = 0, {}
+    for info, data in members:
+        if info.filename.startswith('word/media/') and info.filename.lower().endswith('.png'):
+            encoded = recompress_png(data)
+            if encoded is not None:
+                replaced[info.filename] = encoded
+                saved += len(data) - len(encoded)
+                print(f"{docx_file} {info.filename}: {len(data)} -> {len(encoded)} bytes")
+    if not replaced or check:
+        return saved
+
+    with replace_file(docx_file) as temp_path, zipfile.ZipFile(temp_path, 'w') as zf:
+        for info, data in members:
+            zf.writestr(copy_zip_info(info), replaced.get(info.filename, data))
+    return saved
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build web image variants and recompress template media')
+    parser.add_argument('--check', action='store_true', help='report what would change and exit 1 if anything is stale')
+    parser.add_argument('-t', '--template', default=os.path.join(ROOT, TEMPLATE_FILE), help='DOCX template (default: %(default)s)')
+    args = parser.parse_args()
+
+    os.chdir(ROOT)
+    stale = build_static(check=args.check)
+    saved = recompress_docx(args.template, check=args.check)
+    print(f"{stale} image(s) {'out of date' if args.check else 'rebuilt'}, template media {saved} bytes "
+          f"{'recompressible' if args.check else 'smaller'}")
+    return 1 if args.check and (stale or saved) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,159 @@
+# Scrape check for the /metrics endpoint.
+#
+# Starts the metrics server on a free local port, walks two sessions through the form
+# funnel (one submits, one is abandoned), pushes real submissions through the background
+# pipeline to the SMTP stub from bench_render.py, makes one delivery fail, then scrapes
+# /metrics over HTTP and checks the exposition parses and every number adds up. Last, it
+# checks that track_step() expires idle sessions by itself when nothing scrapes.
+# Runs entirely offline.
+#
+#   python tools/check_metrics.py [-n 3]
+
+import urllib.request
+import argparse
+import tempfile
+import time
+import sys
+import os
+import re
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_render import SMTPStub, configure_environment, learner, emails, TEMPLATE_FILE, SENDER  # noqa: E402
+
+_SAMPLE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(.*)\})? (\S+)$')
+_LABEL = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+
+def parse_exposition(text):
+    # {(name, frozenset of label pairs): value}; raises on any line that isn't valid text format
+    samples = {}
+    for line in text.splitlines():
+        if not line or line.startswith('#'):
+            continue
+        match = _SAMPLE.match(line)
+        if match is None:
+            raise ValueError(f'unparseable metrics line: {line!r}')
+        name, labels, value = match.groups()
+        samples[(name, frozenset(_LABEL.findall(labels or '')))] = float(value)
+    return samples
+
+
+def check_histograms(samples):
+    errors = []
+    series = {}
+    for (name, labels), value in samples.items():
+        if name.endswith('_bucket'):
+            le = dict(labels)['le']
+            key = (name[:-len('_bucket')], frozenset(pair for pair in labels if pair[0] != 'le'))
+            series.setdefault(key, []).append((float('inf') if le == '+Inf' else float(le), value))
+    for (name, labels), buckets in series.items():
+        counts = [count for _, count in sorted(buckets)]
+        if counts != sorted(counts):
+            errors.append(f'{name} buckets are not cumulative')
+        if counts[-1] != samples.get((f'{name}_count', labels)):
+            errors.append(f'{name} +Inf bucket does not match _count')
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Scrape and check the metrics endpoint')
+    parser.add_argument('-n', type=int, default=3, help='submissions to push through the pipeline')
+    args = parser.parse_args()
+
+    stub = SMTPStub()
+    configure_environment(stub, tempfile.mkdtemp(prefix='check-metrics-'))
+
+    from metrics import start_metrics_server, track_step, track_completed, collect_funnel
+    from submissions import submit_enrollment, get_job, release_job
+    from placeholders import build_placeholder_values, document_file_name
+    from outbox import start_dispatcher
+    from mailer import SMTPPool, build_email
+    from workspace import Workspace
+
+    port = start_metrics_server(port=0, host='127.0.0.1')
+    start_dispatcher(*SENDER)
+
+    # Funnel: one session submits after step 10, the other stops at step 2
+    for step in (1, 2, 3, 10, 10):
+        track_step('submitted', step)
+    track_completed('submitted')
+    track_step('submitted', 10)  # the result page keeps polling
+    track_step('submitted', 1)  # the download click reruns the cleared form: not a new enrollment
+    for step in (1, 2, 2):
+        track_step('abandoned', step)
+    collect_funnel(abandon_after=-1)  # everything is idle now
+
+    job_ids = []
+    for index in range(args.n):
+        record = learner(index)
+        job_ids.append(submit_enrollment(TEMPLATE_FILE, document_file_name(record), build_placeholder_values(record),
+                                         Workspace(), emails(index)))
+    for job_id in job_ids:
+        while not get_job(job_id).finished:
+            time.sleep(0.005)
+        release_job(job_id)
+    stub.wait_for(2 * args.n)
+    time.sleep(0.2)  # let the dispatcher record the last delivery
+
+    # One delivery to a port nobody listens on
+    closed = SMTPStub()
+    closed.shutdown()
+    closed.server_close()
+    try:
+        SMTPPool('127.0.0.1', closed.port, None, None, starttls=False, timeout=2).send_message(
+            build_email(SENDER[0], ['nobody@example.com'], 'failing', 'body'))
+    except OSError:
+        pass
+
+    with urllib.request.urlopen(f'http://127.0.0.1:{port}/metrics', timeout=10) as response:
+        content_type = response.headers['Content-Type']
+        samples = parse_exposition(response.read().decode('utf-8'))
+
+    def value(name, **labels):
+        return samples.get((name, frozenset((key, str(val)) for key, val in labels.items())))
+
+    expected = [
+        ('enrollment_started_total', {}, 2),
+        ('enrollment_step_entered_total', {'step': 1}, 2),
+        ('enrollment_step_entered_total', {'step': 2}, 2),
+        ('enrollment_step_entered_total', {'step': 10}, 1),
+        ('enrollment_completed_total', {}, 1),
+        ('enrollment_abandoned_total', {'step': 2}, 1),
+        ('enrollment_abandoned_total', {'step': 1}, None),
+        ('submissions_in_flight', {}, 0),
+        ('submissions_finished_total', {'status': 'done'}, args.n),
+        ('render_seconds_count', {}, args.n),
+        ('email_send_seconds_count', {'outcome': 'sent'}, 2 * args.n),
+        ('email_send_seconds_count', {'outcome': 'failed'}, 1),
+        ('smtp_failures_total', {'error': 'ConnectionRefusedError'}, 1),
+        ('outbox_messages', {'status': 'sent'}, 2 * args.n),
+    ]
+    errors = [] if content_type.startswith('text/plain; version=0.0.4') else [f'unexpected Content-Type {content_type}']
+    for name, labels, want in expected:
+        got = value(name, **labels)
+        status = 'ok' if got == want else 'FAIL'
+        if got != want:
+            errors.append(f'{name}{labels}: expected {want}, got {got}')
+        print(f"{status:4s} {name}{labels} = {got}")
+    errors += check_histograms(samples)
+
+    # Without scrapes: once the abandon window has passed, the next track_step() forgets idle sessions
+    import metrics
+    metrics.ABANDON_AFTER = 0.05
+    track_step('unscraped', 4)
+    time.sleep(0.1)
+    track_step('later', 1)
+    if 'unscraped' in metrics._funnel.sessions:
+        errors.append('track_step() kept a session idle for longer than the abandon window')
+    if metrics.ENROLLMENTS_ABANDONED._values.get(('4',)) != 1:
+        errors.append('track_step() did not count the idle session as abandoned')
+
+    for error in errors:
+        print(f"error: {error}")
+    print(f"{len(samples)} samples scraped from port {port}, {len(errors)} problem(s)")
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
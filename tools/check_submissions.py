@@ -0,0 +1,104 @@
+# Failure-path check for the submission pipeline.
+#
+# Pushes one good submission and one whose template is missing through both backends
+# (worker threads, and the shared queue drained in-process) and checks that the broken
+# one ends as failed with no document and without a single email queued - in particular
+# no thank-you to the learner - while the good one is delivered as usual. A learner whose
+# answers carry control characters XML doesn't allow must still get a document Word opens.
+# Runs entirely offline against the SMTP stub from bench_render.py.
+#
+#   python tools/check_submissions.py
+
+from docx import Document
+import tempfile
+import zipfile
+import time
+import io
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_render import SMTPStub, configure_environment, learner, emails, TEMPLATE_FILE, SENDER  # noqa: E402
+
+MISSING_TEMPLATE = 'no_such_template.docx'
+
+
+def run(backend, template_file, index, record=None):
+    # Returns (status, document, outbox messages added by this submission)
+    import submissions
+    from submissions import submit_enrollment, get_job, release_job, process_queued_job
+    from placeholders import build_placeholder_values, document_file_name
+    from outbox import stats
+    from workspace import Workspace
+
+    submissions.SUBMISSION_BACKEND = backend
+    before = sum(stats().values())
+    record = record or learner(index)
+    job_id = submit_enrollment(template_file, document_file_name(record), build_placeholder_values(record),
+                               Workspace(), emails(index))
+    if backend == 'queue':
+        process_queued_job('check-submissions', SENDER[1])
+    deadline = time.monotonic() + 60
+    while not get_job(job_id).finished:
+        if time.monotonic() > deadline:
+            raise TimeoutError(f'{backend} submission {job_id} never finished')
+        time.sleep(0.01)
+    job = get_job(job_id)
+    result = job.status, job.document or b'', sum(stats().values()) - before
+    release_job(job_id)
+    return result
+
+
+def main():
+    scratch = tempfile.mkdtemp(prefix='check-submissions-')
+    stub = SMTPStub()
+    configure_environment(stub, scratch)
+    os.environ['JOBS_DB'] = os.path.join(scratch, 'jobs.sqlite3')
+
+    errors = []
+    for index, backend in enumerate(('thread', 'queue')):
+        status, document, queued = run(backend, MISSING_TEMPLATE, 2 * index)
+        document = len(document)
+        print(f"{backend:6s} missing template: {status}, {document} document bytes, {queued} email(s) queued")
+        if (status, document, queued) != ('failed', 0, 0):
+            errors.append(f'{backend}: a failed render must end as failed with no document and no email')
+
+        status, document, queued = run(backend, TEMPLATE_FILE, 2 * index + 1)
+        document = len(document)
+        print(f"{backend:6s} good template:    {status}, {document} document bytes, {queued} email(s) queued")
+        if status != 'done' or not document or queued != 2:
+            errors.append(f'{backend}: a good submission must be done with a document and both emails')
+
+    # Vertical tab and escape, as pasted from other programs; XML 1.0 has no way to carry them
+    record = learner(4)
+    record['first_name'] = 'Ann\x0bMarie\x1b'
+    status, document, queued = run('thread', TEMPLATE_FILE, 4, record)
+    print(f"thread control characters: {status}, {len(document)} document bytes, {queued} email(s) queued")
+    try:
+        Document(io.BytesIO(document))
+        with zipfile.ZipFile(io.BytesIO(document)) as zf:
+            text = zf.read('word/document.xml').decode('utf-8')
+    except Exception as e:
+        errors.append(f'control characters: the document does not open ({e})')
+    else:
+        if 'AnnMarie' not in text:
+            errors.append('control characters: the name is missing from the document')
+    if status != 'done' or queued != 2:
+        errors.append('control characters: the submission must be done with both emails')
+
+    try:
+        stub.wait_for(6, timeout=30)  # the three good submissions, team and learner each
+    except TimeoutError as e:
+        errors.append(str(e))
+    if stub.received != 6:
+        errors.append(f'SMTP stub received {stub.received} messages, expected 6')
+
+    for error in errors:
+        print(f"error: {error}")
+    print(f"{len(errors)} problem(s)")
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
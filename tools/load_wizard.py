@@ -0,0 +1,412 @@
+# End-to-end load test of the enrollment wizard.
+#
+# Starts the real app with `streamlit run` and connects hundreds of virtual users to it over
+# Streamlit's websocket protocol, the way browsers do: each one picks a support option on
+# step 1 (selected_option), fills in every required field on steps 2-8, skips the optional
+# uploads on step 9, signs on step 10 and submits (submission_done), then waits on step 11
+# until its document is ready. Widget
+# values go out as the same BackMsg/ForwardMsg protobufs the frontend uses; the signature
+# is sent as the canvas component's value, a PNG of a drawn 400x150 canvas.
+#
+# SMTP (normally smtp.office365.com) is pointed at the sink from bench_render.py, and the
+# outbox, drafts, job queue, workspaces and W5 spool at a temporary directory, so nothing
+# leaves the machine.
+#
+# Reports p50/p95/p99 latency of every step transition (from clicking Next until the next
+# step has finished rendering), the error rate per step and the peak RSS of the server.
+#
+#   python tools/load_wizard.py [-u 200] [-c 50] [--think 0.5] [--json results.json]
+#   python tools/load_wizard.py --url http://host:8501 --pid <server pid>   an already running app
+
+from tornado.httpclient import HTTPRequest
+from tornado.websocket import websocket_connect
+from datetime import date
+import urllib.request
+import subprocess
+import statistics
+import threading
+import argparse
+import tempfile
+import asyncio
+import base64
+import random
+import socket
+import json
+import time
+import sys
+import io
+import os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from streamlit.proto.BackMsg_pb2 import BackMsg  # noqa: E402
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg  # noqa: E402
+from streamlit.proto.WidgetStates_pb2 import WidgetState  # noqa: E402
+from bench_render import SMTPStub, configure_environment, synthetic_canvas, SENDER  # noqa: E402
+
+APP_FILE = os.path.join(ROOT, 'app.py')
+RUN_TIMEOUT = 300  # seconds one interaction may take; the submit polls until the document is rendered
+START_TIMEOUT = 60
+RSS_INTERVAL = 0.1
+RESULT_TEXT = "Processing Complete!"
+
+
+class WizardError(Exception):
+    pass
+
+
+class VirtualUser:
+    # One browser tab: a websocket session, the elements of the page it shows and the query string
+    def __init__(self, url):
+        self.url = url
+        self.connection = None
+        self.page = {}  # delta path -> Element of the current script run
+        self.query_string = ''
+
+    async def connect(self):
+        ws_url = self.url.replace('http', 'ws', 1).rstrip('/') + '/_stcore/stream'
+        request = HTTPRequest(ws_url, headers={'Origin': self.url})
+        self.connection = await websocket_connect(request, subprotocols=['streamlit'])
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+
+    async def rerun(self, widget_states=()):
+        # Send one interaction and wait until the script run it starts (and any st.experimental_rerun
+        # it triggers) has finished; returns the seconds that took
+        message = BackMsg()
+        message.rerun_script.query_string = self.query_string
+        message.rerun_script.widget_states.widgets.extend(widget_states)
+        started = time.perf_counter()
+        await self.connection.write_message(message.SerializeToString(), binary=True)
+        await asyncio.wait_for(self._until_finished(), RUN_TIMEOUT)
+        return time.perf_counter() - started
+
+    async def _until_finished(self):
+        while True:
+            data = await self.connection.read_message()
+            if data is None:
+                raise WizardError('websocket closed by the server')
+            message = ForwardMsg.FromString(data)
+            kind = message.WhichOneof('type')
+            if kind == 'new_session':
+                self.page = {}
+            elif kind == 'delta' and message.delta.WhichOneof('type') == 'new_element':
+                self.page[tuple(message.metadata.delta_path)] = message.delta.new_element
+            elif kind == 'page_info_changed':
+                self.query_string = message.page_info_changed.query_string
+            elif kind == 'script_finished':
+                if message.script_finished == ForwardMsg.FINISHED_WITH_COMPILE_ERROR:
+                    raise WizardError('script failed to compile')
+                if message.script_finished == ForwardMsg.FINISHED_SUCCESSFULLY:
+                    return
+
+    def elements(self, kind):
+        return [getattr(element, kind) for _, element in sorted(self.page.items())
+                if element.WhichOneof('type') == kind]
+
+    def widget(self, kind, label):
+        for element in self.elements(kind):
+            if element.label == label:
+                return element
+        raise WizardError(f'no {kind} labelled {label!r} on "{self.title()}"')
+
+    def title(self):
+        headings = self.elements('heading')
+        return headings[0].body if headings else ''
+
+    def check(self):
+        for exception in self.elements('exception'):
+            raise WizardError(f'{exception.type}: {exception.message}')
+
+
+def text(user, label, value):
+    state = WidgetState(id=user.widget('text_input', label).id)
+    state.string_value = value
+    return state
+
+
+def selectbox(user, label, option):
+    element = user.widget('selectbox', label)
+    state = WidgetState(id=element.id)
+    state.int_value = list(element.options).index(option)
+    return state
+
+
+def date_input(user, label, value):
+    state = WidgetState(id=user.widget('date_input', label).id)
+    state.string_array_value.data.append(value.strftime('%Y/%m/%d'))
+    return state
+
+
+def checkbox(user, label, value):
+    state = WidgetState(id=user.widget('checkbox', label).id)
+    state.bool_value = value
+    return state
+
+
+def button(user, label):
+    state = WidgetState(id=user.widget('button', label).id)
+    state.trigger_value = True
+    return state
+
+
+def signature(user, canvas_png):
+    # What the drawable-canvas component reports after a stroke: the drawing as a PNG data URL
+    components = user.elements('component_instance')
+    if not components:
+        raise WizardError('no signature canvas on step 10')
+    state = WidgetState(id=components[0].id)
+    state.json_value = json.dumps({'data': 'data:image/png;base64,' + canvas_png, 'raw': {'objects': [{'type': 'path'}]}})
+    return state
+
+
+def step_1(user, index, canvas_png):
+    return [selectbox(user, "Who is supporting you to fill this form?", "Self Completing")]
+
+
+def step_2(user, index, canvas_png):
+    states = [text(user, label, value) for label, value in (
+        ("Surname/Family Name", f'Last{index:05d}'), ("First Name(s) in full", f'First{index:05d}'),
+        ("Preferred Name", f'Pref{index:05d}'), ("Home Address", f'{index} High Street'), ("Home Postcode", 'GU1 1AA'),
+        ("National Insurance Number", 'QQ123456C'), ("Home Tel No", '01483 000000'),
+        ("Mobile Number", '07700 900000'), ("Email Address", f'learner{index}@example.com'))]
+    return states + [date_input(user, "Date of Birth", date(1990, 5, 3))]
+
+
+def step_4(user, index, canvas_png):
+    return [text(user, label, value) for label, value in (
+        ("Emergency Contact Name", 'Alex Contact'), ("Emergency Contact Relationship", 'Friend'),
+        ("Emergency Contact Mobile Number", '07700 900001'), ("Emergency Contact Home Tel No", '01483 000001'))]
+
+
+def step_6(user, index, canvas_png):
+    return [text(user, label, value) for label, value in (
+        ("Name of Employer", 'Example Ltd'), ("Postcode", 'GU2 2BB'), ("Current Job Role", 'Assistant'))]
+
+
+def step_10(user, index, canvas_png):
+    return [checkbox(user, "By email", True), signature(user, canvas_png)]
+
+
+def no_input(user, index, canvas_png):
+    return []  # the defaults on this step are valid answers
+
+
+# (step, widget states to send, button that moves on, title of the page it leads to)
+STEPS = [
+    (1, step_1, "Next", "> 1: Learner Information"),
+    (2, step_2, "Next", "> 2: "),
+    (3, no_input, "Next", "> 3: "),
+    (4, step_4, "Next", "> 4: "),
+    (5, no_input, "Next", "> 5: "),
+    (6, step_6, "Next", "> 6: "),
+    (7, no_input, "Next", "> 7: "),
+    (8, no_input, "Next", "> 8: "),
+    (9, no_input, "Next", "> 9: "),  # supporting documents are optional
+    (10, step_10, "Submit", None),
+]
+
+
+class Results:
+    def __init__(self):
+        self.latencies = {}  # stage -> [seconds]
+        self.errors = {}  # stage -> [message]
+        self.completed = 0
+
+    def record(self, stage, elapsed):
+        self.latencies.setdefault(stage, []).append(elapsed)
+
+    def fail(self, stage, error):
+        self.errors.setdefault(stage, []).append(f'{type(error).__name__}: {error}')
+
+
+async def run_user(url, index, think, canvas_png, results):
+    user = VirtualUser(url)
+    stage = 'open'
+    try:
+        await user.connect()
+        elapsed = await user.rerun()
+        user.check()
+        results.record(stage, elapsed)
+        for step, inputs, label, next_title in STEPS:
+            stage = f'step {step}'
+            states = inputs(user, index, canvas_png)
+            if think:
+                await asyncio.sleep(random.uniform(0, 2 * think))
+            elapsed = await user.rerun(states + [button(user, label)])
+            user.check()
+            if next_title is not None and not user.title().startswith(next_title):
+                warnings = [alert.body for alert in user.elements('alert')]
+                raise WizardError(f'still on "{user.title()}": {warnings}')
+            results.record(stage, elapsed)
+        stage = 'result'
+        if not any(alert.body == RESULT_TEXT for alert in user.elements('alert')):
+            raise WizardError(f'no result page: {[alert.body for alert in user.elements("alert")]}')
+        results.completed += 1
+    except Exception as e:
+        results.fail(stage, e)
+    finally:
+        user.close()
+
+
+async def run_users(url, users, concurrency, think, ramp, canvas_png, results):
+    slots = asyncio.Semaphore(concurrency)
+
+    async def one(index):
+        await asyncio.sleep(ramp * index / users)
+        async with slots:
+            await run_user(url, index, think, canvas_png, results)
+
+    await asyncio.gather(*(one(index) for index in range(users)))
+
+
+def rss(pid):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+class RSSSampler(threading.Thread):
+    # Peak resident set size of the server process
+    def __init__(self, pid):
+        super().__init__(name='rss-sampler', daemon=True)
+        self.pid = pid
+        self.peak = rss(pid)
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(RSS_INTERVAL):
+            self.peak = max(self.peak, rss(self.pid))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(scratch):
+    # The app under `streamlit run`, on a free local port, with SMTP and all state in the scratch directory
+    stub = SMTPStub()
+    configure_environment(stub, scratch)
+    os.environ.update({
+        'sender_email': SENDER[0], 'sender_password': SENDER[1], 'METRICS_PORT': '',
+        'DRAFTS_DB': os.path.join(scratch, 'drafts.sqlite3'), 'JOBS_DB': os.path.join(scratch, 'jobs.sqlite3'),
+        'W5_SPOOL': os.path.join(scratch, 'w5_pending.jsonl'), 'LOG_LEVEL': os.environ.get('LOG_LEVEL', 'WARNING'),
+    })
+    port = free_port()
+    log = open(os.path.join(scratch, 'server.log'), 'w')
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'streamlit', 'run', APP_FILE, '--server.headless', 'true', '--server.port', str(port),
+         '--server.address', '127.0.0.1', '--browser.gatherUsageStats', 'false', '--server.fileWatcherType', 'none',
+         '--global.minCachedMessageSize', str(2 ** 40)],  # no cached message references: every element comes in full
+        cwd=ROOT, stdout=log, stderr=subprocess.STDOUT)
+    url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + START_TIMEOUT
+    while True:
+        try:
+            with urllib.request.urlopen(f'{url}/_stcore/health', timeout=1):
+                return server, stub, url
+        except OSError:
+            if server.poll() is not None or time.monotonic() > deadline:
+                server.kill()
+                raise RuntimeError(f'streamlit did not start, see {log.name}')
+            time.sleep(0.2)
+
+
+def percentile(values, fraction):
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method='inclusive')[round(fraction * 100) - 1]
+
+
+def canvas_data():
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.fromarray(synthetic_canvas(), 'RGBA').save(buffer, format='PNG')
+    return base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Drive the enrollment wizard end to end with concurrent virtual users')
+    parser.add_argument('-u', '--users', type=int, default=200, help='virtual users in total')
+    parser.add_argument('-c', '--concurrency', type=int, default=50, help='users connected at the same time')
+    parser.add_argument('--think', type=float, default=0.0, help='mean seconds a user spends on each step before moving on')
+    parser.add_argument('--ramp', type=float, default=0.0, help='seconds over which users start')
+    parser.add_argument('--url', help='test an already running app instead of starting one (its SMTP must be a sink!)')
+    parser.add_argument('--pid', type=int, help='with --url, the server process to report RSS for')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    server = stub = None
+    if args.url:
+        url, pid = args.url, args.pid
+    else:
+        scratch = tempfile.mkdtemp(prefix='load-wizard-')
+        server, stub, url = start_server(scratch)
+        pid = server.pid
+        print(f"Serving app.py at {url} (log: {os.path.join(scratch, 'server.log')})")
+
+    sampler = RSSSampler(pid) if pid else None
+    baseline_rss = sampler.peak if sampler else 0
+    if sampler:
+        sampler.start()
+    results = Results()
+    started = time.perf_counter()
+    try:
+        asyncio.run(run_users(url, args.users, args.concurrency, args.think, args.ramp, canvas_data(), results))
+    finally:
+        elapsed = time.perf_counter() - started
+        if sampler:
+            sampler.stopped.set()
+            sampler.join()
+        if server is not None:
+            server.terminate()
+            server.wait(30)
+
+    stages = ['open'] + [f'step {step}' for step, *_ in STEPS] + ['result']
+    report = {'users': args.users, 'concurrency': args.concurrency, 'think_seconds': args.think, 'seconds': elapsed,
+              'completed': results.completed, 'emails_received': stub.received if stub else None,
+              'peak_rss_bytes': sampler.peak if sampler else None, 'baseline_rss_bytes': baseline_rss, 'stages': {}}
+    print(f"{args.users} users, {args.concurrency} concurrent: {results.completed} completed in {elapsed:.1f}s")
+    print(f"{'stage':8s} {'runs':>6s} {'p50 ms':>9s} {'p95 ms':>9s} {'p99 ms':>9s} {'errors':>7s} {'error %':>8s}")
+    for stage in stages:
+        latencies = results.latencies.get(stage, [])
+        errors = results.errors.get(stage, [])
+        attempts = len(latencies) + len(errors)
+        if not attempts:
+            continue
+        row = {'runs': len(latencies), 'errors': len(errors), 'error_rate': len(errors) / attempts}
+        if latencies:
+            row.update({f'p{p}_ms': percentile(latencies, p / 100) * 1000 for p in (50, 95, 99)})
+        report['stages'][stage] = row
+        print(f"{stage:8s} {row['runs']:6d} {row.get('p50_ms', 0):9.1f} {row.get('p95_ms', 0):9.1f} "
+              f"{row.get('p99_ms', 0):9.1f} {row['errors']:7d} {100 * row['error_rate']:7.1f}%")
+    failed = args.users - results.completed
+    summary = f"error rate {100 * failed / args.users:.1f}% ({failed} users)"
+    if sampler:
+        summary += f", server peak RSS {sampler.peak / 2 ** 20:.0f} MiB (+{(sampler.peak - baseline_rss) / 2 ** 20:.0f} MiB)"
+    if stub:
+        summary += f", {stub.received} emails received"
+    print(summary)
+    for stage, errors in results.errors.items():
+        for message in sorted(set(errors))[:3]:
+            print(f"  {stage}: {message}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
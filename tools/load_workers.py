@@ -0,0 +1,124 @@
+# Load test for the multi-process submission backend (SUBMISSION_BACKEND=queue).
+#
+# Pushes a burst of real submissions (template, signature, both emails) through
+# submit_enrollment() and measures how many go all the way through - rendered, queued
+# and both emails delivered - per second:
+#
+#   threads     the default in-process backend, MAX_WORKERS threads sharing one GIL
+#   queue xN    the shared SQLite queue drained by N worker processes (worker.py)
+#
+# Worker processes are started and warmed up before the clock starts, so the numbers are
+# steady-state throughput, not interpreter start-up. Mail goes to the SMTP stub from
+# bench_render.py; nothing leaves the machine. The gain is bounded by the cores available.
+#
+#   python tools/load_workers.py [-n 200] [--processes 1 2 4]
+
+import argparse
+import tempfile
+import time
+import json
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_render import SMTPStub, configure_environment, learner, emails, synthetic_canvas, TEMPLATE_FILE, SENDER  # noqa: E402
+
+FINISH_TIMEOUT = 600
+
+
+def wait_finished(job_ids, get_job, timeout=FINISH_TIMEOUT):
+    deadline = time.monotonic() + timeout
+    pending = list(job_ids)
+    failed = 0
+    while pending:
+        if time.monotonic() > deadline:
+            raise TimeoutError(f'{len(pending)} of {len(job_ids)} submissions still unfinished')
+        job = get_job(pending[-1])
+        if job is not None and job.finished:
+            failed += job.status != 'done'
+            pending.pop()
+        else:
+            time.sleep(0.05)  # the app itself polls once a second
+    return failed
+
+
+def burst(stub, count, signature_png):
+    # Submit count enrollments at once; returns (seconds until every email arrived, failures)
+    from submissions import submit_enrollment, get_job, release_job, SIGNATURE_BUFFER
+    from placeholders import build_placeholder_values, document_file_name
+    from workspace import Workspace
+
+    expected = stub.received + 2 * count  # team email with the DOCX, plus the learner thank-you
+    records = [learner(index) for index in range(count)]
+    values = [build_placeholder_values(record) for record in records]
+    started = time.perf_counter()
+    job_ids = []
+    for index, record in enumerate(records):
+        workspace = Workspace()
+        workspace.buffer(SIGNATURE_BUFFER).write(signature_png)
+        job_ids.append(submit_enrollment(TEMPLATE_FILE, document_file_name(record), values[index], workspace, emails(index)))
+    failed = wait_finished(job_ids, get_job)
+    stub.wait_for(expected - 2 * failed, timeout=FINISH_TIMEOUT)
+    elapsed = time.perf_counter() - started
+    for job_id in job_ids:
+        release_job(job_id)
+    return elapsed, failed
+
+
+def run_threads(stub, count, signature_png):
+    import submissions
+    submissions.SUBMISSION_BACKEND = 'thread'
+    burst(stub, submissions.MAX_WORKERS, signature_png)  # warm-up: template cache, SMTP connection
+    return burst(stub, count, signature_png)
+
+
+def run_queue(stub, count, processes, signature_png):
+    import submissions
+    from worker import start_workers, stop_workers
+    submissions.SUBMISSION_BACKEND = 'queue'
+    workers, stop = start_workers(processes)
+    try:
+        burst(stub, 2 * processes, signature_png)  # warm-up: every worker imported and holding a compiled template
+        return burst(stub, count, signature_png)
+    finally:
+        stop_workers(workers, stop)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the multi-process submission backend')
+    parser.add_argument('-n', type=int, default=200, help='submissions per burst')
+    parser.add_argument('--processes', type=int, nargs='+', default=sorted({1, 2, os.cpu_count() or 1}),
+                        help='worker process counts to try (default: %(default)s)')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix='load-workers-')
+    stub = SMTPStub()
+    configure_environment(stub, scratch)
+    os.environ.update({'JOBS_DB': os.path.join(scratch, 'jobs.sqlite3'), 'SUBMISSION_BACKEND': 'queue',
+                       'sender_email': SENDER[0], 'sender_password': SENDER[1], 'LOG_LEVEL': os.environ.get('LOG_LEVEL', 'WARNING')})
+
+    from signature import process_signature
+    signature_png = process_signature(synthetic_canvas())
+
+    print(f"{args.n} submissions per burst, {os.cpu_count()} CPU(s)")
+    results = {}
+    elapsed, failed = run_threads(stub, args.n, signature_png)
+    results['threads'] = {'seconds': elapsed, 'per_second': args.n / elapsed, 'failed': failed}
+    for processes in args.processes:
+        elapsed, failed = run_queue(stub, args.n, processes, signature_png)
+        results[f'queue x{processes}'] = {'seconds': elapsed, 'per_second': args.n / elapsed, 'failed': failed}
+
+    baseline = results['threads']['per_second']
+    for name, result in results.items():
+        print(f"{name:12s} {result['seconds']:8.2f} s {result['per_second']:8.1f} submissions/s "
+              f"{result['per_second'] / baseline:6.2f}x  {result['failed']} failed")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'submissions': args.n, 'cpus': os.cpu_count(), 'results': results}, f, indent=2)
+    return 1 if any(result['failed'] for result in results.values()) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,98 @@
+# Concurrency stress check for the render path.
+#
+# Fires N submissions at replace_placeholders() at the same moment, each with its own
+# learner name and a signature that spells its index, then checks every output holds
+# exactly its own name and its own signature image.
+#
+#   python tools/stress_render.py [-n 50]
+
+import numpy as np
+import threading
+import argparse
+import zipfile
+import time
+import sys
+import io
+import os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from submissions import replace_placeholders, SIGNATURE_BUFFER  # noqa: E402
+from workspace import Workspace  # noqa: E402
+from signature import process_signature  # noqa: E402
+
+TEMPLATE_FILE = os.path.join(ROOT, 'ph_skills_bootcamp.docx')
+
+
+def make_signature(index):
+    # 400x150 transparent canvas like st_canvas: a baseline stroke plus blocks spelling the index in binary
+    canvas = np.zeros((150, 400, 4), dtype=np.uint8)
+    canvas[100:110, 40:360] = (0, 0, 0, 255)
+    for bit in range(12):
+        if index >> bit & 1:
+            canvas[40:95, 40 + bit * 26:60 + bit * 26] = (0, 0, 0, 255)
+    return canvas
+
+
+def embedded_signature(document):
+    with zipfile.ZipFile(io.BytesIO(document)) as zf:
+        media = sorted(name for name in zf.namelist() if name.startswith('word/media/'))
+        return zf.read(media[-1])
+
+
+def submit(index, barrier, results):
+    placeholder_values = {'ph1': f'First{index:05d}', 'ph2': f'Last{index:05d}', 'ph5': f'learner{index}@example.com'}
+    with Workspace() as workspace:
+        workspace.buffer(SIGNATURE_BUFFER).write(process_signature(make_signature(index)))
+        barrier.wait()  # release every submission at the same instant
+        results[index] = replace_placeholders(TEMPLATE_FILE, placeholder_values, workspace.getvalue(SIGNATURE_BUFFER))
+
+
+def check(index, document, signatures):
+    with zipfile.ZipFile(io.BytesIO(document)) as zf:
+        xml = zf.read('word/document.xml').decode('utf-8')
+    errors = []
+    if f'First{index:05d}' not in xml or f'Last{index:05d}' not in xml:
+        errors.append('own name missing')
+    strangers = [other for other in range(len(signatures)) if other != index and f'First{other:05d}' in xml]
+    if strangers:
+        errors.append(f'contains names of submissions {strangers[:5]}')
+    if embedded_signature(document) != signatures[index]:
+        errors.append('signature image does not match')
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', type=int, default=50, help='number of simultaneous submissions')
+    args = parser.parse_args()
+
+    # One thread per submission; the main thread joins the barrier so timing starts when all are released
+    barrier = threading.Barrier(args.n + 1)
+    results = [b''] * args.n
+    threads = [threading.Thread(target=submit, args=(index, barrier, results)) for index in range(args.n)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    signatures = [process_signature(make_signature(index)) for index in range(args.n)]
+    failures = 0
+    for index, document in enumerate(results):
+        try:
+            errors = check(index, document, signatures)
+        except Exception as e:
+            errors = [f'unreadable document: {e}']
+        if errors:
+            failures += 1
+            print(f"submission {index}: {'; '.join(errors)}")
+    print(f"{args.n} submissions in {elapsed:.2f}s, {failures} failure(s)")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,154 @@
+from PIL import Image as PILImage, ImageOps
+from mime import Attachment, sniff_content_type, CHUNK_SIZE, SNIFF_SIZE
+from workspace import Workspace
+from telemetry import get_logger
+import mimetypes
+import shutil
+import os
+
+# Supporting documents uploaded by the learner (ID, proof of address, evidence)
+#
+# st.file_uploader hands each file to the script as an in-memory UploadedFile. As soon as
+# one arrives it is copied in CHUNK_SIZE pieces into the session's UploadSpool - a private
+# Workspace directory - and the app drops Streamlit's copy, so session memory never holds
+# more than the file currently being uploaded. Files are checked by their sniffed content
+# type (not their extension) and size. Photos, typically phone pictures of ID documents,
+# are downscaled to PHOTO_MAX_SIDE and re-encoded as JPEG when that makes them smaller.
+#
+# On submission hand_over() moves the files into the submission's own workspace, and the
+# team email attaches them from there: nothing is read back into memory on the way.
+
+UPLOAD_MAX_BYTES = int(os.environ.get('UPLOAD_MAX_BYTES', str(10 * 1024 * 1024)))  # per file, as uploaded
+UPLOAD_MAX_FILES = int(os.environ.get('UPLOAD_MAX_FILES', '6'))
+UPLOAD_TOTAL_BYTES = int(os.environ.get('UPLOAD_TOTAL_BYTES', str(15 * 1024 * 1024)))  # leaves room under mime.EMAIL_MAX_BYTES for the form
+PHOTO_MAX_SIDE = 2000  # pixels; still sharp enough to read an ID document
+PHOTO_QUALITY = 85
+
+# Accepted content types, with the extension a stored file gets
+ALLOWED_TYPES = {
+    'application/pdf': '.pdf',
+    'image/jpeg': '.jpg',
+    'image/png': '.png',
+    'image/webp': '.webp',
+    'image/heic': '.heic',
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document': '.docx',
+    'application/msword': '.doc',
+}
+PHOTO_TYPES = ('image/jpeg', 'image/png', 'image/webp', 'image/heic')
+# For st.file_uploader's type filter in the browser; the server still sniffs every file
+UPLOAD_EXTENSIONS = ['pdf', 'jpg', 'jpeg', 'png', 'webp', 'heic', 'docx', 'doc']
+UPLOAD_ERRORS_KEY = '_upload_errors'  # session key: refusals to show once the uploader has been reset
+
+logger = get_logger('uploads')
+
+
+class UploadError(ValueError):
+    # A file that was refused; the message is shown to the learner
+    pass
+
+
+def _size(uploaded_file):
+    size = getattr(uploaded_file, 'size', None)
+    return size if size is not None else uploaded_file.seek(0, os.SEEK_END)
+
+
+def shrink_photo(path, max_side=PHOTO_MAX_SIDE, quality=PHOTO_QUALITY):
+    # Returns the path of a smaller JPEG next to path, or None if the photo can't be read or wouldn't shrink
+    target = os.path.splitext(path)[0] + '.shrunk.jpg'
+    try:
+        with PILImage.open(path) as image:
+            if image.format == 'JPEG':
+                image.draft('RGB', (max_side, max_side))  # let the decoder scale down by 1/2..1/8 instead of decoding full size
+            image = ImageOps.exif_transpose(image)  # phones store the rotation in EXIF; JPEG re-encoding would lose it
+            image.thumbnail((max_side, max_side), PILImage.LANCZOS)
+            if image.mode in ('RGBA', 'LA', 'P'):
+                image = image.convert('RGBA')
+                background = PILImage.new('RGB', image.size, 'white')
+                background.paste(image, mask=image.getchannel('A'))
+                image = background
+            elif image.mode != 'RGB':
+                image = image.convert('RGB')
+            image.save(target, 'JPEG', quality=quality, optimize=True)
+    except (OSError, ValueError, PILImage.DecompressionBombError) as e:
+        # HEIC needs a Pillow plugin that isn't installed; such photos are sent as uploaded
+        logger.info('Photo %s left as uploaded: %s', os.path.basename(path), e)
+        return None
+    if os.path.getsize(target) >= os.path.getsize(path):
+        os.remove(target)
+        return None
+    return target
+
+
+class UploadSpool:
+    # A session's uploaded files on disk, as mime.Attachment objects; kept in st.session_state.files
+    def __init__(self):
+        self.workspace = Workspace('uploads')
+        self.files = []
+        self.generation = 0  # bumped on every change, so the app can give the uploader a fresh (empty) key
+        self._counter = 0
+
+    @property
+    def total_bytes(self):
+        return sum(attachment.size for attachment in self.files)
+
+    def add(self, uploaded_file):
+        # Spool, check and (for photos) shrink one upload; raises UploadError if it is refused
+        self.generation += 1
+        name = os.path.basename(uploaded_file.name.replace('\\', '/')) or 'upload'
+        size = _size(uploaded_file)
+        if len(self.files) >= UPLOAD_MAX_FILES:
+            raise UploadError(f'{name}: you can upload at most {UPLOAD_MAX_FILES} files.')
+        if size > UPLOAD_MAX_BYTES:
+            raise UploadError(f'{name} is larger than {UPLOAD_MAX_BYTES // (1024 * 1024)} MB.')
+        if size == 0:
+            raise UploadError(f'{name} is empty.')
+
+        uploaded_file.seek(0)
+        head = uploaded_file.read(SNIFF_SIZE)
+        uploaded_file.seek(0)
+        content_type = sniff_content_type(head, name, uploaded_file)
+        if content_type not in ALLOWED_TYPES:
+            raise UploadError(f'{name} is not a PDF, Word document or photo.')
+
+        self._counter += 1
+        stem = os.path.splitext(name)[0]
+        if mimetypes.guess_type(name)[0] != content_type:
+            name = stem + ALLOWED_TYPES[content_type]  # e.g. a JPEG saved as .png
+        path = self.workspace.path(f'{self._counter}-{stem}{ALLOWED_TYPES[content_type]}')
+        uploaded_file.seek(0)
+        with open(path, 'wb') as f:
+            shutil.copyfileobj(uploaded_file, f, CHUNK_SIZE)
+
+        if content_type in PHOTO_TYPES:
+            shrunk = shrink_photo(path)
+            if shrunk is not None:
+                logger.debug('Photo %s: %d -> %d bytes', name, size, os.path.getsize(shrunk))
+                os.remove(path)
+                path, content_type, name = shrunk, 'image/jpeg', f'{stem}.jpg'
+
+        attachment = Attachment(name, path, content_type)
+        if self.total_bytes + attachment.size > UPLOAD_TOTAL_BYTES:
+            os.remove(path)
+            raise UploadError(f'{name}: all files together must stay under {UPLOAD_TOTAL_BYTES // (1024 * 1024)} MB.')
+        self.files.append(attachment)
+        return attachment
+
+    def remove(self, index):
+        attachment = self.files.pop(index)
+        os.remove(attachment.data)
+        self.generation += 1
+
+    def hand_over(self, workspace):
+        # Move the files into a submission's workspace (a rename, same filesystem) and return them as attachments
+        files = []
+        for attachment in self.files:
+            path = workspace.path(os.path.basename(attachment.data))
+            os.replace(attachment.data, path)
+            files.append(Attachment(attachment.file_name, path, attachment.content_type))
+        self.files = []
+        self.generation += 1
+        return files
+
+    def close(self):
+        self.files = []
+        self.workspace.close()
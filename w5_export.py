@@ -0,0 +1,356 @@
+from datetime import date, datetime
+from xml.sax.saxutils import escape
+from assets import copy_zip_info, replace_file
+import threading
+import struct
+import zipfile
+import shutil
+import copy
+import json
+import time
+import os
+import re
+
+# Export of enrollments into the funder's W5 grant-recipient workbook
+#
+# Each submission is mapped from the same session fields the DOCX is filled from onto one
+# learner row of "2. Applicant Information" (the "3. Course Participants" tab picks names
+# and NI numbers up from there by formula). The workbook is never loaded into an object
+# model: the applicant sheet is streamed through row by row, the first empty rows of the
+# pre-formatted table get the new learners' cells, and every other member is copied
+# across byte for byte, still compressed. Memory stays flat however large the sheets get,
+# and appending one learner costs one pass over the applicant sheet, not the workbook.
+#
+# The app appends every accepted submission to W5_SPOOL; staff export it in one go:
+#
+#   python w5_export.py                              spool -> W5 workbook, in place
+#   python w5_export.py learners.csv -o W5_week.xlsx  same columns render_batch.py reads
+
+W5_WORKBOOK = os.environ.get('W5_WORKBOOK', 'W5_GRANT RECIPIENT NAME_PROVIDER_SKILLS BOOTCAMP  NAME_DDMMYY.xlsx')
+W5_SPOOL = os.environ.get('W5_SPOOL', 'w5_pending.jsonl')
+APPLICANT_SHEET = '2. Applicant Information'
+WORKBOOK_PART = 'xl/workbook.xml'
+CHUNK_SIZE = 1 << 20
+SHEET_COMPRESSLEVEL = 1  # the sheet is re-deflated on every export: 4x faster than level 6 for ~30% more bytes
+
+# Session fields the W5 row is built from; this is what gets spooled per submission
+W5_FIELDS = (
+    'first_name', 'sir_name', 'ni_number', 'postcode', 'email', 'mobile_number', 'home_number', 'dob', 'gender',
+    'ethnicity_vars', 'caring_children', 'ph63', 'ph64', 'ph65', 'ph66', 'ph67', 'ph68', 'ph69', 'ph70', 'ph71',
+    'ph72', 'ph73', 'ph74', 'ph75', 'ph76', 'ph77', 'ph78', 'ph79a', 'ph79b', 'ph79c', 'ph79d', 'ph80', 'ph81',
+    'ph82', 'ph83', 'ph84', 'ph85', 'ph86', 'ph87', 'ph88', 'ph89', 'ph90', 'ph91', 'ph92', 'ph93', 'ph94', 'ph95',
+    'ph96', 'ph97y', 'ph97n', 'ph98', 'ph99', 'ph100', 'ph101', 'ph112', 'ph113', 'ph114', 'ph115', 'ph116',
+    'ph117', 'ph118', 'ph119', 'ph120', 'ph121', 'ph122', 'ph123', 'ph136', 'ph147', 'ph148', 'ph149', 'ph150',
+    'ph151', 'ph152', 'ph153', 'ph155',
+)
+
+# Answers are written exactly as the workbook's drop-down lists (Annex tab) spell them, trailing spaces included
+EDUCATION_LEVELS = {
+    'ph63': 'entry level', 'ph64': 'entry level', 'ph65': 'level 1', 'ph66': 'level 2', 'ph67': 'level 3',
+    'ph68': 'level 4', 'ph69': 'level 5', 'ph70': 'level 6', 'ph71': 'level 7', 'ph73': 'no record of attainment',
+}
+EMPLOYMENT_STATUS = {
+    'ph75': 'In part-time employment ', 'ph76': 'In part-time employment ', 'ph77': 'In part-time employment ',
+    'ph78': 'In full-time employment ', 'ph79a': 'Self-employed', 'ph79b': 'Self-employed',
+    'ph79c': 'Self-employed', 'ph79d': 'Self-employed', 'ph82': 'In training/education ',
+}
+WORK_ALONGSIDE = {
+    'ph98': 'yes - full-time employment', 'ph99': 'yes - part-time employment', 'ph100': 'yes - self-employed',
+    'ph101': 'no',
+}
+# Only the form's sectors with an unambiguous SIC section; the rest are left for staff to pick
+INDUSTRIES = {
+    'ph112': 'Agriculture, Forestry and Fishing', 'ph113': 'Wholesale and retail trade; repair of motor vehicles and motorcycles',
+    'ph115': 'Financial and insurance activities', 'ph116': 'Electricity, gas, steam and air conditioning supply',
+    'ph117': 'Transportation and storage', 'ph118': 'Construction', 'ph119': 'Manufacturing ',
+    'ph120': 'Other service activities',
+}
+HEAR_ABOUT = {
+    'ph147': 'Current employer', 'ph148': 'Job Centre Plus / Work Coach / DWP', 'ph149': 'Social Media',
+    'ph150': 'Newspaper/magazine article ', 'ph151': 'Other', 'ph152': 'Family, friend or colleague', 'ph153': 'Other',
+}
+DISABILITY = {'ph122': 'Yes', 'ph123': 'Yes', 'ph121': 'No ', 'ph136': 'Prefer not to say'}
+# ethnicity_vars code -> W5 ethnic group
+ETHNIC_GROUPS = [
+    (range(31, 32), 'White British'), (range(32, 35), 'All other white'), (range(35, 39), 'Mixed / multiple ethnic groups'),
+    (range(39, 44), 'Asian / Asian British'), (range(44, 47), 'Black / African / Caribbean / Black British'),
+    (range(47, 49), 'Other ethnic group'),
+]
+
+_EXCEL_EPOCH = date(1899, 12, 30)
+_INVALID_XML = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f]')
+_ROW = re.compile(rb'<row\b[^>]*?(?:/>|>.*?</row>)', re.S)
+_CELL = re.compile(rb'<c r="([A-Z]+)\d+"([^>]*?)(?:/>|>(.*?)</c>)', re.S)
+_STYLE = re.compile(rb'\ss="\d+"')
+_spool_lock = threading.Lock()
+
+
+def excel_date(value):
+    return (value - _EXCEL_EPOCH).days
+
+
+def column_number(letters):
+    number = 0
+    for letter in letters:
+        number = number * 26 + ord(letter) - 64
+    return number
+
+
+def _is_ticked(state, key):
+    return getattr(state, key, '') in ('X', 'x')
+
+
+def _ticked(state, options):
+    # The label of the first ticked option, or '' when none is
+    return next((label for key, label in options.items() if _is_ticked(state, key)), '')
+
+
+def _ethnic_group(state):
+    for key, value in (getattr(state, 'ethnicity_vars', None) or {}).items():
+        if value in ('X', 'x'):
+            code = int(key.rsplit('_', 1)[1])
+            return next((group for codes, group in ETHNIC_GROUPS if code in codes), '')
+    return ''
+
+
+def _employment_status(state):
+    status = _ticked(state, EMPLOYMENT_STATUS)
+    if status:
+        return status
+    if _is_ticked(state, 'ph80') or _is_ticked(state, 'ph81'):
+        if any(_is_ticked(state, key) for key in ('ph83', 'ph84')):
+            return 'Unemployed - less than 12 months'
+        if any(_is_ticked(state, key) for key in ('ph85', 'ph86', 'ph87')):
+            return 'Unemployed - 12 months or more'
+    return ''
+
+
+def _telephone(state):
+    # The column only takes whole numbers; the funder assumes the leading 0
+    digits = re.sub(r'\D', '', str(state.mobile_number or state.home_number))
+    return int(digits) if digits.strip('0') else ''
+
+
+# One learner's W5 applicant row: column letter -> value (str, number or date)
+def w5_row(state, submitted=None):
+    employed = state.ph93 or any(_is_ticked(state, key) for key in ('ph75', 'ph76', 'ph77', 'ph78'))
+    unemployed = _employment_status(state).startswith('Unemployed')
+    hourly_rate = float(state.ph96 or 0)
+    row = {
+        'B': state.first_name,
+        'C': state.sir_name,
+        'D': re.sub(r'\s', '', str(state.ni_number)).upper(),
+        'F': str(state.postcode).strip().upper(),
+        'G': state.email,
+        'H': _telephone(state),
+        'I': _ticked(state, EDUCATION_LEVELS),
+        'K': submitted or date.today(),
+        'L': _employment_status(state),
+        'M': state.ph93,
+        'N': str(state.ph94).strip().upper(),
+        'O': 'No (Individual)' if _is_ticked(state, 'ph97n') else '',  # "Yes" needs the employer's SME status
+        'Q': hourly_rate if hourly_rate else 0 if unemployed else '',
+        'R': 'Hourly' if hourly_rate else 'N/A - unemployed' if unemployed else '',
+        'S': _ticked(state, WORK_ALONGSIDE) if employed else '',
+        'T': state.ph95,
+        'U': _ticked(state, INDUSTRIES),
+        'V': 'Yes' if _is_ticked(state, 'ph90') else 'No' if any(_is_ticked(state, f'ph{i}') for i in range(88, 93)) else '',
+        'W': state.caring_children if state.caring_children in ('Yes', 'No') else '',
+        'X': state.dob,
+        'Y': state.gender,
+        'Z': _ticked(state, DISABILITY),
+        'AA': _ethnic_group(state),
+        'AB': 'Yes confirmed all materials received',  # privacy notice and complaints procedure are part of the declaration
+        'AC': 'No - learner consents to contact' if _is_ticked(state, 'ph155') else 'Yes - opted out',
+        'AD': _ticked(state, HEAR_ABOUT),
+    }
+    return {column: value for column, value in row.items() if value != '' and value is not None}
+
+
+def _cell_xml(ref, attrs, value):
+    style = _STYLE.search(attrs)
+    style = style.group().decode() if style else ''
+    if isinstance(value, (date, datetime)):
+        return f'<c r="{ref}"{style}><v>{excel_date(value)}</v></c>'
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return f'<c r="{ref}"{style}><v>{value}</v></c>'
+    text = escape(_INVALID_XML.sub('', str(value)))
+    return f'<c r="{ref}"{style} t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def _fill_row(row_xml, values):
+    # Returns the row with `values` written in, or None if the row is not an empty learner row
+    head_end = row_xml.find(b'>') + 1
+    if row_xml[head_end - 2:head_end] == b'/>':
+        return None
+    number = re.search(rb'\sr="(\d+)"', row_xml[:head_end]).group(1).decode()
+    if number == '1':
+        return None
+    cells = {match.group(1).decode(): match for match in _CELL.finditer(row_xml)}
+    if not cells:
+        return None
+    for column in values:
+        cell = cells.get(column)
+        if cell is not None and cell.group(3) and re.search(rb'<(?:v|is|f)\b', cell.group(3)):
+            return None
+
+    out = {column: match.group().decode('utf-8') for column, match in cells.items()}
+    for column, value in values.items():
+        cell = cells.get(column)
+        out[column] = _cell_xml(f'{column}{number}', cell.group(2) if cell is not None else b'', value)
+    body = ''.join(out[column] for column in sorted(out, key=column_number))
+    return row_xml[:head_end] + body.encode('utf-8') + b'</row>'
+
+
+def _fill_sheet(source, target, pending):
+    # Stream the worksheet across, filling empty learner rows until `pending` runs out; returns rows filled.
+    # Once the last row is placed the rest of the sheet is copied without looking at it.
+    values = next(pending, None)
+    written = 0
+    buffer = b''
+    while values is not None:
+        chunk = source.read(CHUNK_SIZE)
+        buffer += chunk
+        done = scanned = 0
+        for match in _ROW.finditer(buffer):
+            scanned = match.end()
+            filled = _fill_row(match.group(), values)
+            if filled is None:
+                continue
+            target.write(buffer[done:match.start()])
+            target.write(filled)
+            done = match.end()
+            written += 1
+            values = next(pending, None)
+            if values is None:
+                break
+        target.write(buffer[done:scanned])
+        buffer = buffer[scanned:]  # a row cut off at the chunk boundary waits for the next chunk
+        if not chunk:
+            break
+    target.write(buffer)
+    shutil.copyfileobj(source, target, CHUNK_SIZE)
+    return written
+
+
+def _sheet_part(zf, sheet_name):
+    workbook = zf.read(WORKBOOK_PART).decode('utf-8')
+    sheet = re.search(rf'<sheet [^>]*name="{re.escape(escape(sheet_name))}"[^>]*r:id="([^"]+)"', workbook)
+    if sheet is None:
+        raise ValueError(f"Sheet '{sheet_name}' not found in workbook")
+    rels = zf.read('xl/_rels/workbook.xml.rels').decode('utf-8')
+    target = re.search(rf'<Relationship [^>]*Id="{sheet.group(1)}"[^>]*Target="([^"]+)"', rels) or \
+        re.search(rf'<Relationship [^>]*Target="([^"]+)"[^>]*Id="{sheet.group(1)}"', rels)
+    return 'xl/' + target.group(1).lstrip('/').replace('xl/', '', 1)
+
+
+def _copy_raw(zin, zout, info):
+    # Copy a member's compressed bytes untouched - no inflate/deflate. zipfile has no public call for
+    # this, so the entry is written and registered the same way ZipFile.writestr() does it.
+    zin.fp.seek(info.header_offset)
+    header = zin.fp.read(zipfile.sizeFileHeader)
+    name_length, extra_length = struct.unpack('<HH', header[26:30])
+    zin.fp.seek(info.header_offset + zipfile.sizeFileHeader + name_length + extra_length)
+
+    member = copy.copy(info)
+    member.flag_bits &= ~0x08  # sizes and CRC are known, so they go in the local header
+    member.header_offset = zout.fp.tell()
+    zout.fp.write(member.FileHeader())
+    remaining = info.compress_size
+    while remaining:
+        data = zin.fp.read(min(CHUNK_SIZE, remaining))
+        if not data:
+            raise zipfile.BadZipFile(f"Truncated member {info.filename}")
+        zout.fp.write(data)
+        remaining -= len(data)
+    zout.filelist.append(member)
+    zout.NameToInfo[member.filename] = member
+    zout.start_dir = zout.fp.tell()
+
+
+# Write rows (dicts from w5_row) into the first empty applicant rows; returns how many were written.
+# The new workbook replaces output_file (default: the workbook itself) only once it is complete.
+def export_rows(rows, workbook_file=W5_WORKBOOK, output_file=None):
+    rows = list(rows)
+    output_file = output_file or workbook_file
+    with replace_file(output_file, mode_source=workbook_file) as temp_file:
+        with zipfile.ZipFile(workbook_file) as zin, \
+                zipfile.ZipFile(temp_file, 'w', zipfile.ZIP_DEFLATED, compresslevel=SHEET_COMPRESSLEVEL) as zout:
+            sheet_part = _sheet_part(zin, APPLICANT_SHEET)
+            pending = iter(rows)
+            written = 0
+            # Only the applicant sheet (and workbook.xml, the first time) is regenerated; every other
+            # member - the other sheets, comments, drawings and tables - is copied still compressed
+            for info in zin.infolist():
+                if info.filename == sheet_part:
+                    with zin.open(info) as source, zout.open(info.filename, 'w', force_zip64=True) as target:
+                        written = _fill_sheet(source, target, pending)
+                elif info.filename == WORKBOOK_PART and b'fullCalcOnLoad' not in zin.read(info):
+                    # Formulas that read the new cells (NI check, participant names) recalculate on open
+                    workbook = zin.read(info).replace(b'<calcPr ', b'<calcPr fullCalcOnLoad="1" ', 1)
+                    zout.writestr(copy_zip_info(info), workbook)
+                else:
+                    _copy_raw(zin, zout, info)
+        if written < len(rows):
+            raise ValueError(f"W5 applicant sheet is full: {len(rows) - written} of {len(rows)} row(s) did not fit")
+    return written
+
+
+# Remember an accepted submission for the next W5 export
+def spool_submission(state, spool_file=None):
+    record = {field: state.get(field, '') for field in W5_FIELDS}
+    record['dob'] = record['dob'].isoformat() if hasattr(record['dob'], 'isoformat') else record['dob']
+    record['submission_date'] = date.today().isoformat()
+    line = json.dumps(record, ensure_ascii=False) + '\n'
+    with _spool_lock, open(spool_file or W5_SPOOL, 'a', encoding='utf-8') as f:
+        f.write(line)
+
+
+def export_records(input_file, workbook_file=W5_WORKBOOK, output_file=None):
+    # Records in the render_batch.py format (CSV or JSONL) -> W5 rows
+    from render_batch import read_records, learner_record, parse_date
+    rows = []
+    for source, raw, error in read_records(input_file):
+        if error is not None:
+            raise ValueError(f"{input_file} {source}: {error}")
+        record = learner_record(raw)
+        submitted = parse_date(str(record.submission_date)) if record.submission_date else None
+        rows.append(w5_row(record, submitted))
+    return export_rows(rows, workbook_file, output_file)
+
+
+def export_spool(workbook_file=W5_WORKBOOK, output_file=None, spool_file=None):
+    # Take the spool out of the way first so submissions arriving during the export go to a new one
+    spool_file = spool_file or W5_SPOOL
+    if not os.path.exists(spool_file):
+        return 0
+    exporting = f'{spool_file}.{int(time.time())}.exporting'
+    os.replace(spool_file, exporting)
+    try:
+        written = export_records(exporting, workbook_file, output_file)
+    except Exception:
+        # Put the records back in front of anything spooled meanwhile
+        with _spool_lock:
+            if os.path.exists(spool_file):
+                with open(spool_file, 'rb') as newer, open(exporting, 'ab') as f:
+                    shutil.copyfileobj(newer, f)
+            os.replace(exporting, spool_file)
+        raise
+    os.remove(exporting)
+    return written
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Append enrollments to the W5 grant-recipient workbook')
+    parser.add_argument('input', nargs='?', help=f'learner records (.csv or .jsonl); default: the spool ({W5_SPOOL})')
+    parser.add_argument('-w', '--workbook', default=W5_WORKBOOK, help='W5 workbook to append to')
+    parser.add_argument('-o', '--output', help='write the result here instead of updating the workbook in place')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    if args.input:
+        written = export_records(args.input, args.workbook, args.output)
+    else:
+        written = export_spool(args.workbook, args.output)
+    print(f"Wrote {written} learner row(s) to {args.output or args.workbook} in {time.perf_counter() - started:.2f}s")
@@ -0,0 +1,98 @@
+from multiprocessing import get_context
+from assets import get_secret
+from telemetry import get_logger, configure_logging
+import argparse
+import signal
+import socket
+import time
+import sys
+import os
+
+# Submission worker processes for SUBMISSION_BACKEND=queue
+#
+# Each process claims jobs from the shared queue (job_queue.py), renders the document and
+# queues the emails in the outbox, then writes the result back for the Streamlit process
+# that polls it. Run one pool per host, next to any number of Streamlit processes:
+#
+#   SUBMISSION_BACKEND=queue streamlit run app.py --server.port 8501 &
+#   SUBMISSION_BACKEND=queue streamlit run app.py --server.port 8502 &
+#   python worker.py -n 4
+#
+# A load balancer in front of the Streamlit ports only has to keep each websocket on one
+# process; a reconnect elsewhere finds its draft (?resume=) in the shared drafts database, and
+# once the form is submitted that draft holds the job id, which it polls in the shared queue.
+
+POLL_INTERVAL = 0.05  # seconds an idle worker waits before looking at the queue again
+
+logger = get_logger('worker')
+
+
+def run_worker(index, stop=None):
+    # Loop until stop (a multiprocessing Event) is set; jobs in flight are finished first
+    configure_logging()
+    from submissions import process_queued_job
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the parent handles Ctrl-C and sets stop
+    worker_name = f'{socket.gethostname()}:{os.getpid()}'
+    sender_password = get_secret('sender_password')
+    logger.info('Submission worker %d started as %s', index, worker_name)
+    while stop is None or not stop.is_set():
+        try:
+            if process_queued_job(worker_name, sender_password):
+                continue
+        except Exception:
+            logger.exception('Submission worker error')
+        if stop is None:
+            time.sleep(POLL_INTERVAL)
+        else:
+            stop.wait(POLL_INTERVAL)
+
+
+def start_workers(processes):
+    # Returns (processes, stop event); spawned, so no Streamlit or SQLite state is inherited
+    context = get_context('spawn')
+    stop = context.Event()
+    workers = [context.Process(target=run_worker, args=(index, stop), name=f'submission-worker-{index}', daemon=True)
+               for index in range(processes)]
+    for process in workers:
+        process.start()
+    return workers, stop
+
+
+def stop_workers(workers, stop, timeout=30):
+    stop.set()
+    for process in workers:
+        process.join(timeout)
+        if process.is_alive():
+            process.terminate()
+
+
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run submission worker processes for SUBMISSION_BACKEND=queue')
+    parser.add_argument('-n', '--processes', type=int, default=os.cpu_count() or 1, help='worker processes (default: %(default)s)')
+    args = parser.parse_args()
+
+    configure_logging()
+    workers, stop = start_workers(args.processes)
+    signal.signal(signal.SIGTERM, _interrupt)  # not stop.set(): that could deadlock against stop.wait() below
+    try:
+        while not stop.is_set():
+            for index, process in enumerate(workers):
+                if not process.is_alive():
+                    # A job that crashed its worker is retried by another one after job_queue.CLAIM_TIMEOUT
+                    logger.error('Submission worker %d exited with %s, restarting it', index, process.exitcode)
+                    workers[index] = process = type(process)(target=run_worker, args=(index, stop), name=process.name,
+                                                             daemon=True)
+                    process.start()
+            stop.wait(1)
+    except KeyboardInterrupt:
+        pass
+    stop_workers(workers, stop)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
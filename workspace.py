@@ -0,0 +1,89 @@
+import tempfile
+import threading
+import weakref
+import shutil
+import uuid
+import time
+import io
+import os
+
+# Per-submission workspace
+#
+# Every submission gets its own namespace of in-memory buffers (signature, rendered
+# document, ...) and, only if something has to touch disk, its own private directory
+# under WORKSPACE_ROOT. Nothing is shared between sessions, so two learners submitting
+# at the same moment can never read each other's files. close() - or garbage
+# collection, or the stale sweep on startup - removes everything.
+
+WORKSPACE_ROOT = os.environ.get('WORKSPACE_ROOT', os.path.join(tempfile.gettempdir(), 'skills-bootcamp'))
+WORKSPACE_TTL = 24 * 3600  # directories older than this are left over from a crashed process
+
+
+def _remove_dir(path):
+    if path:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+class Workspace:
+    def __init__(self, prefix='submission'):
+        self.workspace_id = f'{prefix}-{uuid.uuid4().hex}'
+        self._buffers = {}
+        self._dir = None
+        self._lock = threading.Lock()
+        self._finalizer = weakref.finalize(self, _remove_dir, None)
+
+    def buffer(self, name):
+        # Named in-memory file, created on first use
+        with self._lock:
+            if name not in self._buffers:
+                self._buffers[name] = io.BytesIO()
+            return self._buffers[name]
+
+    def getvalue(self, name, default=b''):
+        with self._lock:
+            buffer = self._buffers.get(name)
+        return buffer.getvalue() if buffer is not None else default
+
+    def path(self, name):
+        # Private on-disk location for the rare step that needs a real file
+        with self._lock:
+            if self._dir is None:
+                os.makedirs(WORKSPACE_ROOT, exist_ok=True)
+                self._dir = tempfile.mkdtemp(prefix=f'{self.workspace_id}-', dir=WORKSPACE_ROOT)
+                self._finalizer.detach()
+                self._finalizer = weakref.finalize(self, _remove_dir, self._dir)
+        return os.path.join(self._dir, os.path.basename(name))
+
+    def detach(self):
+        # Hand the on-disk directory to someone else (a worker process): close() and GC no longer remove it
+        with self._lock:
+            path, self._dir = self._dir, None
+        self._finalizer.detach()
+        return path
+
+    def close(self):
+        with self._lock:
+            for buffer in self._buffers.values():
+                buffer.close()
+            self._buffers.clear()
+            self._dir = None
+        self._finalizer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+# Remove workspace directories left behind by a previous process
+def sweep_stale_workspaces(max_age=WORKSPACE_TTL):
+    if not os.path.isdir(WORKSPACE_ROOT):
+        return 0
+    cutoff = time.time() - max_age
+    removed = 0
+    for entry in os.scandir(WORKSPACE_ROOT):
+        if entry.is_dir() and entry.stat().st_mtime < cutoff:
+            _remove_dir(entry.path)
+            removed += 1
+    return removed